@@ -3,10 +3,12 @@ import numpy as np
 import threading
 import queue
 
-from .logger import logger
+from .logger import get_logger
 from . import names
 from .mixer import StreamContextView
 
+logger = get_logger('analysis')
+
 def pitch_tracker(bus, read_q, response_q, shutdown_signal):
     pass
     """
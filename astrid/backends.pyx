@@ -0,0 +1,186 @@
+#cython: language_level=3
+
+import threading
+import time
+import wave
+
+import numpy as np
+
+from .defaults import DEFAULT_BLOCKSIZE, DEFAULT_CHANNELS, DEFAULT_SAMPLERATE
+from .logger import get_logger
+
+logger = get_logger('backends')
+
+class CallbackExit(Exception):
+    """ Raise from the process callback to stop audio
+    """
+
+class JackBackend:
+    """ Runs the process callback from the JACK server and
+        connects to the physical capture and playback ports.
+    """
+    def __init__(self, name='astrid'):
+        import jack
+        self.jack = jack
+        self.client = jack.Client(name)
+        self.samplerate = self.client.samplerate
+        self.blocksize = self.client.blocksize
+        self.channels = len(self.client.get_ports(is_physical=True, is_input=True)) or DEFAULT_CHANNELS
+        self.inports = self.client.inports
+        self.outports = self.client.outports
+
+        for channel in range(self.channels):
+            self.inports.register('input_{0}'.format(channel))
+            self.outports.register('output_{0}'.format(channel))
+
+    @property
+    def last_frame_time(self):
+        return self.client.last_frame_time
+
+    def set_process_callback(self, callback):
+        def process(frames):
+            try:
+                callback(frames)
+            except CallbackExit:
+                raise self.jack.CallbackExit
+
+        self.client.set_process_callback(process)
+
+    def set_blocksize_callback(self, callback):
+        self.client.set_blocksize_callback(callback)
+
+    def set_xrun_callback(self, callback):
+        self.client.set_xrun_callback(callback)
+
+    def activate(self):
+        self.client.activate()
+        capture = self.client.get_ports(is_physical=True, is_output=True)
+        if not capture:
+            raise RuntimeError('No physical capture ports')
+
+        for src, dest in zip(capture, self.inports):
+            self.client.connect(src, dest)
+
+        playback = self.client.get_ports(is_physical=True, is_input=True)
+        if not playback:
+            raise RuntimeError('No physical playback ports')
+
+        # FIXME -- add interface to zmq cmds for adding and removing synth/voice ports,
+        # which default to connecting to the master outputs... how to handle runtime
+        # choice of output port from instrument scripts?
+        for src, dest in zip(self.outports, playback):
+            self.client.connect(src, dest)
+
+    def deactivate(self):
+        self.client.deactivate()
+
+    def close(self):
+        self.client.close()
+
+class DummyPort:
+    """ Stands in for a JACK port: one block of float samples
+    """
+    def __init__(self, blocksize):
+        self.array = np.zeros(blocksize, dtype='f')
+
+    def get_array(self):
+        return self.array
+
+class DummyBackend:
+    """ Runs the process callback from a thread instead of an
+        audio server, for machines without audio hardware.
+
+        By default it paces blocks in real time and reports an
+        xrun when the callback falls more than a block behind.
+        With freewheel it runs blocks back to back as fast as
+        the callback allows, which measures throughput, but
+        scheduled voices will mostly start late since renderers
+        still wait in real time.
+
+        Inputs are silent. If path is given the output is
+        written there as a 16 bit WAV file.
+    """
+    def __init__(self, samplerate=DEFAULT_SAMPLERATE, blocksize=DEFAULT_BLOCKSIZE, channels=DEFAULT_CHANNELS, freewheel=False, path=None):
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.channels = channels
+        self.freewheel = freewheel
+        self.path = path
+        self.inports = [ DummyPort(blocksize) for _ in range(channels) ]
+        self.outports = [ DummyPort(blocksize) for _ in range(channels) ]
+        self.frame = 0
+        self.process = None
+        self.xrun = None
+        self.out = None
+        self.running = threading.Event()
+        self.thread = None
+
+    @property
+    def last_frame_time(self):
+        # JACK frame times are 32 bit and wrap around
+        return self.frame & 0xffffffff
+
+    def set_process_callback(self, callback):
+        self.process = callback
+
+    def set_blocksize_callback(self, callback):
+        # The block size never changes
+        pass
+
+    def set_xrun_callback(self, callback):
+        self.xrun = callback
+
+    def activate(self):
+        if self.path is not None:
+            self.out = wave.open(self.path, 'wb')
+            self.out.setnchannels(self.channels)
+            self.out.setsampwidth(2)
+            self.out.setframerate(self.samplerate)
+
+        self.running.set()
+        self.thread = threading.Thread(target=self.run, name='astrid-dummy-audio', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        cdef double period = <double>self.blocksize / self.samplerate
+        cdef double deadline = time.monotonic()
+        cdef double late
+
+        while self.running.is_set():
+            try:
+                self.process(self.blocksize)
+            except CallbackExit:
+                break
+
+            if self.out is not None:
+                self.write()
+
+            self.frame += self.blocksize
+
+            if self.freewheel:
+                continue
+
+            deadline += period
+            late = time.monotonic() - deadline
+            if late > period:
+                if self.xrun is not None:
+                    self.xrun(late * 1000000)
+                deadline = time.monotonic()
+            elif late < 0:
+                time.sleep(-late)
+
+        self.running.clear()
+
+    def write(self):
+        block = np.stack([ port.array for port in self.outports ], axis=1)
+        self.out.writeframes((np.clip(block, -1, 1) * 32767).astype('<i2').tobytes())
+
+    def deactivate(self):
+        self.running.clear()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def close(self):
+        if self.out is not None:
+            self.out.close()
+            self.out = None
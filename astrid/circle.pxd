@@ -3,12 +3,17 @@
 from pippi.soundbuffer cimport SoundBuffer
 
 cdef class Circle:
-    cdef object redis
-    cdef int blocksize
-    cdef int samplerate
-    cdef int channels
-    cdef int maxblocks
-    cdef str name
+    cdef object shm
+    cdef long long[:] header
+    cdef double[:,:] frames
+    cdef public long long length
+    cdef public int samplerate
+    cdef public int channels
+    cdef public bint owner
+    cdef public str name
 
+    cpdef bint attach(Circle self)
     cpdef void add(Circle self, double[:,:] block)
+    cpdef void add_ports(Circle self, object ports, int nframes)
     cpdef SoundBuffer read(Circle self, double length, tuple channels=*, double offset=*)
+    cpdef void close(Circle self)
@@ -1,40 +1,149 @@
 #cython: language_level=3
 
-import redis
+cimport cython
 import numpy as np
 from pippi.soundbuffer cimport SoundBuffer
-from .logger import logger
-from .defaults import DEFAULT_CHANNELS, DEFAULT_BLOCKSIZE, DEFAULT_SAMPLERATE
+from . import shm
+from .logger import get_logger
+from .defaults import DEFAULT_CHANNELS, DEFAULT_SAMPLERATE, DEFAULT_CIRCLE_LENGTH
+
+logger = get_logger('circle')
+
+# The header is four int64 values at the start of the segment:
+# the number of frames ever written, then the ring length in
+# frames, the channel count and the samplerate.
+cdef enum:
+    CURSOR = 0
+    LENGTH = 1
+    CHANNELS = 2
+    SAMPLERATE = 3
+    HEADER_SIZE = 4
 
 cdef class Circle:
-    def __cinit__(self, str name='inputbuffer'):
-        self.redis = redis.StrictRedis(host='localhost', port=6379, db=0)
-        self.blocksize = int(self.redis.get('BLOCKSIZE') or DEFAULT_BLOCKSIZE)
-        self.samplerate = int(self.redis.get('SAMPLERATE') or DEFAULT_SAMPLERATE)
-        self.channels = int(self.redis.get('CHANNELS') or DEFAULT_CHANNELS)
-        self.maxblocks = <int>(self.samplerate * 30) // self.blocksize
+    """ A ring of the most recent input frames in shared memory.
+
+        The audio server creates the ring and is the only writer.
+        Any other process can open it by name and read the last
+        few seconds directly out of the shared frames.
+    """
+    def __cinit__(self,
+            str name='inputbuffer',
+            bint create=False,
+            int channels=DEFAULT_CHANNELS,
+            int samplerate=DEFAULT_SAMPLERATE,
+            double length=DEFAULT_CIRCLE_LENGTH
+        ):
         self.name = name
+        self.owner = create
+        self.shm = None
+        self.length = <long long>(length * samplerate)
+        self.channels = channels
+        self.samplerate = samplerate
+
+        if create:
+            self.shm = shm.create(name, (HEADER_SIZE + self.length * channels) * sizeof(double))
+            self.header = np.ndarray((HEADER_SIZE,), dtype='q', buffer=self.shm)
+            self.header[CURSOR] = 0
+            self.header[LENGTH] = self.length
+            self.header[CHANNELS] = channels
+            self.header[SAMPLERATE] = samplerate
+            self.frames = np.ndarray((self.length, channels), dtype='d', buffer=self.shm, offset=HEADER_SIZE * sizeof(double))
+
+    cpdef bint attach(Circle self):
+        """ Open a ring created by the audio server.
+            Returns False if there isn't one yet.
+        """
+        if self.shm is not None:
+            return True
 
+        self.shm = shm.attach(self.name)
+        if self.shm is None:
+            return False
+
+        self.header = np.ndarray((HEADER_SIZE,), dtype='q', buffer=self.shm)
+        self.length = self.header[LENGTH]
+        self.channels = <int>self.header[CHANNELS]
+        self.samplerate = <int>self.header[SAMPLERATE]
+        self.frames = np.ndarray((self.length, self.channels), dtype='d', buffer=self.shm, offset=HEADER_SIZE * sizeof(double))
+        return True
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
     cpdef void add(Circle self, double[:,:] block):
-        self.redis.lpush(self.name, bytes(block))
-        self.redis.ltrim(self.name, 0, self.maxblocks-1)
+        cdef long long cursor = self.header[CURSOR]
+        cdef long long pos
+        cdef int i, c
+        cdef int channels = min(<int>block.shape[1], self.channels)
+
+        for i in range(block.shape[0]):
+            pos = (cursor + i) % self.length
+            for c in range(channels):
+                self.frames[pos, c] = block[i, c]
+
+        # Publish the new frames only once they have been written
+        self.header[CURSOR] = cursor + block.shape[0]
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cpdef void add_ports(Circle self, object ports, int nframes):
+        """ Copy a block straight from the audio input port arrays
+        """
+        cdef long long cursor = self.header[CURSOR]
+        cdef int i, c = 0
+        cdef float[:] inblock
+
+        for port in ports:
+            if c >= self.channels:
+                break
+
+            inblock = port.get_array()
+            for i in range(nframes):
+                self.frames[(cursor + i) % self.length, c] = inblock[i]
+            c += 1
+
+        self.header[CURSOR] = cursor + nframes
 
     cpdef SoundBuffer read(Circle self, double length, tuple channels=None, double offset=0):
+        """ Read `length` seconds of input ending `offset` seconds
+            before the most recent frame. Channels are numbered from 1.
+        """
         if channels is None:
-            channels = (0,)
-        cdef int framelength = <int>(length * self.samplerate)
-        cdef int numblocks = framelength // self.blocksize
-        cdef double[:,:] out = np.zeros((framelength, len(channels)), dtype='d')  
-        cdef double[:,:] block
-        cdef int o = <int>(offset * self.samplerate) // self.blocksize
-        o = min(o, (framelength - self.blocksize) // self.blocksize)
-        cdef int i = (numblocks * self.blocksize) - self.blocksize
-        for b in self.redis.lrange(self.name, o, o+numblocks-1):
-            block = np.ndarray((self.blocksize, self.channels), dtype='d', buffer=bytearray(b))
-            for j in range(self.blocksize):
-                for c in range(len(channels)):
-                    out[i+j,c] = block[j,channels[c]-1]
-
-            i -= self.blocksize
-
-        return SoundBuffer(out, channels=len(channels), samplerate=self.samplerate).remix(1).remix(2) # FIXME channel outs
+            channels = (1,)
+
+        cdef long long framelength = <long long>(length * self.samplerate)
+        if not self.attach():
+            logger.error('No input ring named %s to read from', self.name)
+            return SoundBuffer(np.zeros((framelength, len(channels)), dtype='d'), channels=len(channels), samplerate=self.samplerate).remix(1).remix(2)
+
+        framelength = min(<long long>(length * self.samplerate), self.length)
+        cdef long long cursor = self.header[CURSOR]
+        cdef long long oldest = max(cursor - self.length, 0)
+        cdef long long end = max(cursor - <long long>(offset * self.samplerate), oldest)
+        cdef long long start = max(end - framelength, oldest)
+        cdef list cols = [ (c - 1) % self.channels for c in channels ]
+        cdef object frames = np.asarray(self.frames)
+        cdef long long s = start % self.length
+        cdef long long e = s + (end - start)
+        cdef object out
+
+        if e <= self.length:
+            out = frames[s:e, cols]
+        else:
+            out = np.concatenate((frames[s:, cols], frames[:e - self.length, cols]))
+
+        # Pad out the front when less than `length` has been recorded so far
+        if end - start < framelength:
+            out = np.concatenate((np.zeros((framelength - (end - start), len(channels)), dtype='d'), out))
+
+        return SoundBuffer(np.ascontiguousarray(out), channels=len(channels), samplerate=self.samplerate).remix(1).remix(2) # FIXME channel outs
+
+    cpdef void close(Circle self):
+        if self.shm is None:
+            return
+
+        self.header = None
+        self.frames = None
+        self.shm.close()
+        self.shm = None
+        if self.owner:
+            shm.unlink(self.name)
@@ -1,42 +1,191 @@
 from contextlib import contextmanager
 import os
+import threading
 
 import msgpack
 import zmq
 
 from . import names
-from .logger import logger
+from .defaults import DEFAULT_CLIENT_TIMEOUT
+from .logger import get_logger
+
+logger = get_logger('client')
+
+# Commands that are safe to send again when the first 
+# try times out, since the server may have run them anyway
+IDEMPOTENT_COMMANDS = set([
+    names.LOAD_INSTRUMENT,
+    names.RELOAD_INSTRUMENT,
+    names.LIST_INSTRUMENTS,
+    names.STOP_ALL_VOICES,
+    names.STOP_INSTRUMENT,
+    names.SET_VALUE,
+    names.CLEAR_BANK,
+    names.PIN_INSTRUMENT,
+    names.STARTUP_TIMES,
+    names.SET_LOG_LEVEL,
+    names.CALLBACK_STATS,
+    names.LATENCY,
+])
+
+class ThreadSockets(dict):
+    """ The sockets of one thread, closed once the thread ends 
+        and its thread local goes away
+    """
+    def __init__(self):
+        super().__init__()
+        self.pid = os.getpid()
+
+    def __del__(self):
+        if self.pid != os.getpid():
+            # Never touch sockets that came across a fork
+            return
+        for sock in self.values():
+            sock.close(linger=0)
 
 class AstridClient:
+    """ Talks to the server over sockets that stay open for the
+        life of the process. zmq sockets can't be shared between 
+        threads, so each thread gets its own REQ socket, closed when 
+        the thread ends, while every thread sends through the one 
+        PUSH socket one at a time. A forked process opens fresh 
+        sockets rather than reusing its parent's.
+
+        send_cmd waits for a reply and send_nowait doesn't: use it
+        for play commands and other messages that don't need one.
+
+        A request that times out is only sent again when all of 
+        its commands are idempotent: a play or a dub that was just 
+        slow to reply would otherwise run twice.
+    """
+    def __init__(self, timeout=DEFAULT_CLIENT_TIMEOUT, host=names.MSG_HOST, msg_port=names.MSG_PORT, push_port=names.PUSH_PORT):
+        self.timeout = timeout # milliseconds
+        self.host = host
+        self.msg_port = msg_port
+        self.push_port = push_port
+        self.pid = None
+        self.context = None
+        self.local = None
+        self.pusher = None
+        self.push_lock = None
+
+    def sockets(self):
+        if self.pid != os.getpid():
+            # Sockets and contexts must not cross a fork
+            self.pid = os.getpid()
+            self.context = zmq.Context()
+            self.local = threading.local()
+            self.pusher = None
+            self.push_lock = threading.Lock()
+
+        if not hasattr(self.local, 'sockets'):
+            self.local.sockets = ThreadSockets()
+
+        return self.local.sockets
+
+    def connect(self, kind):
+        sock = self.context.socket(kind)
+        sock.setsockopt(zmq.LINGER, 0)
+        sock.setsockopt(zmq.SNDTIMEO, self.timeout)
+        sock.setsockopt(zmq.RCVTIMEO, self.timeout)
+
+        if kind == zmq.PUSH:
+            address = 'tcp://{}:{}'.format(self.host, self.push_port)
+        else:
+            address = 'tcp://{}:{}'.format(self.host, self.msg_port)
+
+        logger.debug('Connecting client to %s', address)
+        sock.connect(address)
+        return sock
+
+    def socket(self, kind):
+        sockets = self.sockets()
+        sock = sockets.get(kind, None)
+        if sock is None:
+            sock = sockets[kind] = self.connect(kind)
+        return sock
+
+    def reset(self, kind):
+        """ Throw away a socket that's stuck or broken. A REQ socket
+            that timed out waiting for a reply can't send again.
+        """
+        sock = self.sockets().pop(kind, None)
+        if sock is not None:
+            sock.close(linger=0)
+
     @contextmanager
     def get_client(self):
-        context = zmq.Context()
-        client = context.socket(zmq.REQ)
-        address = 'tcp://{}:{}'.format(names.MSG_HOST, names.MSG_PORT)
-        logger.debug('Connecting client to %s' % address)
-        client.connect(address)
-        yield client
-        context.destroy()
+        try:
+            yield self.socket(zmq.REQ)
+        except zmq.ZMQError:
+            self.reset(zmq.REQ)
+            raise
+
+    def request(self, cmds):
+        frame = names.encode(cmds)
+        msg = msgpack.packb(frame)
+        attempts = 2 if all([ cmd[0] in IDEMPOTENT_COMMANDS for cmd in frame[1] ]) else 1
+
+        for attempt in range(attempts):
+            try:
+                with self.get_client() as client:
+                    client.send(msg)
+                    return msgpack.unpackb(client.recv())
+            except zmq.Again:
+                logger.warning('No reply from server to %s, %s', cmds, 'retrying' if attempt < attempts - 1 else 'giving up')
+
+        return None
 
     def send_cmd(self, cmd):
-        msg = msgpack.packb(cmd)
+        """ Send one command, given by name or opcode, 
+            and return the server's reply
+        """
+        resp = self.request([cmd])
+        resp = resp[0] if resp else None
+        logger.debug(names.cton(resp) if isinstance(resp, int) else resp)
+        return resp
+
+    def send_batch(self, cmds, wait=True):
+        """ Send several commands in one message. Returns the 
+            list of replies, or if wait is False, whether the 
+            batch was sent.
+        """
+        if not wait:
+            return self.push(cmds)
+
+        return self.request(cmds) or []
+
+    def send_nowait(self, cmd):
+        """ Send a command without waiting for a reply. Returns
+            False if the command had to be dropped.
+        """
+        return self.push([cmd])
+
+    def push(self, cmds):
+        msg = msgpack.packb(names.encode(cmds))
+        self.sockets()
+        with self.push_lock:
+            if self.pusher is None:
+                self.pusher = self.connect(zmq.PUSH)
 
-        with self.get_client() as client:
-            client.send(msg)
-            resp = client.recv()
-            resp = msgpack.unpackb(resp)
-            logger.debug(names.cton(resp))
+            try:
+                self.pusher.send(msg, zmq.NOBLOCK)
+                return True
+            except zmq.Again:
+                logger.warning('Server is not keeping up, dropped %s', cmds)
+                return False
 
     def list_instruments(self):
-        with self.get_client() as client:
-            msg = msgpack.packb([names.cton(names.LIST_INSTRUMENTS)])
-            client.send(msg)
-            instruments = client.recv()
-            logger.debug(('!!list instruments', instruments))
-            instruments = msgpack.unpackb(instruments)
-            logger.debug(('!!list instruments', instruments))
-            return instruments      
+        instruments = self.send_cmd([names.LIST_INSTRUMENTS])
+        logger.debug(('!!list instruments', instruments))
+        return instruments or {}
 
-        return {}
+# One client shared by everything in a process
+_client = None
 
+def get_client():
+    global _client
+    if _client is None:
+        _client = AstridClient()
+    return _client
 
@@ -0,0 +1,16 @@
+#cython: language_level=3
+
+cdef double monotonic() nogil
+
+cdef class FrameClock:
+    cdef public object shared
+    cdef double[:] state
+    cdef long long epoch
+    cdef long long last_raw
+
+    cpdef void set_samplerate(FrameClock self, int samplerate)
+    cpdef long long tick(FrameClock self, unsigned int raw_frame)
+    cpdef bint running(FrameClock self)
+    cpdef int samplerate(FrameClock self)
+    cpdef long long now(FrameClock self)
+    cpdef double seconds_until(FrameClock self, long long frame)
@@ -0,0 +1,84 @@
+#cython: language_level=3
+
+import multiprocessing as mp
+import numpy as np
+from posix.time cimport clock_gettime, timespec, CLOCK_MONOTONIC
+
+# Layout of the shared clock state
+cdef enum:
+    SEQ = 0
+    FRAME = 1
+    STAMP = 2
+    SAMPLERATE = 3
+
+cdef double monotonic() nogil:
+    """ Same clock as time.monotonic(), without the GIL
+    """
+    cdef timespec ts
+    clock_gettime(CLOCK_MONOTONIC, &ts)
+    return <double>ts.tv_sec + <double>ts.tv_nsec * 1e-9
+
+cdef class FrameClock:
+    """ Shares the audio server's frame clock with other processes.
+
+        The audio callback calls `tick` with the frame time at the
+        start of every block, and stamps it with the monotonic time.
+        Renderers estimate the current frame from the last stamp,
+        so they can schedule buffers against absolute frame times.
+
+        Reads are guarded by a sequence counter so a reader never
+        mixes the frame of one block with the stamp of another.
+    """
+    def __cinit__(self, object shared=None):
+        if shared is None:
+            shared = mp.RawArray('d', 4)
+        self.shared = shared
+        self.state = np.frombuffer(shared, dtype='d')
+        self.epoch = 0
+        self.last_raw = 0
+
+    def __reduce__(self):
+        return (FrameClock, (self.shared,))
+
+    cpdef void set_samplerate(FrameClock self, int samplerate):
+        self.state[SAMPLERATE] = samplerate
+
+    cpdef long long tick(FrameClock self, unsigned int raw_frame):
+        """ Publish the frame time of the current block and
+            return it unwrapped to 64 bits. Only the audio
+            callback should call this.
+        """
+        if raw_frame < self.last_raw:
+            self.epoch += (<long long>1) << 32
+        self.last_raw = raw_frame
+
+        cdef long long frame = self.epoch + raw_frame
+        self.state[SEQ] += 1
+        self.state[FRAME] = <double>frame
+        self.state[STAMP] = monotonic()
+        self.state[SEQ] += 1
+        return frame
+
+    cpdef bint running(FrameClock self):
+        return self.state[SAMPLERATE] > 0 and self.state[STAMP] > 0
+
+    cpdef int samplerate(FrameClock self):
+        return <int>self.state[SAMPLERATE]
+
+    cpdef long long now(FrameClock self):
+        """ Estimate the frame time right now
+        """
+        cdef double seq, frame, stamp
+        while True:
+            seq = self.state[SEQ]
+            frame = self.state[FRAME]
+            stamp = self.state[STAMP]
+            if <long long>seq % 2 == 0 and seq == self.state[SEQ]:
+                break
+
+        return <long long>(frame + (monotonic() - stamp) * self.state[SAMPLERATE])
+
+    cpdef double seconds_until(FrameClock self, long long frame):
+        if not self.running():
+            return 0
+        return <double>(frame - self.now()) / self.state[SAMPLERATE]
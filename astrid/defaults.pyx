@@ -1,3 +1,21 @@
 DEFAULT_BLOCKSIZE = 64
 DEFAULT_SAMPLERATE = 44100
 DEFAULT_CHANNELS = 2
+DEFAULT_LOOKAHEAD = 0.05
+DEFAULT_STREAM_LOOKAHEAD = 0.2
+DEFAULT_VOICE_RING_SIZE = 1024
+DEFAULT_CIRCLE_LENGTH = 30
+DEFAULT_CLIENT_TIMEOUT = 1000
+DEFAULT_COMMAND_WORKERS = 4
+DEFAULT_NUMRENDERERS = 8
+DEFAULT_POLYPHONY = 32
+DEFAULT_SOUND_CACHE_BUDGET = 1 << 30
+DEFAULT_RELOAD_DELAY = 0.2
+DEFAULT_STARTUP_TIMEOUT = 30
+DEFAULT_RECONNECT_DELAY = 0.1 # doubles after each failed try
+DEFAULT_RECONNECT_MAX_DELAY = 5
+DEFAULT_LOG_LEVEL = 'INFO'
+DEFAULT_LOG_RATE = 50 # messages per second from each call site
+DEFAULT_LOG_BURST = 200
+DEFAULT_STATS_BLOCKS = 1 << 14
+DEFAULT_LATENCY_TRACES = 256 # per instrument
@@ -1,14 +1,25 @@
 #cython: language_level=3
 
 from pippi.soundbuffer cimport SoundBuffer
+from .clock cimport FrameClock
+from .orc cimport EventContext
 
 cdef class BufferNode:
     cdef public SoundBuffer snd
     cdef public double start_time
     cdef public double onset
+    cdef public long long start_frame
     cdef public int pos
     cdef public int done_playing
+    cdef double[:,:] frames
+    cdef public int length
+    cdef public int channels
+    cdef public object shm
+    cdef public object trace
+    cdef public double first_out
+    cdef void set_frames(BufferNode self, double[:,:] frames)
     cpdef double[:,:] next_block(BufferNode self, int block_size)
+    cpdef void release(BufferNode self)
 
-cdef void init_voice(object instrument, object params, object buf_q)
+cdef void init_voice(object instrument, EventContext ctx, object buf_q, FrameClock clock)
 cdef tuple collect_players(object instrument)
@@ -1,86 +1,315 @@
 #cython: language_level=3
 
 from __future__ import absolute_import
+cimport cython
 import collections
+from multiprocessing import shared_memory, resource_tracker
 import threading
 import queue
 import time
 import numpy as np
-import redis
 import sys
 
-from .logger import logger
+from .logger import get_logger
 from . import names
+from .clock cimport FrameClock
+from .defaults import DEFAULT_LOOKAHEAD, DEFAULT_STREAM_LOOKAHEAD
 from .orc cimport EventContext, Instrument
 from pippi.soundbuffer cimport SoundBuffer
 
+logger = get_logger('io')
+
 
 cdef class BufferNode:
-    def __init__(self, snd, start_time, onset):
+    def __init__(self, snd, start_time, onset, start_frame=-1, trace=None):
         self.snd = snd
         self.start_time = start_time
         self.onset = onset
+        self.start_frame = start_frame
+        self.trace = trace
+        self.first_out = 0
         self.pos = 0
         self.done_playing = -1
+        self.shm = None
+        if snd is not None:
+            self.set_frames(snd.frames)
+
+    def __reduce__(self):
+        return (BufferNode, (self.snd, self.start_time, self.onset, self.start_frame, self.trace))
+
+    cdef void set_frames(self, double[:,:] frames):
+        self.frames = frames
+        self.length = <int>frames.shape[0]
+        self.channels = <int>frames.shape[1]
 
     cpdef double[:,:] next_block(self, int block_size):
         cdef int startpos = self.pos
         cdef int endpos = startpos + block_size
         self.pos += block_size
-        if endpos >= len(self.snd.frames):
-            endpos = len(self.snd.frames)
+        if endpos >= self.length:
+            endpos = self.length
             self.done_playing = 1
-        return self.snd.frames[startpos:endpos]
+        return self.frames[startpos:endpos]
+
+    cpdef void release(self):
+        """ Unmap and unlink the shared memory segment 
+            backing this node, if there is one. Never call 
+            this from the audio callback.
+        """
+        if self.shm is None:
+            return
+
+        self.frames = None
+        self.shm.unlink()
+        try:
+            self.shm.close()
+        except BufferError:
+            # Someone is still holding a view from next_block,
+            # the mapping goes away when they let go of it.
+            pass
+        self.shm = None
+
+def share(SoundBuffer snd, double start_time, double onset, long long start_frame=-1, object trace=None):
+    """ Copy the frames of a rendered buffer into a new shared 
+        memory slab and return a small descriptor to send to the 
+        server in place of the buffer itself.
+
+        The server owns the slab from here on: it attaches to it 
+        with `attach` and unlinks it once the mixer is done.
+    """
+    cdef int length = <int>len(snd.frames)
+    cdef int channels = <int>snd.frames.shape[1]
+    shm = shared_memory.SharedMemory(create=True, size=length * channels * sizeof(double))
+
+    # Hand cleanup over to the server's resource tracker
+    resource_tracker.unregister(shm._name, 'shared_memory')
+
+    frames = np.ndarray((length, channels), dtype='d', buffer=shm.buf)
+    frames[:] = snd.frames
+    del frames
+    shm.close()
+
+    return (shm.name, length, channels, start_time, onset, start_frame, trace)
+
+def attach(tuple desc):
+    """ Wrap a shared memory slab described by `share` 
+        in a BufferNode without copying its frames
+    """
+    name, length, channels, start_time, onset, start_frame, trace = desc
+    cdef BufferNode node = BufferNode(None, start_time, onset, start_frame, trace)
+    node.shm = shared_memory.SharedMemory(name=name)
+    node.set_frames(np.ndarray((length, channels), dtype='d', buffer=node.shm.buf))
+    return node
 
 def default_onsets(ctx):
     yield 0
 
-cdef void play_sequence(buf_q, object player, EventContext ctx, object onsets, bint loop, double overlap):
+def send_buffer(buf_q, SoundBuffer snd, double start_time, double onset, long long start_frame, object trace=None):
+    try:
+        desc = share(snd, start_time, onset, start_frame, trace)
+        if trace is not None:
+            trace['shared'] = time.monotonic()
+        buf_q.put(desc)
+    except OSError as e:
+        logger.error('Could not share buffer, falling back to pickling: %s', e)
+        buf_q.put(BufferNode(snd, start_time, onset, start_frame, trace))
+
+cdef object take_trace(EventContext ctx):
+    """ The voice's trace goes along with its first buffer only
+    """
+    trace = ctx.trace
+    if trace is not None:
+        trace['rendered'] = time.monotonic()
+        ctx.trace = None
+    return trace
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef double peak(double[:,:] frames) nogil:
+    """ The loudest sample in frames, without the temporary 
+        arrays np.max(np.abs(...)) would allocate
+    """
+    cdef Py_ssize_t i, c
+    cdef double v, p = 0
+    for i in range(frames.shape[0]):
+        for c in range(frames.shape[1]):
+            v = frames[i, c]
+            if v < 0:
+                v = -v
+            if v > p:
+                p = v
+    return p
+
+cdef long long play_sequence(buf_q, object player, EventContext ctx, object onsets, bint loop, double overlap, FrameClock clock, long long start_frame, double lookahead, bint levels):
     """ Play a sequence of overlapping oneshots
+
+        Onsets are seconds relative to start_frame. Each one is 
+        rendered `lookahead` seconds before it is due and stamped 
+        with the absolute frame it should start on, so the mixer 
+        can start it on the exact sample. Returns the frame the 
+        next pass of a looping voice should start on.
+
+        With levels set, ctx.level follows the peak of the latest 
+        buffer, for stealing the quietest voice.
     """
-    cdef object snd 
-    cdef long elapsed = 0
-    cdef object delay = threading.Event()
+    cdef object snd = None
     cdef double onset = 0
-    cdef double start_time = time.clock_gettime(time.CLOCK_MONOTONIC_RAW)
+    cdef double wait = 0
+    cdef double start_time = time.monotonic()
+    cdef bint scheduled = clock.running() and start_frame >= 0
+    cdef int samplerate = clock.samplerate()
+    cdef long long onset_frame = -1
+    cdef long long next_frame = start_frame
 
-    logger.info('begin play_sequence %s' % ctx.instrument_name)
+    logger.debug('begin play_sequence %s', ctx.instrument_name)
 
     for onset in onsets:
+        if scheduled:
+            onset_frame = start_frame + <long long>(onset * samplerate)
+            wait = clock.seconds_until(onset_frame) - lookahead
+        else:
+            wait = onset - (time.monotonic() - start_time)
+
+        # Stopping the voice cuts the wait short
+        if wait > 0:
+            ctx.stop_me.wait(timeout=wait)
+
+        if ctx.stop_me.is_set():
+            break
+
+        if ctx.trace is not None:
+            ctx.trace['render_start'] = time.monotonic()
+
         generator = player(ctx)
-        delay.wait(timeout=onset)
         try:
             for snd in generator:
-                bufnode = BufferNode(snd, start_time, onset)
-                buf_q.put(bufnode)
+                if len(snd) == 0:
+                    continue
+
+                if levels:
+                    ctx.level = peak(snd.frames)
+                send_buffer(buf_q, snd, start_time, onset, onset_frame, take_trace(ctx))
+
+                if scheduled:
+                    next_frame = max(next_frame, onset_frame + <long long>(len(snd) * overlap))
+
+                if ctx.stop_me.is_set():
+                    break
 
         except Exception as e:
-            logger.exception('Error during %s generator render: %s' % (ctx.instrument_name, e))
+            logger.exception('Error during %s generator render: %s', ctx.instrument_name, e)
 
         ctx.tick += 1
 
-    if loop:
-        delay.wait(timeout=<double>(overlap * snd.dur))
+    if loop and not scheduled and snd is not None:
+        ctx.stop_me.wait(timeout=<double>(overlap * snd.dur))
+
+    logger.debug('play_sequence complete %s', ctx.instrument_name)
+    return next_frame
+
+cdef long long play_stream(buf_q, object player, EventContext ctx, object onsets, FrameClock clock, long long start_frame, double lookahead, bint levels):
+    """ Play a sequence of streams
+
+        A streaming player yields short buffers that follow on 
+        from each other instead of whole sounds. Each one is stamped 
+        with the frame right after the last, and the next one isn't 
+        rendered until the mixer is within `lookahead` seconds of 
+        needing it. The voice only keeps that much audio ahead of 
+        playback, and param and MIDI changes are heard on the next 
+        chunk. A chunk that would start in the past, or before the 
+        clock was running, is moved `lookahead` seconds ahead of now 
+        and the chunks after it follow on from there, so a slow 
+        render leaves one gap instead of overlapping chunks. 
+        Returns the frame the stream ended on.
+    """
+    cdef object snd = None
+    cdef double onset = 0
+    cdef double wait = 0
+    cdef double due = 0
+    cdef double start_time = time.monotonic()
+    cdef bint scheduled = clock.running() and start_frame >= 0
+    cdef int samplerate = clock.samplerate()
+    cdef long long chunk_frame = -1
+    cdef long long next_frame = start_frame
+    cdef long long now = 0
 
-    logger.info('play_sequence complete %s' % ctx.instrument_name)
-    #elapsed = time.clock_gettime(time.CLOCK_MONOTONIC_RAW) - start_time
+    logger.debug('begin play_stream %s', ctx.instrument_name)
 
-def wait_for_messages(stop_me, instrument_name):
-    r = redis.StrictRedis(host='localhost', port=6379, db=0, decode_responses=True)
-    pubsub = r.pubsub(ignore_subscribe_messages=True)
-    pubsub.subscribe(names.STOP_ALL_VOICES, names.STOP_INSTRUMENT)
-    for msg in pubsub.listen():
-        c = int(msg['channel'] or 0)
-        if not msg['type'] == 'message':
-            continue
+    for onset in onsets:
+        if scheduled and start_frame >= 0:
+            chunk_frame = start_frame + <long long>(onset * samplerate)
+        due = onset
 
-        data = msg['data']
-        logger.info('MSG DATA %s - %s' % (data, instrument_name))
+        generator = iter(player(ctx))
+        try:
+            while True:
+                # Wait for the mixer to catch up before rendering more
+                if scheduled:
+                    wait = clock.seconds_until(chunk_frame) - lookahead
+                else:
+                    wait = due - (time.monotonic() - start_time) - lookahead
 
-        if c == names.STOP_ALL_VOICES or (c == names.STOP_INSTRUMENT and msg['data'] == instrument_name):
-            stop_me.set()
+                if wait > 0:
+                    ctx.stop_me.wait(timeout=wait)
+
+                if ctx.stop_me.is_set():
+                    break
+
+                if ctx.trace is not None:
+                    ctx.trace['render_start'] = time.monotonic()
+
+                snd = next(generator, None)
+                if snd is None:
+                    break
+
+                if len(snd) == 0:
+                    continue
+
+                if levels:
+                    ctx.level = peak(snd.frames)
+
+                if clock.running():
+                    now = clock.now()
+                    if chunk_frame < now:
+                        if chunk_frame >= 0:
+                            logger.debug('%s stream chunk is %s frames late', ctx.instrument_name, now - chunk_frame)
+                        samplerate = clock.samplerate()
+                        chunk_frame = now + <long long>(lookahead * samplerate)
+                        scheduled = True
+
+                send_buffer(buf_q, snd, start_time, onset, chunk_frame, take_trace(ctx))
+
+                due += snd.dur
+                if scheduled:
+                    chunk_frame += len(snd)
+
+        except Exception as e:
+            logger.exception('Error during %s stream render: %s', ctx.instrument_name, e)
+
+        finally:
+            if hasattr(generator, 'close'):
+                generator.close()
+
+        if scheduled:
+            next_frame = max(next_frame, chunk_frame)
+
+        ctx.tick += 1
+
+        if ctx.stop_me.is_set():
             break
 
+    logger.debug('play_stream complete %s', ctx.instrument_name)
+    return next_frame
+
+def render_sequence(buf_q, object player, EventContext ctx, object onsets, bint loop, double overlap, FrameClock clock, long long start_frame, double lookahead, list next_frames, bint stream=False, bint levels=False):
+    try:
+        if stream:
+            next_frames.append(play_stream(buf_q, player, ctx, onsets, clock, start_frame, lookahead, levels))
+        else:
+            next_frames.append(play_sequence(buf_q, player, ctx, onsets, loop, overlap, clock, start_frame, lookahead, levels))
+    except Exception as e:
+        logger.exception('error calling play_sequence: %s', e)
+
 cdef tuple collect_players(object instrument):
     loop = False
     if hasattr(instrument.renderer, 'LOOP'):
@@ -114,18 +343,23 @@ cdef tuple collect_players(object instrument):
     #logger.info('COLLECT_PLAYERS players: %s' % players)
     return players, loop, overlap
 
-cdef void init_voice(object instrument, object params, object buf_q):
-    cdef object stop_me = threading.Event()
+cdef void init_voice(object instrument, EventContext ctx, object buf_q, FrameClock clock):
+    """ Render a voice until it finishes or ctx.stop_me is set.
+        The renderer that started the voice sets stop_me when the 
+        voice is stopped or stolen.
+    """
     cdef set players
     cdef object onset_generator
     cdef bint loop
     cdef double overlap
-    cdef EventContext ctx = instrument.create_ctx(params)
+    cdef double lookahead
+    cdef bint stream
+    cdef bint levels
+    cdef list next_frames
+    cdef list sequences
+    cdef EventContext player_ctx
     ctx.running.set()
 
-    message_listener = threading.Thread(target=wait_for_messages, args=(stop_me, ctx.instrument_name))
-    message_listener.start()
-
     if hasattr(instrument.renderer, 'before'):
         # blocking before callback makes
         # its results available to voices
@@ -133,31 +367,67 @@ cdef void init_voice(object instrument, object params, object buf_q):
 
     players, loop, overlap = collect_players(instrument)
 
+    # Streaming players yield short chunks on demand
+    stream = getattr(instrument.renderer, 'STREAM', False)
+    lookahead = getattr(instrument.renderer, 'LOOKAHEAD', DEFAULT_STREAM_LOOKAHEAD if stream else DEFAULT_LOOKAHEAD)
+
+    # Levels are only needed to steal the quietest voice
+    levels = getattr(instrument.renderer, 'STEAL', 'oldest') == 'quietest'
+
     cdef int count = 0
-    cdef object delay = threading.Event()
+    cdef long long start_frame = -1
+
+    if clock.running():
+        start_frame = clock.now() + <long long>(lookahead * clock.samplerate())
 
     while True:
+        ctx.count = count
+        ctx.tick = 0
+        next_frames = []
+        sequences = []
+        ctx.players = []
+
+        # Every player in a pass shares the same start frame, 
+        # so they render side by side rather than one after 
+        # the other, each with its own copy of the context.
         for player, onsets in players:
-            try:
-                ctx.count = count
-                ctx.tick = 0
-
-                if onsets is None:
-                    onset_generator = default_onsets(ctx)
-                else:
-                    onset_generator = onsets(ctx)
-                
-                play_sequence(buf_q, player, ctx, onset_generator, loop, overlap)
-            except Exception as e:
-                logger.exception('error calling play_sequence: %s' % e)
+            if len(players) == 1:
+                player_ctx = ctx
+            else:
+                player_ctx = ctx.copy()
+                # Only one buffer can be the voice's first
+                player_ctx.trace, ctx.trace = ctx.trace, None
+                ctx.players.append(player_ctx)
+
+            if onsets is None:
+                onset_generator = default_onsets(player_ctx)
+            else:
+                onset_generator = onsets(player_ctx)
+
+            if len(players) == 1:
+                render_sequence(buf_q, player, player_ctx, onset_generator, loop, overlap, clock, start_frame, lookahead, next_frames, stream, levels)
+            else:
+                sequences += [ threading.Thread(target=render_sequence, args=(buf_q, player, player_ctx, onset_generator, loop, overlap, clock, start_frame, lookahead, next_frames, stream, levels)) ]
+                sequences[-1].start()
+
+        for sequence in sequences:
+            sequence.join()
            
         count += 1
 
-        if not loop or ctx.shutdown.is_set() or stop_me.is_set():
+        if not loop or ctx.shutdown.is_set() or ctx.stop_me.is_set():
             break
 
+        if start_frame >= 0 and len(next_frames) > 0:
+            # Continue the loop on the frame the last pass ended
+            start_frame = max(next_frames)
+            wait = clock.seconds_until(start_frame) - lookahead
+            if wait > 0:
+                ctx.stop_me.wait(timeout=wait)
+
         instrument.reload()
         players, loop, overlap = collect_players(instrument)
+        levels = getattr(instrument.renderer, 'STEAL', 'oldest') == 'quietest'
         if hasattr(instrument.renderer, 'before'):
             # blocking before callback makes
             # its results available to voices
@@ -169,4 +439,3 @@ cdef void init_voice(object instrument, object params, object buf_q):
         # When the loop has completed or playback has stopped, 
         # execute the done callback
         instrument.renderer.done(ctx)
-
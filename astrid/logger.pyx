@@ -1,14 +1,31 @@
+import atexit
 import logging
-from logging.handlers import SysLogHandler, RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, SysLogHandler, RotatingFileHandler
 import os
+import queue
+import threading
+import time
 import warnings
 from pprint import pformat
 
-LOG_FORMAT_STRING = '[%(asctime)s] %(levelname)-8s %(threadName)s %(message)s'
+from .defaults import DEFAULT_LOG_LEVEL, DEFAULT_LOG_RATE, DEFAULT_LOG_BURST
+
+LOG_FORMAT_STRING = '[%(asctime)s] %(levelname)-8s %(name)s %(threadName)s %(message)s'
+
+class Pretty:
+    """ Runs pformat on a message only when it's written
+    """
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return pformat(self.msg)
 
 class PrettyPrintAdapter(logging.LoggerAdapter):
     def process(self, msg, kwargs):
-        return pformat(msg), kwargs
+        if not isinstance(msg, str):
+            msg = Pretty(msg)
+        return msg, kwargs
 
 class ColorFormatter(logging.Formatter):
     def format(self, record):
@@ -27,29 +44,132 @@ class ColorFormatter(logging.Formatter):
         elif record.levelno == logging.ERROR:
             formatter = logging.Formatter(ERROR + LOG_FORMAT_STRING + RESET)
 
-        elif record.levelno in (logging.CRITICAL, logging.EXCEPTION):
+        else:
             formatter = logging.Formatter(CRITICAL + LOG_FORMAT_STRING + RESET)
 
         return formatter.format(record)
-    
-logger = logging.getLogger('astrid')
 
-if not logger.handlers:
-    _syslog = SysLogHandler(address='/dev/log', facility=SysLogHandler.LOG_DAEMON)
-    _syslog.setFormatter(ColorFormatter())
-    logger.addHandler(_syslog)
+class RateLimitFilter(logging.Filter):
+    """ Lets each call site and message log at most `rate` 
+        messages a second, after an initial burst. The next message to
+        get through says how many were dropped in between.
+        Warnings and errors are never dropped.
+    """
+    def __init__(self, rate=DEFAULT_LOG_RATE, burst=DEFAULT_LOG_BURST):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.sites = {}
+        self.lock = threading.Lock()
 
-    _logfile = RotatingFileHandler('astrid.log', mode='a', maxBytes=2**20, backupCount=4)
-    _logfile.setFormatter(logging.Formatter(LOG_FORMAT_STRING))
-    logger.addHandler(_logfile)
+    def filter(self, record):
+        if self.rate <= 0 or record.levelno >= logging.WARNING:
+            return True
 
-    _streamHandler = logging.StreamHandler()
-    _streamHandler.setFormatter(ColorFormatter())
-    logger.addHandler(_streamHandler)
+        # Helpers that log different messages from one line get a 
+        # limit per message. Non-string messages may not hash.
+        msg = record.msg if isinstance(record.msg, str) else None
+        key = (record.name, record.pathname, record.lineno, msg)
+        now = time.monotonic()
 
-    logger.setLevel(logging.DEBUG)
-    warnings.simplefilter('always')
+        with self.lock:
+            tokens, last, dropped = self.sites.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self.sites[key] = (tokens, now, dropped + 1)
+                return False
+            self.sites[key] = (tokens - 1, now, 0)
+
+        if dropped > 0:
+            record.msg = '%s (%s similar messages dropped)' % (record.msg, dropped)
+        return True
+
+class LazyQueueHandler(QueueHandler):
+    """ Hands records to the listener thread as they are.
+        The stock QueueHandler formats the message first,
+        which is the work we want off the hot path.
+    """
+    def prepare(self, record):
+        return record
+
+def make_handlers():
+    handlers = []
+    try:
+        syslog = SysLogHandler(address='/dev/log', facility=SysLogHandler.LOG_DAEMON)
+        syslog.setFormatter(ColorFormatter())
+        handlers.append(syslog)
+    except OSError:
+        pass
+
+    logfile = RotatingFileHandler('astrid.log', mode='a', maxBytes=2**20, backupCount=4)
+    logfile.setFormatter(logging.Formatter(LOG_FORMAT_STRING))
+    handlers.append(logfile)
+
+    stream = logging.StreamHandler()
+    stream.setFormatter(ColorFormatter())
+    handlers.append(stream)
+
+    return handlers
 
-    #logger.setLevel(logging.INFO)
+_root = logging.getLogger('astrid')
+_listener = None
+
+def start_listener():
+    """ Producers only put records on a queue, and a
+        thread in each process formats and writes them.
+    """
+    global _listener
+    q = queue.SimpleQueue()
+
+    for handler in list(_root.handlers):
+        _root.removeHandler(handler)
+
+    handler = LazyQueueHandler(q)
+    handler.addFilter(RateLimitFilter())
+    _root.addHandler(handler)
+
+    _listener = QueueListener(q, *make_handlers(), respect_handler_level=True)
+    _listener.start()
+
+def restart_listener():
+    # The listener thread doesn't survive a fork,
+    # so the child starts its own
+    global _listener
+    _listener = None
+    start_listener()
+
+def stop_listener():
+    """ Write out whatever is still queued
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+def get_logger(subsystem=None):
+    """ The astrid logger, or the child logger for one
+        subsystem, e.g. astrid.server
+    """
+    if subsystem is None:
+        return PrettyPrintAdapter(_root, {})
+    return PrettyPrintAdapter(_root.getChild(subsystem), {})
+
+def set_level(level, subsystem=None):
+    """ Change the level of the astrid logger, or of one
+        subsystem, while the server is running
+    """
+    if isinstance(level, str):
+        level = level.upper()
+    target = _root if not subsystem else _root.getChild(subsystem)
+    target.setLevel(level)
+
+if _listener is None and not any([ isinstance(h, LazyQueueHandler) for h in _root.handlers ]):
+    _root.setLevel(DEFAULT_LOG_LEVEL)
+    warnings.simplefilter('always')
+    start_listener()
+    os.register_at_fork(after_in_child=restart_listener)
+    atexit.register(stop_listener)
 
-logger = PrettyPrintAdapter(logger, {})
+logger = get_logger()
@@ -1,4 +1,3 @@
 cdef class MidiBucket:
-    cdef public object bus
     cdef public object devices
     cdef public object dummy
@@ -2,19 +2,28 @@ import multiprocessing as mp
 from concurrent.futures import ThreadPoolExecutor
 import threading
 import math
+import re
 import time
 
 import mido
-import redis
+import numpy as np
 
 from pippi import tune
 from . import client
-from .logger import logger
+from . import names
+from . import shm
+from .logger import get_logger
+
+logger = get_logger('midi')
 
-MIDI_MSG_NOTE_TEMPLATE = 'midi-message-{device}-note-{note}'
-MIDI_MSG_CC_TEMPLATE = 'midi-message-{device}-cc-{cc}'
 MIDI_LISTENER_KEY_TEMPLATE = '{}-midi-listener'
 
+# Rows of a device's state table
+MIDI_CC_VALUES = 0
+MIDI_CC_TIMES = 1
+MIDI_NOTE_VALUES = 2
+MIDI_NOTE_TIMES = 3
+
 def find_device(substr, input_device=True):
     try:
         if input_device:
@@ -26,50 +35,137 @@ def find_device(substr, input_device=True):
             if substr in device_name:
                 return device_name
     except RuntimeError as e:
-        logger.exception('Could not query for devices: %s' % e)
+        logger.exception('Could not query for devices: %s', e)
 
     return None
 
 
+class MidiStateTable:
+    """ The latest value of every CC and the latest velocity 
+        of every note for one device, each with the monotonic 
+        time it last changed, in a shared memory segment.
+
+        The device's listener writes the table as events come 
+        in and voices in any process read it directly. A value 
+        that has never been set has a time of zero.
+    """
+    def __init__(self, device, create=False):
+        self.name = 'midi-%s' % re.sub(r'[^\w-]', '_', device)
+        self.state = None
+        if create:
+            self.map(shm.ensure(self.name, 4 * 128 * 8))
+
+    def map(self, mapped):
+        self.state = np.ndarray((4, 128), dtype='d', buffer=mapped)
+
+    def attach(self):
+        if self.state is None:
+            mapped = shm.attach(self.name)
+            if mapped is None:
+                return False
+            self.map(mapped)
+        return True
+
+    def set_cc(self, cc, value):
+        self.state[MIDI_CC_VALUES, cc] = value
+        self.state[MIDI_CC_TIMES, cc] = time.monotonic()
+
+    def set_note(self, note, velocity):
+        self.state[MIDI_NOTE_VALUES, note] = velocity
+        self.state[MIDI_NOTE_TIMES, note] = time.monotonic()
+
+    def get(self, row, index):
+        """ Returns (value, time), or None if it was never set
+        """
+        if not self.attach() or not 0 <= index < 128 or self.state[row + 1, index] == 0:
+            return None
+        return float(self.state[row, index]), float(self.state[row + 1, index])
+
+# Tables this process has opened, by device name
+_tables = {}
+
+def state_table(device):
+    try:
+        return _tables[device]
+    except KeyError:
+        return _tables.setdefault(device, MidiStateTable(device))
+
+
 class MidiDeviceBucket:
-    def __init__(self, device=None, bus=None, mapping=None):
+    def __init__(self, device=None, mapping=None):
         self._device = device # full device / port name
-        self._bus = bus
+        self._table = state_table(device) if device else None
         self._mapping = mapping
+        self._keys = {}
 
     def __getattr__(self, key):
         return self.get(key)
 
+    def _index(self, key):
+        try:
+            return self._keys[key]
+        except KeyError:
+            pass
+
+        index = key
+        if self._mapping is not None \
+        and key in self._mapping:
+            index = self._mapping[key]
+
+        if isinstance(index, str):
+            try:
+                index = int(index[2:] if index.startswith('cc') else index)
+            except ValueError:
+                # Not a controller or note: lookups get the default
+                index = None
+
+        self._keys[key] = index
+        return index
+
     def get(self, key, default=None):
         if not self._device:
             return default
 
-        if self._mapping is not None \
-        and key in self._mapping:
-            key = self.__mapping[key]
+        index = self._index(key)
+        if index is None:
+            return default
 
-        val = self._bus.get(MIDI_MSG_CC_TEMPLATE.format(device=self._device, cc=key[2:]))
+        val = self._table.get(MIDI_CC_VALUES, index)
         if val is None:
             return default
-        return float(val or 0)
+        return val[0]
 
     def getnote(self, key, default=None):
         if not self._device:
             return default
 
-        if self._mapping is not None \
-        and key in self._mapping:
-            key = self.__mapping[key]
+        index = self._index(key)
+        if index is None:
+            return default
 
-        val = self._bus.get(MIDI_MSG_NOTE_TEMPLATE.format(device=self._device, note=key))
+        val = self._table.get(MIDI_NOTE_VALUES, index)
         if val is None:
             return default
-        return val
+        return val[0]
+
+    def changed(self, key, default=None):
+        """ Monotonic time the CC last changed
+        """
+        if not self._device:
+            return default
+
+        index = self._index(key)
+        if index is None:
+            return default
+
+        val = self._table.get(MIDI_CC_VALUES, index)
+        if val is None:
+            return default
+        return val[1]
 
 
 cdef class MidiBucket:
     def __init__(self, devices, mappings):
-        self.bus = redis.StrictRedis(host='localhost', port=6379, db=0)
         self.devices = self.map_device_buckets(devices, mappings)
         self.dummy = MidiDeviceBucket() # empty fallback
 
@@ -84,7 +180,7 @@ cdef class MidiBucket:
         for device_alias in devices:
             mapping = mappings.get(device_alias, None)
             device_fullname = find_device(device_alias)
-            device_buckets[device_alias] = MidiDeviceBucket(device_fullname, self.bus, mapping)
+            device_buckets[device_alias] = MidiDeviceBucket(device_fullname, mapping)
 
         return device_buckets
 
@@ -100,14 +196,14 @@ class PlayNote(threading.Thread):
     def run(self):
         note = int(math.floor(math.log(self.freq/440.0, 2) * 12 + 69))
         velocity = int(self.amp * 127)
-        logger.info('MidiOutput ON %s %s %s %s %s' % (self.freq, self.amp, self.length, note, velocity))
+        logger.debug('MidiOutput ON %s %s %s %s %s', self.freq, self.amp, self.length, note, velocity)
 
         m = mido.Message('note_on', note=note, velocity=velocity)
         self.out.send(m)
         time.sleep(self.length)
         m = mido.Message('note_off', note=note)
         self.out.send(m)
-        logger.info('MidiOutput OFF %s %s %s %s %s' % (self.freq, self.amp, self.length, note, velocity))
+        logger.debug('MidiOutput OFF %s %s %s %s %s', self.freq, self.amp, self.length, note, velocity)
 
 
 class MidiOutput(mp.Process):
@@ -122,43 +218,46 @@ class MidiOutput(mp.Process):
     def run(self):
         while True:
             freq, amp, length = self.event_q.get()
-            logger.info('Got MSG: MidiOutput %s %s %s' % (freq, amp, length))
+            logger.debug('Got MSG: MidiOutput %s %s %s', freq, amp, length)
             e = PlayNote(self.out, freq, amp, length)
-            logger.info(type(e))
             e.start()
             #self.event_loop.run_in_executor(self.pool, self._play, freq, amp, length)
 
 class MidiListener(mp.Process):
     def __init__(self, instrument_name, device, triggers, shutdown):
         super(MidiListener, self).__init__()
-        self.client = client.AstridClient()
+        self.client = client.get_client()
         self.shutdown = shutdown
         self.instrument_name = instrument_name
         self.device = device
-        self.bus = redis.StrictRedis(host='localhost', port=6379, db=0)
         self.triggers = triggers
         self.name = 'astrid-%s-midi-listener' % instrument_name
-        logger.info('MidiListener %s %s %s' % (instrument_name, device, triggers))
+        logger.info('MidiListener %s %s %s', instrument_name, device, triggers)
 
     def run(self):
+        table = MidiStateTable(self.device, create=True)
+
         with mido.open_input(self.device) as events:
             for msg in events:
-                #logger.info('midi: %s %s' % (self.device, msg))
+                #logger.info('midi: %s %s', self.device, msg)
                 if self.shutdown.is_set():
                     break
 
                 if msg.type == 'note_on':
                     freq = tune.mtof(msg.note)
                     amp = msg.velocity / 127
-                    self.bus.set(MIDI_MSG_NOTE_TEMPLATE.format(device=self.device, note=msg.note), amp)
+                    table.set_note(msg.note, amp)
 
                     if self.triggers is not None and (self.triggers == -1 or msg.note in self.triggers):
-                        self.client.send_cmd(['play', self.instrument_name, {'freq': freq, 'amp': amp}])
+                        self.client.send_nowait([names.PLAY_INSTRUMENT, self.instrument_name, {'freq': freq, 'amp': amp}])
  
                 elif msg.type == 'control_change':
                     value = msg.value / 127.0
-                    #logger.info('CC: %s %s %s' % (self.device, msg.control, value))
-                    self.bus.set(MIDI_MSG_CC_TEMPLATE.format(device=self.device, cc=msg.control), value)
+                    #logger.info('CC: %s %s %s', self.device, msg.control, value)
+                    table.set_cc(msg.control, value)
+
+                elif msg.type == 'note_off':
+                    table.set_note(msg.note, 0)
 
 def start_listener(instrument):
     # FIXME
@@ -0,0 +1,26 @@
+#cython: language_level=3
+
+from .io cimport BufferNode
+from .ring cimport ObjectRing
+
+cdef class AstridMixer:
+    cdef public int block_size
+    cdef public int channels
+    cdef public int samplerate
+    cdef public list voices
+    cdef public long retired
+    cdef public long late
+    cdef public object finished
+    cdef public object started
+    cdef double[:,:] accumulator
+
+    cpdef void add(AstridMixer self, BufferNode node)
+    cpdef int take(AstridMixer self, ObjectRing incoming)
+    cpdef void clear(AstridMixer self)
+    cpdef int process(AstridMixer self, object ports, int nframes, long long frame_time=*)
+    cpdef void silence(AstridMixer self, object ports)
+    cpdef int reap(AstridMixer self)
+    cpdef list traces(AstridMixer self)
+    cdef void resize(AstridMixer self, int block_size)
+    cdef int mix(AstridMixer self, int nframes, long long frame_time)
+    cdef void write(AstridMixer self, object ports, int nframes)
@@ -0,0 +1,188 @@
+#cython: language_level=3
+
+cimport cython
+import collections
+import numpy as np
+
+from .clock cimport monotonic
+from .io cimport BufferNode
+from .ring cimport ObjectRing
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void mix_frames(double[:,:] out, int offset, double[:,:] src, int start, int length, int channels, int src_channels) nogil:
+    """ Sum `length` frames of src starting at `start` into out, 
+        beginning `offset` frames into the block. Source channels 
+        wrap around the output channels so mono buffers are spread 
+        across every output.
+    """
+    cdef int i, c
+    for i in range(length):
+        for c in range(channels):
+            out[offset + i, c] += src[start + i, c % src_channels]
+
+cdef class AstridMixer:
+    """ Sums active BufferNodes into preallocated blocks
+        and writes them straight into the output port arrays.
+
+        Finished voices are retired by swapping the last
+        voice into their slot, so retirement is O(1) and
+        the voice list never shifts. Voices backed by shared 
+        memory are handed off to `reap`, which releases them 
+        outside of the audio callback.
+
+        Voices stamped with a start frame wait until the block 
+        that contains it and start on that exact sample. Voices 
+        that arrive after their start frame play immediately 
+        and are counted as late.
+
+        The first block of a traced voice is stamped with the 
+        time its first sample goes out, and handed to `traces`.
+    """
+    def __cinit__(self, int block_size, int channels, int samplerate):
+        self.block_size = block_size
+        self.channels = channels
+        self.samplerate = samplerate
+        self.voices = []
+        self.retired = 0
+        self.late = 0
+        self.finished = collections.deque()
+        self.started = collections.deque()
+        self.accumulator = np.zeros((block_size, channels), dtype='d')
+
+    cpdef void add(AstridMixer self, BufferNode node):
+        self.voices.append(node)
+
+    cpdef int take(AstridMixer self, ObjectRing incoming):
+        """ Start every voice waiting in the incoming ring 
+            and return how many were added
+        """
+        cdef int count = 0
+        cdef object node = incoming.pop()
+
+        while node is not None:
+            self.voices.append(node)
+            node = incoming.pop()
+            count += 1
+
+        return count
+
+    cpdef void clear(AstridMixer self):
+        self.finished.extend(self.voices)
+        self.voices.clear()
+
+    cdef void resize(AstridMixer self, int block_size):
+        # Only happens when the audio server changes its period size
+        self.block_size = block_size
+        self.accumulator = np.zeros((block_size, self.channels), dtype='d')
+
+    cdef int mix(AstridMixer self, int nframes, long long frame_time):
+        cdef int i = 0
+        cdef int last
+        cdef int offset
+        cdef int length
+        cdef BufferNode node
+
+        while i < len(self.voices):
+            node = <BufferNode>self.voices[i]
+            offset = 0
+
+            if node.pos == 0 and node.start_frame >= 0 and frame_time >= 0:
+                if node.start_frame >= frame_time + nframes:
+                    # Not due yet
+                    i += 1
+                    continue
+
+                if node.start_frame >= frame_time:
+                    offset = <int>(node.start_frame - frame_time)
+                else:
+                    self.late += 1
+
+            length = min(nframes - offset, node.length - node.pos)
+            if length > 0:
+                if node.pos == 0 and node.trace is not None:
+                    node.first_out = monotonic() + <double>offset / self.samplerate
+                    self.started.append(node)
+
+                with nogil:
+                    mix_frames(self.accumulator, offset, node.frames, node.pos, length, self.channels, node.channels)
+                node.pos += length
+
+            if node.pos >= node.length:
+                node.done_playing = 1
+                last = len(self.voices) - 1
+                self.voices[i] = self.voices[last]
+                self.voices.pop()
+                self.retired += 1
+                if node.shm is not None:
+                    self.finished.append(node)
+                continue
+
+            i += 1
+
+        return len(self.voices)
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef void write(AstridMixer self, object ports, int nframes):
+        cdef int i, c = 0
+        cdef float[:] out
+        cdef double[:,:] acc = self.accumulator
+
+        for port in ports:
+            out = port.get_array()
+            if c < self.channels:
+                with nogil:
+                    for i in range(nframes):
+                        out[i] = <float>acc[i, c]
+                        acc[i, c] = 0
+            else:
+                out[:] = 0
+            c += 1
+
+    cpdef int process(AstridMixer self, object ports, int nframes, long long frame_time=-1):
+        """ Mix one block of every active voice into the given
+            ports and return the number of voices still playing. 
+            Pass the frame time of the block to start scheduled 
+            voices on time.
+        """
+        cdef int active
+
+        if nframes > self.accumulator.shape[0]:
+            self.resize(nframes)
+
+        active = self.mix(nframes, frame_time)
+        self.write(ports, nframes)
+        return active
+
+    cpdef void silence(AstridMixer self, object ports):
+        for port in ports:
+            port.get_array().fill(0)
+
+    cpdef list traces(AstridMixer self):
+        """ The traces of voices that started since the 
+            last call, with the time of their first sample
+        """
+        cdef list traces = []
+        cdef BufferNode node
+
+        while self.started:
+            node = <BufferNode>self.started.popleft()
+            node.trace['first_out'] = node.first_out
+            traces.append(node.trace)
+
+        return traces
+
+    cpdef int reap(AstridMixer self):
+        """ Release the shared memory of retired voices
+            and return the number of voices released
+        """
+        cdef int count = 0
+        cdef BufferNode node
+
+        while self.finished:
+            node = <BufferNode>self.finished.popleft()
+            node.release()
+            count += 1
+
+        return count
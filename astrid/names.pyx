@@ -22,11 +22,21 @@ STOP_INSTRUMENT = 19
 CLEAR_BANK = 20
 REC_BANK = 21
 DUB_BANK = 22
+PARAM_UPDATE = 23
+PIN_INSTRUMENT = 24
+RENDERER_READY = 25
+STARTUP_TIMES = 26
+SET_LOG_LEVEL = 27
+CALLBACK_STATS = 28
+LATENCY = 29
 
 ENVELOPE_FOLLOWER = 14
 PITCH_TRACKER = 15
 
+PROTOCOL_VERSION = 1
+
 MSG_PORT = 9191
+PUSH_PORT = 9192
 MSG_HOST = 'localhost'
 
 ORC_DIR = 'orc'
@@ -50,6 +60,12 @@ _cmdToName = {
     CLEAR_BANK: 'clear_bank',
     REC_BANK: 'rec_bank',
     DUB_BANK: 'dub_bank',
+    PIN_INSTRUMENT: 'pin',
+    RENDERER_READY: 'renderer_ready',
+    STARTUP_TIMES: 'startup',
+    SET_LOG_LEVEL: 'log_level',
+    CALLBACK_STATS: 'stats',
+    LATENCY: 'latency',
 }
 
 _nameToCmd = {
@@ -72,6 +88,12 @@ _nameToCmd = {
     'clear_bank': CLEAR_BANK,
     'rec_bank': REC_BANK,
     'dub_bank': DUB_BANK,
+    'pin': PIN_INSTRUMENT,
+    'renderer_ready': RENDERER_READY,
+    'startup': STARTUP_TIMES,
+    'log_level': SET_LOG_LEVEL,
+    'stats': CALLBACK_STATS,
+    'latency': LATENCY,
 }
 
 def ntoc(name):
@@ -80,4 +102,35 @@ def ntoc(name):
 def cton(cmd):
     return _cmdToName.get(cmd, None)
 
+def encode(cmds):
+    """ Pack a list of commands into a message frame: 
+        [PROTOCOL_VERSION, [[opcode, *args], ...]]
+        Command names are translated to their opcodes.
+    """
+    frame = []
+    for cmd in cmds:
+        op = cmd[0]
+        if isinstance(op, str):
+            op = ntoc(op)
+        frame.append([op] + list(cmd[1:]))
+
+    return [PROTOCOL_VERSION, frame]
+
+def decode(msg):
+    """ Unpack a message frame into a list of (opcode, args) 
+        pairs. Also accepts the old single command format where 
+        the command is given by name: ['play', 'instrument', ...]
+
+        Returns the commands and whether the message was old style.
+    """
+    if len(msg) == 0:
+        return [], True
+
+    if not isinstance(msg[0], int):
+        return [(ntoc(msg[0]), msg[1:])], True
+
+    if len(msg) != 2 or msg[0] != PROTOCOL_VERSION:
+        raise ValueError('Unsupported protocol version %s' % msg[0])
+
+    return [ (cmd[0] if len(cmd) > 0 else None, cmd[1:]) for cmd in msg[1] ], False
 
@@ -6,7 +6,7 @@ cdef class ParamBucket:
     cdef object _params
 
 cdef class SessionParamBucket:
-    cdef object _bus
+    cdef dict _snapshot
 
 cdef class EventContext:
     cdef public object before
@@ -22,6 +22,9 @@ cdef class EventContext:
     cdef public object sounds
     cdef public int count
     cdef public int tick
+    cdef public double level
+    cdef public object trace
+    cdef public list players
     cdef public object adc
     cdef public object sampler
 
@@ -29,5 +32,7 @@ cdef class Instrument:
     cdef public str name
     cdef public str path
     cdef public object renderer
+    cdef public str digest
+    cdef public object error
     cdef public object shutdown
     cdef public object sounds 
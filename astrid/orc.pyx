@@ -2,10 +2,12 @@
 
 import asyncio
 from contextlib import contextmanager
+import hashlib
 import importlib
 import importlib.util
 import os
 import threading
+import time
 
 import redis
 import msgpack
@@ -19,55 +21,201 @@ from pippi import dsp
 from . import client
 from . import midi
 from . import names
-from .logger import logger
+from . import soundcache
+from .defaults import DEFAULT_RECONNECT_DELAY, DEFAULT_RECONNECT_MAX_DELAY, DEFAULT_RELOAD_DELAY
+from .logger import get_logger
 from .circle cimport Circle
 from .sampler cimport Sampler
 
+logger = get_logger('orc')
+
 INSTRUMENT_RENDERER_KEY_TEMPLATE = '{}-renderer'
 
-def load_instrument(name, path, shutdown=None):
+class ModuleCache:
+    """ Compiled instrument scripts keyed by path.
+
+        A script is only read again when its mtime or size 
+        changes, and only compiled again when its contents 
+        have actually changed.
+    """
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def compile(self, path):
+        """ Returns the (digest, code) of the script at path
+        """
+        st = os.stat(path)
+        with self.lock:
+            entry = self.entries.get(path, None)
+            if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+                return entry[2], entry[3]
+
+        with open(path, 'rb') as f:
+            source = f.read()
+
+        digest = hashlib.sha1(source).hexdigest()
+        if entry is not None and entry[2] == digest:
+            # Saved again without any changes
+            code = entry[3]
+        else:
+            code = compile(source, path, 'exec')
+
+        with self.lock:
+            self.entries[path] = (st.st_mtime_ns, st.st_size, digest, code)
+
+        return digest, code
+
+modules = ModuleCache()
+
+def load_instrument(name, path, shutdown=None, listen=True):
     """ Loads a renderer module from the script 
-        at self.path 
+        at self.path and starts its MIDI listeners,
+        unless listen is False
 
         Failure to load the module raises an 
         InstrumentNotFoundError
     """
+    logger.info('Loading instrument %s from %s', name, path)
     try:
-        logger.info('Loading instrument %s from %s' % (name, path))
-        spec = importlib.util.spec_from_file_location(name, path)
-        if spec is not None:
-            renderer = importlib.util.module_from_spec(spec)
-            try:
-                spec.loader.exec_module(renderer)
-            except Exception as e:
-                logger.exception('Error loading instrument module: %s' % str(e))
+        digest, code = modules.compile(path)
+    except (OSError, TypeError, SyntaxError) as e:
+        logger.exception('Could not compile instrument module: %s', str(e))
+        raise InstrumentNotFoundError(name) from e
 
-            instrument = Instrument(name, path, renderer, shutdown)
+    spec = importlib.util.spec_from_file_location(name, path)
+    if spec is None:
+        logger.error('Could not load instrument - spec is None: %s %s', path, name)
+        raise InstrumentNotFoundError(name)
 
-        else:
-            logger.error('Could not load instrument - spec is None: %s %s' % (path, name))
-            raise InstrumentNotFoundError(name)
-    except TypeError as e:
-        logger.exception('TypeError loading instrument module: %s' % str(e))
-        raise InstrumentNotFoundError(name) from e
+    renderer = importlib.util.module_from_spec(spec)
+    error = None
+    try:
+        exec(code, renderer.__dict__)
+    except Exception as e:
+        logger.exception('Error loading instrument module: %s', str(e))
+        error = str(e)
 
-    midi.start_listener(instrument)
+    instrument = Instrument(name, path, renderer, shutdown, digest, error)
+
+    if listen:
+        midi.start_listener(instrument)
     return instrument
 
+class SessionParamCache:
+    """ In-process copy of the session params set with SET_VALUE.
+
+        Each key is fetched from redis the first time it is read
+        (missing keys are remembered too) and afterwards kept up to 
+        date by the PARAM_UPDATE messages the server publishes 
+        whenever it sets a value, so reads are dict lookups.
+    """
+    def __init__(self):
+        self.values = {}
+        self.bus = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def start(self, listen=True):
+        """ Connect and subscribe to updates, once per process.
+            Pass listen=False when something else in the process is 
+            already subscribed and will call update itself.
+        """
+        if self.pid == os.getpid():
+            return
+
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+
+            self.values = {}
+            self.bus = redis.StrictRedis(host='localhost', port=6379, db=0)
+            if listen:
+                threading.Thread(target=self.wait_for_updates, args=(self.subscribe(),), daemon=True).start()
+            self.pid = os.getpid()
+
+    def subscribe(self):
+        pubsub = self.bus.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(names.PARAM_UPDATE)
+        return pubsub
+
+    def wait_for_updates(self, pubsub):
+        """ Apply updates until the subscription ends. If the 
+            connection drops, forget everything cached, since 
+            updates may be missed while it's down, and subscribe 
+            again with backoff.
+        """
+        delay = DEFAULT_RECONNECT_DELAY
+        while True:
+            try:
+                if pubsub is None:
+                    pubsub = self.subscribe()
+
+                for msg in pubsub.listen():
+                    delay = DEFAULT_RECONNECT_DELAY
+                    if not msg['type'] == 'message':
+                        continue
+
+                    key, value = msgpack.unpackb(msg['data'])
+                    self.update(key, value)
+                return
+
+            except redis.ConnectionError as e:
+                logger.error('Lost the session param subscription, trying again in %ss: %s', delay, e)
+                self.values = {}
+                if pubsub is not None:
+                    pubsub.reset()
+                pubsub = None
+                time.sleep(delay)
+                delay = min(delay * 2, DEFAULT_RECONNECT_MAX_DELAY)
+
+    def update(self, key, value):
+        self.values[key] = value
+
+    def get(self, key):
+        self.start()
+        try:
+            return self.values[key]
+        except KeyError:
+            pass
+
+        v = self.bus.get(key)
+        if v is not None:
+            v = v.decode('utf-8')
+
+        # An update may have landed while we were fetching, 
+        # in which case it wins.
+        return self.values.setdefault(key, v)
+
+session_params = SessionParamCache()
+
 cdef class SessionParamBucket:
     """ params[key] to params.key
+
+        With snapshot set, every value is frozen the first 
+        time the voice reads it, starting with everything 
+        already cached when the voice began.
     """
-    def __init__(self):
-        self._bus = redis.StrictRedis(host='localhost', port=6379, db=0)
+    def __init__(self, snapshot=False):
+        self._snapshot = None
+        if snapshot:
+            session_params.start()
+            self._snapshot = dict(session_params.values)
 
     def __getattr__(self, key):
         return self.get(key)
 
     def get(self, key, default=None):
-        v = self._bus.get(key) 
+        if self._snapshot is None:
+            v = session_params.get(key)
+        elif key in self._snapshot:
+            v = self._snapshot[key]
+        else:
+            v = self._snapshot[key] = session_params.get(key)
+
         if v is None:
             return default
-        return v.decode('utf-8')
+        return v
 
 cdef class ParamBucket:
     """ params[key] to params.key
@@ -95,21 +243,52 @@ cdef class EventContext:
             midi_devices=None, 
             midi_maps=None, 
             before=None,
+            snapshot=False,
         ):
 
         self.before = before
         self.m = midi.MidiBucket(midi_devices, midi_maps)
         self.p = ParamBucket(params)
-        self.s = SessionParamBucket() 
-        self.client = None
+        self.s = SessionParamBucket(snapshot) 
+        self.client = client.get_client()
         self.instrument_name = instrument_name
         self.running = running
         self.shutdown = shutdown
         self.stop_me = stop_me
+        self.level = 0
+        self.trace = None
+        self.players = []
         self.sounds = sounds
         self.adc = Circle()
         self.sampler = Sampler()
 
+    def copy(self):
+        """ A context for one of several players rendering side 
+            by side. It shares everything with this one except the 
+            counters each sequence keeps for itself: tick, level 
+            and trace.
+        """
+        cdef EventContext ctx = EventContext.__new__(EventContext)
+        ctx.before = self.before
+        ctx.m = self.m
+        ctx.p = self.p
+        ctx.s = self.s
+        ctx.client = self.client
+        ctx.instrument_name = self.instrument_name
+        ctx.running = self.running
+        ctx.shutdown = self.shutdown
+        ctx.stop_me = self.stop_me
+        ctx.bus = self.bus
+        ctx.sounds = self.sounds
+        ctx.count = self.count
+        ctx.tick = 0
+        ctx.level = 0
+        ctx.trace = None
+        ctx.players = []
+        ctx.adc = self.adc
+        ctx.sampler = self.sampler
+        return ctx
+
     def msg(self, msg):
         if self.client is not None:
             self.client.send_cmd(msg)
@@ -125,7 +304,7 @@ cdef class EventContext:
             params.update(kwargs)
 
         if self.client is not None:
-            self.client.send_cmd([names.PLAY_INSTRUMENT, instrument_name, params])
+            self.client.send_nowait([names.PLAY_INSTRUMENT, instrument_name, params])
 
     def log(self, msg):
         logger.info(msg)
@@ -134,32 +313,63 @@ cdef class EventContext:
         return self.p._params
 
 cdef class Instrument:
-    def __init__(self, str name, str path, object renderer, object shutdown):
+    def __init__(self, str name, str path, object renderer, object shutdown, str digest=None, object error=None):
         self.name = name
         self.path = path
         self.renderer = renderer
+        self.digest = digest
+        self.error = error
         self.sounds = self.load_sounds()
         self.shutdown = shutdown
 
     def reload(self):
-        #logger.info('Reloading instrument %s from %s' % (self.name, self.path))
+        """ Run the script again if it has changed since it was 
+            last loaded. The new module only replaces the old one 
+            once it has run without errors. Returns True if the 
+            instrument changed.
+        """
+        try:
+            digest, code = modules.compile(self.path)
+        except (OSError, SyntaxError) as e:
+            logger.error('Could not reload instrument %s: %s', self.name, e)
+            self.error = str(e)
+            return False
+
+        if digest == self.digest:
+            self.error = None
+            return False
+
+        logger.info('Reloading instrument %s from %s', self.name, self.path)
         spec = importlib.util.spec_from_file_location(self.name, self.path)
-        if spec is not None:
-            renderer = importlib.util.module_from_spec(spec)
-            try:
-                spec.loader.exec_module(renderer)
-            except Exception as e:
-                logger.exception('Error loading instrument module: %s' % str(e))
-
-            self.renderer = renderer
-        else:
+        if spec is None:
             logger.error(self.path)
+            return False
+
+        renderer = importlib.util.module_from_spec(spec)
+        try:
+            exec(code, renderer.__dict__)
+        except Exception as e:
+            logger.exception('Error loading instrument module: %s', str(e))
+            self.error = str(e)
+            return False
+
+        if getattr(renderer, 'SOUNDS', None) != getattr(self.renderer, 'SOUNDS', None):
+            self.sounds = self.load_sounds(renderer)
+
+        self.renderer = renderer
+        self.digest = digest
+        self.error = None
 
-    def load_sounds(self):
-        if hasattr(self.renderer, 'SOUNDS') and isinstance(self.renderer.SOUNDS, list):
-            return [ dsp.read(snd) for snd in self.renderer.SOUNDS ]
-        elif hasattr(self.renderer, 'SOUNDS') and isinstance(self.renderer.SOUNDS, dict):
-            return { k: dsp.read(snd) for k, snd in self.renderer.SOUNDS.items() }
+        return True
+
+    def load_sounds(self, renderer=None):
+        if renderer is None:
+            renderer = self.renderer
+
+        if hasattr(renderer, 'SOUNDS') and isinstance(renderer.SOUNDS, list):
+            return [ soundcache.read(snd) for snd in renderer.SOUNDS ]
+        elif hasattr(renderer, 'SOUNDS') and isinstance(renderer.SOUNDS, dict):
+            return { k: soundcache.read(snd) for k, snd in renderer.SOUNDS.items() }
 
         return None
 
@@ -199,6 +409,7 @@ cdef class Instrument:
                     sounds=self.sounds,
                     midi_devices=device_aliases, 
                     midi_maps=midi_maps, 
+                    snapshot=getattr(self.renderer, 'SNAPSHOT', False),
                 )
 
 
@@ -208,16 +419,65 @@ class InstrumentNotFoundError(Exception):
         self.message = 'No instrument named %s found' % instrument_name
 
 class InstrumentHandler(FileSystemEventHandler):
-    def __init__(self, load_q, orc_path, numrenderers):
+    """ Watches the orc directory and calls reload(name, path) 
+        once a script has been saved.
+
+        Editors often touch a file several times for one save, 
+        so reload is only called after a script has been quiet 
+        for `delay` seconds.
+    """
+    def __init__(self, reload, orc_path, delay=DEFAULT_RELOAD_DELAY):
         super(InstrumentHandler, self).__init__()
-        self.load_q = load_q
+        self.reload = reload
         self.orc_path = orc_path
-        self.numrenderers = numrenderers
+        self.delay = delay
+        self.timers = {}
+        self.lock = threading.Lock()
+
+    def changed(self, path):
+        if path[-3:] != '.py':
+            return
+
+        with self.lock:
+            timer = self.timers.get(path, None)
+            if timer is not None:
+                timer.cancel()
+
+            timer = threading.Timer(self.delay, self.fire, args=(path,))
+            timer.daemon = True
+            self.timers[path] = timer
+            timer.start()
+
+    def fire(self, path):
+        with self.lock:
+            self.timers.pop(path, None)
+
+        if not os.path.exists(path):
+            return
+
+        instrument_name = os.path.basename(path)[:-3]
+        try:
+            self.reload(instrument_name, path)
+        except Exception as e:
+            logger.exception('Could not reload %s: %s', instrument_name, e)
+
+    def cancel(self):
+        with self.lock:
+            for timer in self.timers.values():
+                timer.cancel()
+            self.timers = {}
 
     def on_modified(self, event):
-        logger.debug('updated %s' % event)
-        if event.src_path[-3:] == '.py':
-            instrument_name = os.path.basename(event.src_path).replace('.py', '')
-            for _ in range(self.numrenderers):
-                self.load_q.put((instrument_name, event.src_path))
+        logger.debug('updated %s', event)
+        if not event.is_directory:
+            self.changed(event.src_path)
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.changed(event.src_path)
+
+    def on_moved(self, event):
+        # Some editors save by writing a new file and renaming it
+        if not event.is_directory:
+            self.changed(event.dest_path)
 
@@ -0,0 +1,12 @@
+#cython: language_level=3
+
+cdef class ObjectRing:
+    cdef list slots
+    cdef unsigned long capacity
+    cdef unsigned long head
+    cdef unsigned long tail
+    cdef public unsigned long dropped
+
+    cpdef bint push(ObjectRing self, object item)
+    cpdef object pop(ObjectRing self)
+    cpdef unsigned long size(ObjectRing self)
@@ -0,0 +1,48 @@
+#cython: language_level=3
+
+cdef class ObjectRing:
+    """ Bounded single-producer / single-consumer ring of
+        Python objects for handing things between threads
+        without locks.
+
+        The producer only ever moves `tail` and the consumer
+        only ever moves `head`. A slot is filled before the
+        tail is published and emptied before the head is,
+        so neither side ever waits on the other. Pushing to
+        a full ring drops the item and counts it instead of
+        blocking.
+    """
+    def __cinit__(self, unsigned long capacity):
+        self.capacity = max(capacity, 1)
+        self.slots = [None] * self.capacity
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.size()
+
+    cpdef bint push(ObjectRing self, object item):
+        if self.tail - self.head >= self.capacity:
+            self.dropped += 1
+            return False
+
+        self.slots[self.tail % self.capacity] = item
+        self.tail += 1
+        return True
+
+    cpdef object pop(ObjectRing self):
+        """ Returns the oldest item, or None when empty
+        """
+        cdef unsigned long pos
+        if self.head == self.tail:
+            return None
+
+        pos = self.head % self.capacity
+        item = self.slots[pos]
+        self.slots[pos] = None
+        self.head += 1
+        return item
+
+    cpdef unsigned long size(ObjectRing self):
+        return self.tail - self.head
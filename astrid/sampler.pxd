@@ -2,11 +2,23 @@
 
 from pippi.soundbuffer cimport SoundBuffer
 
+# Every bank file starts with four int64 values: the length
+# of the bank in frames, its channel count, its samplerate
+# and the number of frames the file has room for.
+cdef enum:
+    LENGTH = 0
+    CHANNELS = 1
+    SAMPLERATE = 2
+    CAPACITY = 3
+    HEADER_SIZE = 4
+
 cdef class Sampler:
-    cdef object redis
+    cdef dict banks
 
     cpdef void write(Sampler self, str bank, SoundBuffer buf)
-    cpdef void dub(Sampler self, str bank, SoundBuffer buf)
+    cpdef void dub(Sampler self, str bank, SoundBuffer buf, long long offset=*, double feedback=*)
     cpdef SoundBuffer read(Sampler self, str bank)
     cpdef bint has(Sampler self, str bank)
     cpdef void clear(Sampler self, str bank)
+    cdef object open(Sampler self, str bank)
+    cdef object grow(Sampler self, str bank, long long capacity)
@@ -1,10 +1,14 @@
 #cython: language_level=3
 
-import redis
-import msgpack
+import mmap
+import os
+import uuid
 import numpy as np
 from pippi.soundbuffer cimport SoundBuffer
-from astrid.logger import logger
+from . import shm
+from astrid.logger import get_logger
+
+logger = get_logger('sampler')
 
 # Low density patterns at first, fill in down to fast pulse
 # x              x     x              x  x         x 
@@ -17,57 +21,140 @@ from astrid.logger import logger
 # Finish all instrument scripts & MIDI hookups
 # Don't wory about structure, transitions too much
 
+def bank_name(str bank):
+    return 'bank-%s' % bank.replace(os.sep, '_')
+
+def map_bank(object mapped):
+    """ Header and frame views of a mapped bank file
+    """
+    header = np.ndarray((HEADER_SIZE,), dtype='q', buffer=mapped)
+    frames = np.ndarray((header[CAPACITY], header[CHANNELS]), dtype='d', buffer=mapped, offset=HEADER_SIZE * sizeof(double))
+    return header, frames
+
+def create_bank(str name, object frames, int samplerate):
+    """ Write frames to a new bank file called `name` 
+        under a temporary name, then move it into place
+    """
+    cdef long long length = <long long>frames.shape[0]
+    cdef int channels = <int>frames.shape[1]
+    cdef str tmp = '%s.%s' % (name, uuid.uuid4().hex)
+
+    mapped = shm.create(tmp, (HEADER_SIZE + length * channels) * sizeof(double))
+    header = np.ndarray((HEADER_SIZE,), dtype='q', buffer=mapped)
+    header[:] = (length, channels, samplerate, length)
+    header, views = map_bank(mapped)
+    views[:] = frames
+    del header, views
+    mapped.close()
+
+    os.replace(shm.path(tmp), shm.path(name))
+
 cdef class Sampler:
+    """ Sound banks stored in memory mapped files under /dev/shm.
+
+        Every process maps the same file, so reading a bank
+        maps it copy-on-write with nothing to fetch, decode 
+        or copy up front. Writing a bank builds a new file 
+        and renames it over the old one, so readers never see 
+        a half written bank.
+    """
     def __cinit__(self):
-        self.redis = redis.StrictRedis(host='localhost', port=6379, db=0)
+        self.banks = {}
+
+    cdef object open(Sampler self, str bank):
+        """ Returns the (header, frames) views of a bank,
+            or None if there is no such bank. Mappings are
+            reused until the bank file is replaced.
+        """
+        try:
+            inode = os.stat(shm.path(bank_name(bank))).st_ino
+        except FileNotFoundError:
+            self.banks.pop(bank, None)
+            return None
+
+        cached = self.banks.get(bank, None)
+        if cached is not None and cached[0] == inode:
+            header, frames = cached[1]
+            if frames.shape[0] == header[CAPACITY]:
+                return cached[1]
+            # The bank has grown since we mapped it
+
+        mapped = shm.attach(bank_name(bank))
+        if mapped is None:
+            return None
+
+        views = map_bank(mapped)
+        self.banks[bank] = (inode, views)
+        return views
 
     cpdef void write(Sampler self, str bank, SoundBuffer buf):
-        self.redis.set(bank, msgpack.packb({
-            'l': len(buf), 
-            's': buf.samplerate, 
-            'c': buf.channels,
-            'f': bytes(buf.frames), 
-        }))
+        create_bank(bank_name(bank), np.asarray(buf.frames), buf.samplerate)
+
+    cdef object grow(Sampler self, str bank, long long capacity):
+        """ Extend a bank file in place to hold `capacity` frames
+            and return the new views. Mappings held elsewhere stay 
+            valid and are remapped on their next read.
+        """
+        header, frames = self.open(bank)
+        os.truncate(shm.path(bank_name(bank)), (HEADER_SIZE + capacity * header[CHANNELS]) * sizeof(double))
+        header[CAPACITY] = capacity
+        return self.open(bank)
+
+    cpdef void dub(Sampler self, str bank, SoundBuffer buf, long long offset=0, double feedback=1):
+        """ Mix buf into a bank in place, starting `offset` frames
+            into the bank. The existing frames under buf are scaled 
+            by `feedback` first. The bank grows if buf runs past the 
+            end of it, and is created if it doesn't exist yet.
+            The offset can't be negative.
+        """
+        if offset < 0:
+            raise ValueError('dub offset %s is negative' % offset)
+
+        cdef long long length = <long long>len(buf.frames)
+        cdef long long end = offset + length
+        cdef int channels
+        cdef object src = np.asarray(buf.frames)
+
+        views = self.open(bank)
+        if views is None:
+            self.write(bank, SoundBuffer(np.zeros((end, src.shape[1]), dtype='d'), channels=src.shape[1], samplerate=buf.samplerate))
+            views = self.open(bank)
+
+        header, frames = views
+        if end > header[CAPACITY]:
+            # Leave room to keep overdubbing past the end without 
+            # growing the file every time
+            header, frames = self.grow(bank, max(end, header[CAPACITY] * 2))
+
+        channels = <int>header[CHANNELS]
+        if src.shape[1] != channels:
+            src = src[:, np.arange(channels) % src.shape[1]]
 
-    cpdef void dub(Sampler self, str bank, SoundBuffer buf):
-        pass
+        region = frames[offset:end]
+        if feedback != 1:
+            region *= feedback
+        region += src
+
+        header[LENGTH] = max(header[LENGTH], end)
 
     cpdef SoundBuffer read(Sampler self, str bank):
-        s = msgpack.unpackb(self.redis.get(bank))
-        #logger.info('READ %s' % s.keys())
-        #return SoundBuffer()
-        f = np.ndarray((s[b'l'], s[b'c']), dtype='d', buffer=bytearray(s[b'f']))
-        return SoundBuffer(f, channels=s[b'c'], samplerate=s[b's'])
+        """ The bank on its own copy-on-write mapping. Voices are 
+            free to change it in place without touching the bank, 
+            and only the pages they write get copied. Pages a voice 
+            hasn't written still follow the file, so a dub can show 
+            up in a sound read before it.
+        """
+        mapped = shm.attach(bank_name(bank), mmap.ACCESS_COPY)
+        if mapped is None:
+            logger.error('No bank named %s', bank)
+            return SoundBuffer()
+
+        header, frames = map_bank(mapped)
+        return SoundBuffer(frames[:header[LENGTH]], channels=header[CHANNELS], samplerate=header[SAMPLERATE])
 
     cpdef bint has(Sampler self, str bank):
-        return self.redis.exists(bank) > 0
+        return os.path.exists(shm.path(bank_name(bank)))
 
     cpdef void clear(Sampler self, str bank):
-        self.redis.unlink(bank)
-
-
-    """
-    cpdef void write(Sampler self, double[:,:] block):
-        self.redis.lpush(self.name, bytes(block))
-        self.redis.ltrim(self.name, 0, self.maxblocks-1)
-
-    cpdef SoundBuffer read(Sampler self, double length, tuple channels=None, double offset=0):
-        if channels is None:
-            channels = (1,2)
-        cdef int framelength = <int>(length * self.samplerate)
-        cdef int numblocks = framelength // self.blocksize
-        cdef double[:,:] out = np.zeros((framelength, len(channels)), dtype='d')  
-        cdef double[:,:] block
-        cdef int o = <int>(offset * self.samplerate) // self.blocksize
-        o = min(o, (framelength - self.blocksize) // self.blocksize)
-        cdef int i = (numblocks * self.blocksize) - self.blocksize
-        for b in self.redis.lrange(self.name, o, o+numblocks-1):
-            block = np.ndarray((self.blocksize, self.channels), dtype='d', buffer=bytearray(b))
-            for j in range(self.blocksize):
-                for c in range(len(channels)):
-                    out[i+j,c] = block[j,channels[c]-1]
-
-            i -= self.blocksize
-
-        return SoundBuffer(out, channels=len(channels), samplerate=self.samplerate)
-    """
+        self.banks.pop(bank, None)
+        shm.unlink(bank_name(bank))
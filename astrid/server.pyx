@@ -2,6 +2,8 @@
 
 from contextlib import contextmanager
 import collections
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 import os
 import time
 import threading
@@ -16,19 +18,26 @@ import numpy as np
 import zmq
 import redis
 
+from . import backends
 from . import midi
 from . cimport io
 from . import io
 from . import orc
 from . import names
 from . import voices
-from .defaults import DEFAULT_CHANNELS
-from .logger import logger
+from .defaults import DEFAULT_CHANNELS, DEFAULT_COMMAND_WORKERS, DEFAULT_NUMRENDERERS, DEFAULT_POLYPHONY, DEFAULT_STARTUP_TIMEOUT, DEFAULT_VOICE_RING_SIZE
+from .logger import get_logger, set_level
+from .clock cimport FrameClock
+from .mixer cimport AstridMixer
+from .ring cimport ObjectRing
+from .stats cimport CallbackStats
+from .stats import LatencyStats
 from .circle import Circle
 from .sampler import Sampler
 from pippi import dsp
 from pippi.soundbuffer cimport SoundBuffer
-import jack
+
+logger = get_logger('server')
 
 BANNER = """
  █████╗ ███████╗████████╗██████╗ ██╗██████╗ 
@@ -39,23 +48,83 @@ BANNER = """
 ╚═╝  ╚═╝╚══════╝   ╚═╝   ╚═╝  ╚═╝╚═╝╚═════╝ 
 """                         
 
+# Commands that can take a while: these run on the worker 
+# pool so they don't hold up everything else
+SLOW_COMMANDS = set([
+    names.CLEAR_BANK, 
+    names.REC_BANK, 
+    names.DUB_BANK,
+])
+
 
 class AstridServer:
-    def __init__(self):
+    def __init__(self, numrenderers=DEFAULT_NUMRENDERERS, affinity=False, polyphony=DEFAULT_POLYPHONY, preload=True, backend=None):
+        """ affinity may be True to pin each renderer to its own CPU,
+            or a list with a set of CPUs for each renderer. polyphony 
+            is the most voices each renderer will run at once. preload 
+            is a list of instruments every renderer loads at startup, 
+            or True for every instrument in the orc directory. backend 
+            runs the audio callback, and defaults to JACK.
+        """
         self.cwd = os.getcwd()
+        self.instruments = {}
+        self.numrenderers = numrenderers
+        self.polyphony = polyphony
+        self.preload = preload
+        self.backend = backend
+        self.ready = threading.Event()
+        self.latency = LatencyStats()
+        self.trace_ids = itertools.count()
+        self.startup_times = {'phases': {}, 'renderers': {}}
+        self.affinity = affinity
         self.listeners = {}
         self.channels = DEFAULT_CHANNELS
 
+        # Command opcodes from names to their handlers
+        self.handlers = {
+            names.LOAD_INSTRUMENT: self.handle_load_instrument,
+            names.RELOAD_INSTRUMENT: self.handle_load_instrument,
+            names.REGISTER_PORT: self.handle_register_port,
+            names.SHUTDOWN: self.handle_shutdown,
+            names.STOP_ALL_VOICES: self.handle_stop_all_voices,
+            names.STOP_INSTRUMENT: self.handle_stop_instrument,
+            names.LIST_INSTRUMENTS: self.handle_list_instruments,
+            names.PLAY_INSTRUMENT: self.handle_play_instrument,
+            names.SET_VALUE: self.handle_set_value,
+            names.PIN_INSTRUMENT: self.handle_pin_instrument,
+            names.STARTUP_TIMES: self.handle_startup_times,
+            names.SET_LOG_LEVEL: self.handle_set_log_level,
+            names.CALLBACK_STATS: self.handle_callback_stats,
+            names.LATENCY: self.handle_latency,
+            names.CLEAR_BANK: self.handle_clear_bank,
+            names.REC_BANK: self.handle_rec_bank,
+            names.DUB_BANK: self.handle_dub_bank,
+        }
+
     @contextmanager
     def msg_context(self):
         self.context = zmq.Context()
-        self.msgsock = self.context.socket(zmq.REP)
+        self.msgsock = self.context.socket(zmq.ROUTER)
         address = 'tcp://*:{}'.format(names.MSG_PORT)
         self.msgsock.bind(address)
-        logger.info('^_-               Listening on %s' % address)
+        logger.info('^_-               Listening on %s', address)
+
+        # Commands that don't want a reply
+        self.pushsock = self.context.socket(zmq.PULL)
+        self.pushsock.bind('tcp://*:{}'.format(names.PUSH_PORT))
+
+        # Workers hand their replies back through this queue 
+        # and poke the pipe to wake up the command loop
+        self.workers = ThreadPoolExecutor(max_workers=DEFAULT_COMMAND_WORKERS)
+        self.replies = queue.SimpleQueue()
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        self.bank_lock = threading.Lock()
 
         yield None
 
+        self.workers.shutdown(wait=True)
+        os.close(self.wakeup_r)
+        os.close(self.wakeup_w)
         self.context.destroy()
 
     def cleanup(self):
@@ -65,35 +134,151 @@ class AstridServer:
             if listener is not None:
                 listener.join()
 
+        self.instrument_handler.cancel()
         self.instrument_observer.stop()
         self.instrument_observer.join()
+        self.status_listener.join()
 
-        self.jack_client.deactivate()
-        self.jack_client.close()
+        self.backend.deactivate()
+        self.backend.close()
+        self.circle.close()
 
         logger.info('all cleaned up!')
 
+    def renderer_cpus(self, renderer):
+        if not self.affinity:
+            return None
+
+        if self.affinity is True:
+            cpus = sorted(os.sched_getaffinity(0))
+            return set([ cpus[renderer % len(cpus)] ])
+
+        return set(self.affinity[renderer % len(self.affinity)])
+
     def load_instrument(self, instrument_name):
+        """ Check that the script compiles, then tell every 
+            renderer to load it. Renderers report back on the 
+            status queue.
+        """
         instrument_path = os.path.join(self.cwd, names.ORC_DIR, '%s.py' % instrument_name)
         if not os.path.exists(instrument_path):
-            logger.error('Could not find an instrument file at location %s' % instrument_path)
+            logger.error('Could not find an instrument file at location %s', instrument_path)
+            return names.MSG_INVALID_INSTRUMENT
+
+        try:
+            orc.modules.compile(instrument_path)
+        except SyntaxError as e:
+            logger.error('Not loading %s: %s', instrument_name, e)
             return names.MSG_INVALID_INSTRUMENT
 
-        #for _ in range(self.numrenderers):
-        #    self.load_q.put((instrument_name, instrument_path))
         self.redis.publish(names.LOAD_INSTRUMENT, instrument_name)
+        self.router.loaded(instrument_name)
 
         return names.MSG_OK
 
-    def wait_for_buffers(self, buffers, buf_q, buflock):
+    def reload_instrument(self, instrument_name, instrument_path):
+        """ Called by the orc directory watcher once a save has settled
+        """
+        if os.path.dirname(os.path.abspath(instrument_path)) != os.path.join(self.cwd, names.ORC_DIR):
+            # Scripts in subdirectories aren't instruments
+            return
+
+        logger.info('Reloading %s after a save', instrument_name)
+        self.load_instrument(instrument_name)
+
+    def wait_for_status(self, status_q):
+        """ Keep track of which renderers have each instrument 
+            loaded, log the ones that failed, and note when each 
+            renderer has finished warming up.
+        """
+        while True:
+            msg = status_q.get()
+            if msg == names.SHUTDOWN:
+                break
+
+            if msg[0] == names.LOAD_INSTRUMENT:
+                renderer, instrument_name, error = msg[1:]
+                self.instruments.setdefault(instrument_name, {})[renderer] = error
+                if error is not None:
+                    logger.error('Renderer %s could not load %s: %s', renderer, instrument_name, error)
+
+            elif msg[0] == names.RENDERER_READY:
+                renderer, timings = msg[1:]
+                # msgpack only allows string map keys by default
+                self.startup_times['renderers'][str(renderer)] = timings
+                if len(self.startup_times['renderers']) == self.numrenderers:
+                    self.ready.set()
+
+    def discover_instruments(self):
+        """ Every instrument script in the orc directory
+        """
+        orc_fullpath = os.path.join(self.cwd, names.ORC_DIR)
+        try:
+            filenames = os.listdir(orc_fullpath)
+        except FileNotFoundError:
+            return []
+
+        return sorted([ f[:-3] for f in filenames if f.endswith('.py') and not f.startswith('_') ])
+
+    def mark(self, phase, start):
+        """ Record how long a startup phase took and start the next one
+        """
+        now = time.monotonic()
+        self.startup_times['phases'][phase] = now - start
+        return now
+
+    def wait_for_buffers(self, buf_q, incoming):
         while True:
-            msg = buf_q.get()
+            try:
+                msg = buf_q.get(timeout=1)
+            except queue.Empty:
+                self.reap()
+                continue
+
             if msg == names.SHUTDOWN:
                 break
 
-            with buflock:
-                logger.info('Adding to buf q: %s %s %s' % (msg.start_time, msg.onset, msg.pos))
-                buffers += [ msg ]
+            if isinstance(msg, tuple):
+                msg = io.attach(msg)
+
+            if msg.trace is not None:
+                msg.trace['buffered'] = time.monotonic()
+
+            if not incoming.push(msg):
+                msg.release()
+                logger.warning('Voice ring is full, dropped buffer (%s dropped so far)', incoming.dropped)
+                continue
+
+            logger.debug('Adding to buf q: %s %s %s', msg.start_time, msg.onset, msg.pos)
+            self.reap()
+
+        # RUNNING is already False, so the audio callback has stopped 
+        # taking voices: release the ones it never got to, and any 
+        # that were sent after the shutdown, so their slabs don't 
+        # stay behind in /dev/shm
+        node = incoming.pop()
+        while node is not None:
+            node.release()
+            node = incoming.pop()
+
+        while True:
+            try:
+                msg = buf_q.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(msg, tuple):
+                io.attach(msg).release()
+
+        self.mixer.clear()
+        self.reap()
+
+    def reap(self):
+        """ Release finished voices and collect the traces 
+            of the ones that started playing
+        """
+        self.mixer.reap()
+        for trace in self.mixer.traces():
+            self.latency.add(trace)
 
     def wait_for_params(self, param_q):
         bus = redis.StrictRedis(host='localhost', port=6379, db=0)
@@ -103,214 +288,365 @@ class AstridServer:
             if msg == names.SHUTDOWN:
                 break
 
-            logger.info('GOT PARAM UPDATE %s' % msg)
+            logger.debug('GOT PARAM UPDATE %s', msg)
             for m in msg:
                 try:
                     k, v = tuple(m.split(':'))
-                    bus.set(k, v)
                 except ValueError as e:
-                    logger.exception('Bad param: %s' % m)
+                    logger.exception('Bad param: %s', m)
+                    continue
+
+                # Store the value for processes that haven't cached it 
+                # yet, and push it to the ones that have.
+                pipe = bus.pipeline()
+                pipe.set(k, v)
+                pipe.publish(names.PARAM_UPDATE, msgpack.packb([k, v]))
+                pipe.execute()
+
+    def dispatch(self, envelope, frame):
+        """ Run the commands in a message frame and send back the 
+            reply. Commands from the push socket have no envelope 
+            and get no reply.
+        """
+        try:
+            cmds, legacy = names.decode(msgpack.unpackb(frame))
+        except Exception as e:
+            # Whatever a client sends, the command loop keeps going
+            logger.error('Bad message %r: %s', frame, e)
+            cmds, legacy = [], True
+
+        # Fast commands run here, so routing state is only ever
+        # touched on this thread. Slow ones fill in their replies 
+        # on the worker pool, which sends the whole batch's reply.
+        replies = []
+        slow = []
+        for op, args in cmds:
+            if op in SLOW_COMMANDS:
+                slow.append((len(replies), op, args))
+                replies.append(None)
+            else:
+                replies.extend(self.handle_cmds([(op, args)]))
+
+        if len(slow) > 0:
+            self.workers.submit(self.run_slow_cmds, envelope, slow, replies, legacy)
+        elif envelope is not None:
+            self.send_reply(envelope, replies, legacy)
+
+    def run_slow_cmds(self, envelope, slow, replies, legacy):
+        cmds = [ (op, args) for _, op, args in slow ]
+        try:
+            done = self.handle_cmds(cmds)
+        except Exception as e:
+            logger.exception('Commands %s failed: %s', cmds, e)
+            done = [ names.MSG_BAD_PARAMS for _ in cmds ]
+
+        for (i, _, _), reply in zip(slow, done):
+            replies[i] = reply
+
+        if envelope is not None:
+            self.replies.put((envelope, replies, legacy))
+            os.write(self.wakeup_w, b'.')
+
+    def send_replies(self):
+        os.read(self.wakeup_r, 4096)
+        while True:
+            try:
+                envelope, replies, legacy = self.replies.get_nowait()
+            except queue.Empty:
+                break
+            self.send_reply(envelope, replies, legacy)
+
+    def send_reply(self, envelope, replies, legacy):
+        if legacy:
+            # Old style clients send one command and get one reply
+            reply = replies[0] if len(replies) > 0 else names.MSG_BAD_PARAMS
+        else:
+            reply = replies
+        self.msgsock.send_multipart(envelope + [msgpack.packb(reply)])
+
+    def handle_cmds(self, cmds):
+        replies = []
+        for op, args in cmds:
+            logger.debug((op, args))
+            handler = self.handlers.get(op, None)
+            if handler is None:
+                logger.error('Unknown command %s %s', op, args)
+                replies.append(names.MSG_BAD_PARAMS)
+                continue
+
+            try:
+                reply = handler(args)
+            except Exception as e:
+                logger.exception('Command %s %s failed: %s', names.cton(op), args, e)
+                reply = names.MSG_BAD_PARAMS
+
+            # Empty summaries and lists are still replies
+            replies.append(names.MSG_OK if reply is None else reply)
+
+        return replies
+
+    def handle_load_instrument(self, cmd):
+        if len(cmd) > 0:
+            return self.load_instrument(cmd[0])
+
+    def handle_register_port(self, cmd):
+        if len(cmd) > 0:
+            try:
+                port_name, port_channels = cmd
+                logger.debug('REGISTER_PORT %s %s', port_name, port_channels)
+            except (TypeError, ValueError):
+                return names.MSG_BAD_PARAMS
+
+            # Check for a port with this name that already exists
+            # If not, register the port with the audio backend
+            # Connect the port to the master output, mapping ports 
+            # to channels incrementally from hardware out 0
+
+    def handle_shutdown(self, cmd):
+        logger.info('SHUTDOWN %s', cmd)
+        self.router.put_all(names.SHUTDOWN)
+        self.status_q.put(names.SHUTDOWN)
+
+        self.RUNNING = False
+        self.shutdown.set()
+        self.buf_q.put(names.SHUTDOWN)
+        self.redis.publish(names.SHUTDOWN, names.SHUTDOWN)
+
+    def handle_stop_all_voices(self, cmd):
+        logger.info('STOP_ALL_VOICES %s', cmd)
+        self.redis.publish(names.STOP_ALL_VOICES, names.STOP_ALL_VOICES)
+
+    def handle_stop_instrument(self, cmd):
+        logger.info('STOP_INSTRUMENT %s', cmd)
+        self.redis.publish(names.STOP_INSTRUMENT, cmd[0])
+
+    def handle_set_log_level(self, cmd):
+        """ log_level <level> or log_level <subsystem> <level>
+        """
+        if len(cmd) == 1:
+            subsystem, level = None, cmd[0]
+        elif len(cmd) == 2:
+            subsystem, level = cmd
+        else:
+            return names.MSG_BAD_PARAMS
+
+        try:
+            set_level(level, subsystem)
+        except (TypeError, ValueError) as e:
+            logger.error('Bad log level %s: %s', cmd, e)
+            return names.MSG_BAD_PARAMS
+
+        # Renderers keep their own loggers
+        self.redis.publish(names.SET_LOG_LEVEL, msgpack.packb([subsystem, level]))
+
+    def handle_latency(self, cmd):
+        return self.latency.summary(cmd[0] if len(cmd) > 0 else None)
+
+    def handle_callback_stats(self, cmd):
+        return self.stats.summary()
+
+    def handle_startup_times(self, cmd):
+        return self.startup_times
+
+    def handle_list_instruments(self, cmd):
+        logger.info('LIST_INSTRUMENTS %s', cmd)
+        instruments = []
+        for name, renderers in sorted(self.instruments.items()):
+            errors = [ error for error in renderers.values() if error is not None ]
+            if len(errors) > 0:
+                name = '%s (failed: %s)' % (name, errors[0])
+            instruments.append(name)
+        return instruments
+
+    def handle_play_instrument(self, cmd):
+        if len(cmd) == 0:
+            return names.MSG_BAD_PARAMS
+
+        trace = {'id': next(self.trace_ids), 'instrument': cmd[0], 'received': time.monotonic()}
+        self.router.route(cmd, trace)
+
+    def handle_pin_instrument(self, cmd):
+        logger.info('PIN_INSTRUMENT %s', cmd)
+        try:
+            instrument_name, *renderers = cmd
+            self.router.pin(instrument_name, [ int(r) for r in renderers ])
+        except ValueError:
+            return names.MSG_BAD_PARAMS
+
+    def handle_set_value(self, cmd):
+        logger.info('SET_VALUE %s', cmd)
+        self.param_q.put(cmd)
+
+    def handle_clear_bank(self, cmd):
+        logger.info('CLEAR_BANK %s', cmd)
+        with self.bank_lock:
+            for b in cmd:
+                self.sampler.clear(b)
+
+    def handle_rec_bank(self, cmd):
+        logger.info('REC_BANK %s', cmd)
+        b, *params = cmd
+        try:
+            rtime = float(params[0]) if len(params) > 0 else 1
+        except ValueError:
+            return names.MSG_BAD_PARAMS
+
+        snd = self.circle.read(rtime)
+        with self.bank_lock:
+            self.sampler.write(b, snd)
+
+    def handle_dub_bank(self, cmd):
+        logger.info('DUB_BANK %s', cmd)
+        b, *params = cmd
+        try:
+            rtime = float(params[0]) if len(params) > 0 else 1
+            offset = float(params[1]) if len(params) > 1 else 0
+            feedback = float(params[2]) if len(params) > 2 else 1
+        except ValueError:
+            return names.MSG_BAD_PARAMS
+
+        if offset < 0:
+            return names.MSG_BAD_PARAMS
+
+        snd = self.circle.read(rtime)
+        with self.bank_lock:
+            self.sampler.dub(b, snd, <long long>(offset * self.samplerate), feedback)
 
     def run(self):
+        cdef CallbackStats stats
         logger.info(BANNER)
+        started = time.monotonic()
+        t = started
 
-        self.jack_client = jack.Client('astrid')
-        self.load_q = mp.Queue()
-        self.play_q = mp.Queue()
+        if self.backend is None:
+            self.backend = backends.JackBackend()
+        self.status_q = mp.Queue()
+        self.router = voices.RendererRouter(self.numrenderers)
         self.param_q = mp.Queue()
         self.buf_q = mp.Queue()
-        self.buflock = mp.Lock()
         self.shutdown = mp.Event()
-        self.numrenderers = 8
         self.renderers = []
-        self.buffers = []
+        self.incoming = ObjectRing(DEFAULT_VOICE_RING_SIZE)
         self.redis = redis.StrictRedis(host='localhost', port=6379, db=0)
         self.redis.pubsub()
+        self.clock = FrameClock()
+        self.clock.set_samplerate(self.backend.samplerate)
 
 
-        self.buffer_listener = threading.Thread(target=self.wait_for_buffers, args=(self.buffers, self.buf_q, self.buflock))
-        self.buffer_listener.start()
-
         self.param_listener = threading.Thread(target=self.wait_for_params, args=(self.param_q,))
         self.param_listener.start()
 
+        self.status_listener = threading.Thread(target=self.wait_for_status, args=(self.status_q,))
+        self.status_listener.start()
+
         self.listeners = midi.start_listeners(self.shutdown)
 
+        if self.preload is True:
+            preload = self.discover_instruments()
+        else:
+            preload = list(self.preload or [])
+
+        # Renderers warm up and load the preload 
+        # instruments in parallel with each other
+        t = self.mark('setup', t)
         for i in range(self.numrenderers):
-            r = voices.VoiceHandler(self.play_q, self.load_q, self.buf_q, self.shutdown, self.cwd)
+            r = voices.VoiceHandler(i, self.router.play_qs[i], self.status_q, self.buf_q, self.shutdown, self.cwd, self.clock, self.router.active, self.router.taken, self.renderer_cpus(i), self.polyphony, preload)
             r.start()
             self.renderers += [ r ]
 
-        self.block_size = self.jack_client.blocksize
-        self.channels = len(self.jack_client.outports)
-        self.samplerate = self.jack_client.samplerate
-        self.RUNNING = True
+        for instrument_name in preload:
+            self.router.loaded(instrument_name)
+        t = self.mark('renderers', t)
 
-        # FIXME get number of hardware channels
-        for channel in range(self.channels):
-            self.jack_client.inports.register('input_{0}'.format(channel))
-            self.jack_client.outports.register('output_{0}'.format(channel))
+        self.block_size = self.backend.blocksize
+        self.samplerate = self.backend.samplerate
+        self.channels = self.backend.channels
+        self.RUNNING = True
 
         self.redis.set('SAMPLERATE', self.samplerate)
         self.redis.set('CHANNELS', self.channels)
         self.redis.set('BLOCKSIZE', self.block_size)
 
-        self.circle = Circle()
+        self.circle = Circle(create=True, channels=self.channels, samplerate=self.samplerate)
         self.sampler = Sampler()
+        self.mixer = AstridMixer(self.block_size, self.channels, self.samplerate)
+        self.stats = stats = CallbackStats()
+        stats.set_deadline(self.block_size, self.samplerate)
+
+        self.buffer_listener = threading.Thread(target=self.wait_for_buffers, args=(self.buf_q, self.incoming))
+        self.buffer_listener.start()
+
+        backend = self.backend
+
+        def audio_callback(frames):
+            cdef int active
+            stats.start()
 
-        def jack_callback(frames):
             if not self.RUNNING:
-                for channel, port in enumerate(self.jack_client.outports):
-                    port.get_array().fill(0)
-                raise jack.CallbackExit
-
-            cdef double[:,:] inbuf = np.zeros((self.jack_client.blocksize, self.channels), dtype='d')
-            cdef double[:,:] outbuf = np.zeros((self.jack_client.blocksize, self.channels), dtype='d')
-            cdef double[:,:] next_block
-            cdef int blocklen
-
-            with self.buflock:
-                to_remove = []
-                for b in self.buffers:
-                    if b.done_playing > 0:
-                        to_remove += [ b ]
-                        continue
-                    next_block = b.next_block(self.block_size)
-                    blocklen = <int>len(next_block)
-                    for i in range(blocklen):
-                        for c in range(self.channels):
-                            outbuf[i, c] += next_block[i, c]
-
-                for b in to_remove:
-                    i = self.buffers.index(b)
-                    del self.buffers[i]
-
-            for channel, port in enumerate(self.jack_client.outports):
-                if channel < self.channels:
-                    port.get_array()[:] = np.array(outbuf[:,channel]).astype('f')
-
-            """
-            for channel, port in enumerate(self.jack_client.inports):
-                inblock = port.get_array().astype('d')
-                for i in range(self.block_size):
-                    inbuf[i,channel] = inblock[i]
-
-            self.circle.add(inbuf)
-            """
-
-        self.jack_client.set_process_callback(jack_callback)
+                self.mixer.silence(backend.outports)
+                raise backends.CallbackExit
+
+            self.mixer.take(self.incoming)
+            active = self.mixer.process(backend.outports, frames, self.clock.tick(backend.last_frame_time))
+            self.circle.add_ports(backend.inports, frames)
+            stats.stop(active, self.mixer.retired)
+
+        def blocksize_callback(blocksize):
+            stats.set_deadline(blocksize, self.samplerate)
+
+        def xrun_callback(delay):
+            stats.xrun(delay)
+
+        backend.set_process_callback(audio_callback)
+        backend.set_blocksize_callback(blocksize_callback)
+        backend.set_xrun_callback(xrun_callback)
 
         # Instrument reload listeners watch orc dir for saves
         orc_fullpath = os.path.join(self.cwd, names.ORC_DIR)
-        self.instrument_handler = orc.InstrumentHandler(self.load_q, orc_fullpath, self.numrenderers)
+        self.instrument_handler = orc.InstrumentHandler(self.reload_instrument, orc_fullpath)
         self.instrument_observer = orc.Observer()
         self.instrument_observer.schedule(self.instrument_handler, path=orc_fullpath, recursive=True)
         self.instrument_observer.start()
 
         with self.msg_context():
-            self.jack_client.activate()
-            capture = self.jack_client.get_ports(is_physical=True, is_output=True)
-            if not capture:
-                raise RuntimeError('No physical capture ports')
-
-            for src, dest in zip(capture, self.jack_client.inports):
-                self.jack_client.connect(src, dest)
-
-            playback = self.jack_client.get_ports(is_physical=True, is_input=True)
-            if not playback:
-                raise RuntimeError('No physical playback ports')
-
-            # FIXME -- add interface to zmq cmds for adding and removing synth/voice ports, 
-            # which default to connecting to the master outputs... how to handle runtime 
-            # choice of output port from instrument scripts?
-            for src, dest in zip(self.jack_client.outports, playback):
-                self.jack_client.connect(src, dest)
-
-            while True:
-                reply = None
-                cmd = self.msgsock.recv()
-                #cmd = msgpack.unpackb(cmd, encoding='utf-8')
-                cmd = msgpack.unpackb(cmd)
-                logger.debug(cmd)
-
-                if len(cmd) == 0:
-                    action = None
-                else:
-                    action = cmd.pop(0)
-
-                if names.ntoc(action) == names.LOAD_INSTRUMENT:
-                    if len(cmd) > 0:
-                        reply = self.load_instrument(cmd[0])
-
-                elif names.ntoc(action) == names.RELOAD_INSTRUMENT:
-                    if len(cmd) > 0:
-                        reply = self.load_instrument(cmd[0])
-
-                elif names.ntoc(action) == names.REGISTER_PORT:
-                    if len(cmd) > 0:
+            t = self.mark('mixer', t)
+            if not self.ready.wait(DEFAULT_STARTUP_TIMEOUT):
+                logger.warning('Only %s of %s renderers were ready after %ss', len(self.startup_times['renderers']), self.numrenderers, DEFAULT_STARTUP_TIMEOUT)
+            t = self.mark('preload', t)
+
+            backend.activate()
+            self.mark('audio', t)
+            self.mark('total', started)
+            logger.info('Astrid ready in %.3fs, preloaded %s', self.startup_times['phases']['total'], ', '.join(preload) or 'nothing')
+
+            poller = zmq.Poller()
+            poller.register(self.msgsock, zmq.POLLIN)
+            poller.register(self.pushsock, zmq.POLLIN)
+            poller.register(self.wakeup_r, zmq.POLLIN)
+
+            while self.RUNNING:
+                events = dict(poller.poll())
+
+                if self.wakeup_r in events:
+                    self.send_replies()
+
+                if self.pushsock in events:
+                    while self.RUNNING:
+                        try:
+                            cmd = self.pushsock.recv(zmq.NOBLOCK)
+                        except zmq.Again:
+                            break
+                        self.dispatch(None, cmd)
+
+                if self.msgsock in events:
+                    while self.RUNNING:
                         try:
-                            port_name, port_channels = cmd
-                            print(port_name, port_channels)
-                        except TypeError:
-                            self.msgsock.send(msgpack.packb(names.MSG_BAD_PARAMS))
-                            continue
-
-                        # Check for a port with this name that already exists
-                        # If not, register the port with jack
-                        # Connect the port to the master output, mapping ports 
-                        # to channels incrementally from hardware out 0
-
-                elif names.ntoc(action) == names.SHUTDOWN:
-                    logger.info('SHUTDOWN %s' % cmd)
-                    for _ in range(self.numrenderers):
-                        self.load_q.put(names.SHUTDOWN)
-                        self.play_q.put(names.SHUTDOWN)
-
-                    self.RUNNING = False
-                    self.shutdown.set()
-                    self.msgsock.send(msgpack.packb(names.MSG_OK))
-                    self.redis.publish(names.SHUTDOWN, names.SHUTDOWN)
-                    break
-
-                elif names.ntoc(action) == names.STOP_ALL_VOICES:
-                    logger.info('STOP_ALL_VOICES %s' % cmd)
-                    self.redis.publish(names.STOP_ALL_VOICES, names.STOP_ALL_VOICES)
-
-                elif names.ntoc(action) == names.STOP_INSTRUMENT:
-                    logger.info('STOP_INSTRUMENT %s' % cmd)
-                    self.redis.publish(names.STOP_INSTRUMENT, cmd[0])
-
-                elif names.ntoc(action) == names.LIST_INSTRUMENTS:
-                    logger.info('LIST_INSTRUMENTS %s' % cmd)
-                    reply = [ str(instrument) for name, instrument in self.instruments.items() ]
-
-                elif names.ntoc(action) == names.PLAY_INSTRUMENT:
-                    self.play_q.put(cmd)
-
-                elif names.ntoc(action) == names.SET_VALUE:
-                    logger.info('SET_VALUE %s' % cmd)
-                    self.param_q.put(cmd)
-
-                elif names.ntoc(action) == names.CLEAR_BANK:
-                    logger.info('CLEAR_BANK %s' % cmd)
-                    for b in cmd:
-                        self.redis.unlink(b)
-
-                elif names.ntoc(action) == names.REC_BANK:
-                    logger.info('REC_BANK %s' % cmd)
-                    b, *params = cmd
-                    if len(params) == 0:
-                        rtime = 1
-                    else:
-                        rtime = float(params[0])
-                    self.sampler.write(b, self.circle.read(rtime))
-
-                elif names.ntoc(action) == names.DUB_BANK:
-                    logger.info('DUB_BANK %s' % cmd)
-                    b, *params = cmd
-                    self.sampler.dub(b, self.circle.read(*params))
-
-                self.msgsock.send(msgpack.packb(reply or names.MSG_OK))
+                            # The envelope is the client's identity 
+                            # and the empty delimiter frame from REQ
+                            *envelope, cmd = self.msgsock.recv_multipart(zmq.NOBLOCK)
+                        except zmq.Again:
+                            break
+                        self.dispatch(envelope, cmd)
 
         for r in self.renderers:
             r.join()
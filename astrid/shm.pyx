@@ -0,0 +1,63 @@
+#cython: language_level=3
+
+""" Named shared memory segments for state that lives as long
+    as the server: the input ring, MIDI tables and so on.
+
+    These are plain files under /dev/shm mapped with mmap.
+    Unlike multiprocessing.shared_memory, opening a segment
+    doesn't register it with the resource tracker, so a voice
+    process exiting never unlinks a segment out from under
+    the server.
+"""
+
+import mmap
+import os
+
+SHM_DIR = '/dev/shm'
+
+def path(str name):
+    return os.path.join(SHM_DIR, 'astrid-%s' % name)
+
+def create(str name, long long size):
+    """ Create (or replace) a zero-filled segment and map it
+    """
+    unlink(name)
+    fd = os.open(path(name), os.O_CREAT | os.O_EXCL | os.O_RDWR, 0o600)
+    try:
+        os.ftruncate(fd, size)
+        return mmap.mmap(fd, size)
+    finally:
+        os.close(fd)
+
+def ensure(str name, long long size):
+    """ Map a segment, creating it zero-filled if it doesn't exist.
+        Unlike create, a segment someone else already made is kept.
+    """
+    fd = os.open(path(name), os.O_CREAT | os.O_RDWR, 0o600)
+    try:
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+        return mmap.mmap(fd, size)
+    finally:
+        os.close(fd)
+
+def attach(str name, int access=mmap.ACCESS_WRITE):
+    """ Map an existing segment, or return None if there isn't one.
+        With access=mmap.ACCESS_COPY, writes stay private to this 
+        process and never reach the shared segment.
+    """
+    try:
+        fd = os.open(path(name), os.O_RDWR)
+    except FileNotFoundError:
+        return None
+
+    try:
+        return mmap.mmap(fd, 0, access=access)
+    finally:
+        os.close(fd)
+
+def unlink(str name):
+    try:
+        os.unlink(path(name))
+    except FileNotFoundError:
+        pass
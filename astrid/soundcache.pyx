@@ -0,0 +1,138 @@
+#cython: language_level=3
+
+import fcntl
+import glob
+import hashlib
+import mmap
+import os
+
+import numpy as np
+from pippi import dsp
+from pippi.soundbuffer cimport SoundBuffer
+from . import shm
+from .defaults import DEFAULT_SOUND_CACHE_BUDGET
+from .logger import get_logger
+from .sampler import create_bank, map_bank
+from .sampler cimport LENGTH, SAMPLERATE
+
+logger = get_logger('soundcache')
+
+def segment_name(str digest, str prefix='sound'):
+    return '%s-%s' % (prefix, digest)
+
+class SoundCache:
+    """ Decoded sound files shared by every process.
+
+        Sounds are keyed by the sha1 of the file, so a file is only
+        decoded once no matter how many instruments, processes or
+        paths refer to it. The frames are kept in /dev/shm in the
+        same format as sampler banks, and each process maps them
+        copy-on-write: reads share the same memory, and a voice
+        that changes its buffer in place only changes its own copy.
+
+        When the sounds in /dev/shm go over `budget` bytes, the
+        least recently used ones are removed. Buffers already 
+        read from one can keep using it.
+
+        Segment names start with `prefix`, and eviction and clear
+        only touch segments with the same prefix.
+    """
+    def __init__(self, budget=DEFAULT_SOUND_CACHE_BUDGET, prefix='sound'):
+        self.budget = budget
+        self.prefix = prefix
+        self.digests = {}
+
+    def digest(self, str path):
+        """ sha1 of the file at path, only hashed again when
+            its mtime or size change
+        """
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+        digest = self.digests.get(key, None)
+        if digest is None:
+            h = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+            digest = self.digests[key] = h.hexdigest()
+        return digest
+
+    def read(self, str path):
+        """ A buffer of the sound at path on its own copy-on-write 
+            mapping, so writes to it never show up in other reads
+        """
+        cdef str digest = self.digest(path)
+        cdef str name = segment_name(digest, self.prefix)
+
+        mapped = shm.attach(name, mmap.ACCESS_COPY)
+        if mapped is None:
+            mapped = self.decode(name, path)
+
+        try:
+            # Mark it as recently used for eviction
+            os.utime(shm.path(name))
+        except FileNotFoundError:
+            pass
+
+        header, frames = map_bank(mapped)
+        return SoundBuffer(frames[:header[LENGTH]], channels=frames.shape[1], samplerate=header[SAMPLERATE])
+
+    def decode(self, str name, str path):
+        """ Decode a file into a new segment, unless another
+            process gets there first
+        """
+        with open(shm.path(name + '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            mapped = shm.attach(name, mmap.ACCESS_COPY)
+            if mapped is None:
+                logger.info('Decoding %s into the sound cache', path)
+                snd = dsp.read(path)
+                create_bank(name, np.asarray(snd.frames), snd.samplerate)
+                mapped = shm.attach(name, mmap.ACCESS_COPY)
+                self.evict()
+
+        return mapped
+
+    def evict(self):
+        """ Remove the least recently used sounds from /dev/shm
+            until they fit in the budget
+        """
+        segments = []
+        for path in glob.glob(shm.path(segment_name('*', self.prefix))):
+            if '.' in os.path.basename(path):
+                # Lock files and banks still being written
+                continue
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            segments.append((st.st_mtime, st.st_size, path))
+
+        total = sum([ size for _, size, _ in segments ])
+        for _, size, path in sorted(segments):
+            if total <= self.budget:
+                break
+
+            # Lock files stay behind so two processes never 
+            # decode the same sound at once
+            logger.info('Evicting %s from the sound cache', path)
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for path in glob.glob(shm.path(segment_name('*', self.prefix))):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+# One cache per process, backed by the segments every process shares
+sounds = SoundCache()
+
+def read(str path):
+    return sounds.read(path)
+
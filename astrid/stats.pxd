@@ -0,0 +1,19 @@
+#cython: language_level=3
+
+cdef class CallbackStats:
+    cdef double[:] durations
+    cdef int[:] voices
+    cdef int[:] retired
+    cdef unsigned long capacity
+    cdef double started
+    cdef long last_retired
+    cdef public unsigned long blocks
+    cdef public unsigned long overruns
+    cdef public unsigned long xruns
+    cdef public double xrun_delay
+    cdef public double deadline
+
+    cpdef void set_deadline(CallbackStats self, int block_size, int samplerate)
+    cpdef void start(CallbackStats self)
+    cpdef void stop(CallbackStats self, int voices, long retired)
+    cpdef void xrun(CallbackStats self, double delay)
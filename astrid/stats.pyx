@@ -0,0 +1,179 @@
+#cython: language_level=3
+
+cimport cython
+import collections
+import threading
+
+import numpy as np
+
+from .clock cimport monotonic
+from .defaults import DEFAULT_LATENCY_TRACES, DEFAULT_STATS_BLOCKS
+
+cdef class CallbackStats:
+    """ Timing of the audio callback.
+
+        Every block records how long the callback took, how many 
+        voices it mixed and how many it retired into rings that 
+        are allocated up front, so recording never allocates. 
+        Blocks that took longer than the deadline (the length of 
+        one block) and xruns reported by the audio server are 
+        counted from the start.
+
+        `summary` is for everything else: it copies the latest 
+        blocks out of the rings and works out percentiles.
+    """
+    def __cinit__(self, unsigned long capacity=DEFAULT_STATS_BLOCKS):
+        self.capacity = capacity
+        self.durations = np.zeros(capacity, dtype='d')
+        self.voices = np.zeros(capacity, dtype='i')
+        self.retired = np.zeros(capacity, dtype='i')
+        self.started = 0
+        self.last_retired = 0
+        self.blocks = 0
+        self.overruns = 0
+        self.xruns = 0
+        self.xrun_delay = 0
+        self.deadline = 0
+
+    cpdef void set_deadline(CallbackStats self, int block_size, int samplerate):
+        if samplerate > 0:
+            self.deadline = <double>block_size / samplerate
+
+    cpdef void start(CallbackStats self):
+        self.started = monotonic()
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cpdef void stop(CallbackStats self, int voices, long retired):
+        """ Record the block started by the last call to start. 
+            retired is the mixer's running total.
+        """
+        cdef double duration = monotonic() - self.started
+        cdef unsigned long slot = self.blocks % self.capacity
+
+        self.durations[slot] = duration
+        self.voices[slot] = voices
+        self.retired[slot] = <int>(retired - self.last_retired)
+        self.last_retired = retired
+        self.blocks += 1
+
+        if self.deadline > 0 and duration > self.deadline:
+            self.overruns += 1
+
+    cpdef void xrun(CallbackStats self, double delay):
+        """ Called by the audio server with how late it 
+            was, in microseconds
+        """
+        self.xruns += 1
+        self.xrun_delay += delay
+
+    def summary(self):
+        cdef unsigned long count = min(self.blocks, self.capacity)
+        summary = {
+            'blocks': self.blocks,
+            'window': count,
+            'deadline_ms': self.deadline * 1000,
+            'over_deadline': self.overruns,
+            'xruns': self.xruns,
+            'xrun_delay_ms': self.xrun_delay / 1000,
+        }
+
+        if count == 0:
+            return summary
+
+        durations = np.array(self.durations[:count]) * 1000
+        voices = np.array(self.voices[:count])
+        p50, p90, p99, p999 = np.percentile(durations, [50, 90, 99, 99.9])
+
+        summary.update({
+            'mean_ms': float(durations.mean()),
+            'p50_ms': float(p50),
+            'p90_ms': float(p90),
+            'p99_ms': float(p99),
+            'p999_ms': float(p999),
+            'max_ms': float(durations.max()),
+            'load': float(durations.mean() / (self.deadline * 1000)) if self.deadline > 0 else 0,
+            'voices_mean': float(voices.mean()),
+            'voices_max': int(voices.max()),
+            'retired': int(np.array(self.retired[:count]).sum()),
+        })
+        return summary
+
+# Where a play is timestamped on its way to the speakers, in order
+TRACE_STAGES = (
+    'received',     # server got the play command
+    'dequeued',     # renderer took it off its play queue
+    'started',      # a voice thread picked it up
+    'render_start', # the player was asked for its first buffer
+    'rendered',     # the first buffer came back
+    'shared',       # the buffer was copied to shared memory
+    'buffered',     # the server took it off the buffer queue
+    'first_out',    # the mixer played its first sample
+)
+
+# The time between each stage and the one before
+TRACE_SPANS = (
+    'route', 
+    'dispatch', 
+    'wait', 
+    'render', 
+    'share', 
+    'transfer', 
+    'mix',
+)
+
+class LatencyStats:
+    """ Where the time goes between a play command and the 
+        first sample of its voice, for the latest `size` 
+        plays of each instrument.
+
+        The wait span includes the instrument's before callback, 
+        its onsets and the lookahead for scheduled voices, and the 
+        mix span includes waiting for a scheduled start frame.
+    """
+    def __init__(self, size=DEFAULT_LATENCY_TRACES):
+        self.size = size
+        self.instruments = {}
+        self.lock = threading.Lock()
+
+    def add(self, dict trace):
+        spans = {}
+        for i, span in enumerate(TRACE_SPANS):
+            start = trace.get(TRACE_STAGES[i], None)
+            end = trace.get(TRACE_STAGES[i + 1], None)
+            if start is not None and end is not None:
+                spans[span] = (end - start) * 1000
+
+        if 'received' in trace and 'first_out' in trace:
+            spans['total'] = (trace['first_out'] - trace['received']) * 1000
+
+        with self.lock:
+            self.instruments.setdefault(trace.get('instrument'), collections.deque(maxlen=self.size)).append(spans)
+
+    def summary(self, instrument_name=None):
+        """ Mean, median, 95th percentile and max of each span 
+            in milliseconds, by instrument
+        """
+        with self.lock:
+            instruments = { name: list(traces) for name, traces in self.instruments.items() }
+
+        summary = {}
+        for name, traces in instruments.items():
+            if instrument_name is not None and name != instrument_name:
+                continue
+
+            summary[name] = {'count': len(traces)}
+            for span in TRACE_SPANS + ('total',):
+                values = [ t[span] for t in traces if span in t ]
+                if len(values) == 0:
+                    continue
+
+                p50, p95 = np.percentile(values, [50, 95])
+                summary[name][span] = {
+                    'mean': float(np.mean(values)), 
+                    'p50': float(p50), 
+                    'p95': float(p95), 
+                    'max': float(np.max(values)),
+                }
+
+        return summary
@@ -47,6 +47,48 @@ class AstridConsole(cmd.Cmd):
         else:
             self.client.send_cmd(['stop_instrument', instrument])
 
+    def do_pin(self, cmd):
+        self.client.send_cmd(['pin'] + cmd.split(' '))
+
+    def do_log(self, cmd):
+        self.client.send_cmd(['log_level'] + cmd.split(' '))
+
+    def do_lat(self, instrument):
+        latency = self.client.send_cmd(['latency'] + ([instrument] if instrument else []))
+        if not isinstance(latency, dict):
+            return
+
+        for name, spans in latency.items():
+            if isinstance(name, bytes):
+                name = name.decode('utf-8')
+            print('%s (%s plays)' % (name, spans.pop('count', 0)))
+            for span, ms in spans.items():
+                print('  %-10s mean %7.2fms  p50 %7.2fms  p95 %7.2fms  max %7.2fms' % (span, ms['mean'], ms['p50'], ms['p95'], ms['max']))
+
+    def do_stats(self, cmd):
+        stats = self.client.send_cmd(['stats'])
+        if not isinstance(stats, dict):
+            return
+
+        for key, value in stats.items():
+            if isinstance(value, float):
+                value = '%.3f' % value
+            print('%s: %s' % (key, value))
+
+    def do_startup(self, cmd):
+        times = self.client.send_cmd(['startup'])
+        if not isinstance(times, dict):
+            return
+
+        for phase, elapsed in times.get('phases', {}).items():
+            print('%s: %.3fs' % (phase, elapsed))
+
+        for renderer, timings in sorted(times.get('renderers', {}).items()):
+            instruments = timings.pop('instruments', {})
+            print('renderer %s: %s' % (renderer, ', '.join([ '%s %.3fs' % (k, v) for k, v in timings.items() ])))
+            for name, elapsed in instruments.items():
+                print('  %s %.3fs' % (name, elapsed))
+
     def do_b(self, cmd):
         action, *values = cmd.split(' ')
         if action == 'c' or action == 'clear':
@@ -1,39 +1,352 @@
 #cython: language_level=3
 
+from concurrent.futures import ThreadPoolExecutor
 import multiprocessing as mp
 import threading
 import queue
 import os
 import time
 
+import msgpack
 import redis
 
+from .clock cimport FrameClock
+from .defaults import DEFAULT_POLYPHONY, DEFAULT_RECONNECT_DELAY, DEFAULT_RECONNECT_MAX_DELAY
 from .io cimport init_voice
-from .logger import logger
+from .orc cimport EventContext
+from .logger import get_logger, set_level
 from . import names
 from . import orc
 
+logger = get_logger('voices')
+
+def render_voice(object instrument, EventContext ctx, object buf_q, FrameClock clock):
+    init_voice(instrument, ctx, buf_q, clock)
+
+def warm_pippi():
+    """ Import the pippi modules instruments use and build 
+        the common tables once, so the first voice doesn't pay 
+        for it.
+    """
+    try:
+        from pippi import dsp, oscs, tune, rhythm, wavetables
+        for name in ('sine', 'hann', 'tri'):
+            dsp.win(name)
+        dsp.buffer(length=0.1)
+    except Exception as e:
+        logger.debug('Could not warm up pippi: %s', e)
+
+class Voice:
+    def __init__(self, instrument_name):
+        self.instrument_name = instrument_name
+        self.started = time.monotonic()
+        self.stop_me = threading.Event()
+        self.ctx = None
+
+    @property
+    def level(self):
+        if self.ctx is None:
+            return 0
+        # Each of several players keeps its own level
+        return max([ self.ctx.level ] + [ c.level for c in self.ctx.players ])
+
+class VoicePool:
+    """ The voices running in one renderer.
+
+        At most `polyphony` voices run at once, and an instrument 
+        can set a lower limit for itself with POLYPHONY. When a new 
+        voice would go over a limit, a running voice is stolen to 
+        make room: the oldest by default, or the quietest if the 
+        instrument sets STEAL = 'quietest'. A stolen voice is told 
+        to stop and finishes on its own, and the new voice waits for 
+        its thread if there isn't a spare one.
+    """
+    def __init__(self, polyphony=DEFAULT_POLYPHONY):
+        self.polyphony = polyphony
+        self.voices = []
+        self.instruments = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=polyphony)
+
+    def __len__(self):
+        return len(self.voices)
+
+    def start(self, instrument, target, *args):
+        """ Run target(voice, *args) as a new voice of instrument
+        """
+        voice = Voice(instrument.name)
+        with self.lock:
+            self.make_room(
+                instrument.name, 
+                getattr(instrument.renderer, 'POLYPHONY', None), 
+                getattr(instrument.renderer, 'STEAL', 'oldest'),
+            )
+            self.voices.append(voice)
+            self.instruments.setdefault(voice.instrument_name, set()).add(voice)
+
+        future = self.executor.submit(target, voice, *args)
+        future.add_done_callback(lambda f: self.finished(voice))
+        return voice
+
+    def finished(self, voice):
+        with self.lock:
+            if voice in self.voices:
+                self.remove(voice)
+
+    def remove(self, voice):
+        self.voices.remove(voice)
+        self.instruments[voice.instrument_name].discard(voice)
+
+    def make_room(self, instrument_name, limit, policy):
+        if limit is not None:
+            voices = [ v for v in self.voices if v.instrument_name == instrument_name ]
+            while len(voices) > 0 and len(voices) >= limit:
+                voices.remove(self.steal(voices, policy))
+
+        while len(self.voices) > 0 and len(self.voices) >= self.polyphony:
+            self.steal(self.voices, policy)
+
+    def steal(self, voices, policy):
+        if policy == 'quietest':
+            voice = min(voices, key=lambda v: v.level)
+        else:
+            voice = min(voices, key=lambda v: v.started)
+
+        logger.info('Stealing %s voice started at %.3f', voice.instrument_name, voice.started)
+        voice.stop_me.set()
+        self.remove(voice)
+        return voice
+
+    def stop(self, instrument_name=None):
+        """ Stop every voice, or every voice of one instrument
+        """
+        with self.lock:
+            if instrument_name is None:
+                voices = self.voices
+            else:
+                voices = self.instruments.get(instrument_name, ())
+
+            for voice in voices:
+                voice.stop_me.set()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+class RendererRouter:
+    """ Decides which renderer plays each voice.
+
+        Every renderer has its own play queue and reports how many 
+        voices it is running in a shared array. A play goes to the 
+        least busy renderer, where a renderer that doesn't have the 
+        instrument loaded yet counts as `cold_penalty` voices busier. 
+        Instruments can be pinned to a subset of the renderers.
+
+        Each shared counter has a single writer: the router counts 
+        the plays it sends and the renderer counts the plays it takes, 
+        so no locking is needed across processes.
+    """
+    cold_penalty = 2
+
+    def __init__(self, numrenderers):
+        self.numrenderers = numrenderers
+        self.play_qs = [ mp.Queue() for _ in range(numrenderers) ]
+        self.active = mp.RawArray('i', numrenderers)
+        self.routed = mp.RawArray('i', numrenderers)
+        self.taken = mp.RawArray('i', numrenderers)
+        self.warm = {}
+        self.pins = {}
+
+    def load(self, renderer):
+        # Plays still waiting in the queue count as running voices
+        return self.active[renderer] + self.routed[renderer] - self.taken[renderer]
+
+    def route(self, cmd, trace=None):
+        instrument_name = cmd[0]
+        renderers = self.pins.get(instrument_name, None) or range(self.numrenderers)
+        warm = self.warm.setdefault(instrument_name, set())
+        renderer = min(renderers, key=lambda r: self.load(r) + (0 if r in warm else self.cold_penalty))
+
+        self.routed[renderer] += 1
+        self.play_qs[renderer].put((cmd, trace))
+        warm.add(renderer)
+        return renderer
+
+    def loaded(self, instrument_name):
+        """ Every renderer has been told to load the instrument
+        """
+        self.warm[instrument_name] = set(range(self.numrenderers))
+
+    def pin(self, instrument_name, renderers=None):
+        """ Only play the instrument on the given renderers. 
+            Passing no renderers removes the pin.
+        """
+        renderers = [ r for r in (renderers or []) if 0 <= r < self.numrenderers ]
+        if len(renderers) == 0:
+            self.pins.pop(instrument_name, None)
+        else:
+            self.pins[instrument_name] = renderers
+
+    def put_all(self, msg):
+        for play_q in self.play_qs:
+            play_q.put(msg)
+
+class ControlSubscriber:
+    """ The one Redis subscription in a renderer process.
+
+        Stops go straight to the renderer's voice pool, param 
+        updates to the session param cache, and loads and shutdown 
+        to the renderer's own queue.
+    """
+    channels = (
+        names.LOAD_INSTRUMENT, 
+        names.STOP_ALL_VOICES, 
+        names.STOP_INSTRUMENT, 
+        names.PARAM_UPDATE, 
+        names.SET_LOG_LEVEL, 
+        names.SHUTDOWN,
+    )
+
+    def __init__(self, q, voices):
+        self.q = q
+        self.voices = voices
+
+    def run(self):
+        orc.session_params.start(listen=False)
+        self.listen()
+
+    def subscribe(self):
+        r = redis.StrictRedis(host='localhost', port=6379, db=0)
+        pubsub = r.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(*self.channels)
+        return pubsub
+
+    def listen(self, pubsub=None):
+        """ Dispatch messages until shutdown. If the connection 
+            drops, subscribe again with backoff, and forget the 
+            cached session params since updates may have been 
+            missed while it was down.
+        """
+        delay = DEFAULT_RECONNECT_DELAY
+        while True:
+            try:
+                if pubsub is None:
+                    pubsub = self.subscribe()
+
+                for msg in pubsub.listen():
+                    delay = DEFAULT_RECONNECT_DELAY
+                    if not msg['type'] == 'message':
+                        continue
+
+                    if not self.dispatch(int(msg['channel'] or 0), msg['data']):
+                        logger.debug('render process shutdown control subscriber')
+                        return
+                return
+
+            except redis.ConnectionError as e:
+                logger.error('Lost the control subscription, trying again in %ss: %s', delay, e)
+                orc.session_params.values = {}
+                if pubsub is not None:
+                    pubsub.reset()
+                pubsub = None
+                time.sleep(delay)
+                delay = min(delay * 2, DEFAULT_RECONNECT_MAX_DELAY)
+
+    def dispatch(self, c, data):
+        """ Returns False once it's time to stop listening
+        """
+        if c == names.PARAM_UPDATE:
+            key, value = msgpack.unpackb(data)
+            orc.session_params.update(key, value)
+            return True
+
+        if c == names.SET_LOG_LEVEL:
+            subsystem, level = msgpack.unpackb(data)
+            set_level(level, subsystem)
+            return True
+
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+
+        logger.debug('MSG %s %s', names.cton(c), data)
+
+        if c == names.STOP_ALL_VOICES:
+            self.voices.stop()
+
+        elif c == names.STOP_INSTRUMENT:
+            self.voices.stop(data)
+
+        elif c == names.LOAD_INSTRUMENT:
+            self.q.put((names.LOAD_INSTRUMENT, (data, None)))
+
+        elif c == names.SHUTDOWN:
+            return False
+
+        return True
+
 class VoiceHandler(mp.Process):
-    def __init__(self, play_q, load_q, buf_q, shutdown, cwd):
+    def __init__(self, index, play_q, status_q, buf_q, shutdown, cwd, clock, active, taken, cpus=None, polyphony=DEFAULT_POLYPHONY, preload=None):
         super().__init__()
+        self.index = index
         self.instruments = {}
         self.buf_q = buf_q
+        self.clock = clock
         self.play_q = play_q
-        self.load_q = load_q
+        self.status_q = status_q
         self.shutdown = shutdown
         self.cwd = cwd
+        self.active = active
+        self.taken = taken
+        self.active_lock = threading.Lock()
+        self.cpus = cpus
+        self.polyphony = polyphony
+        self.preload = preload or []
         self.q = queue.Queue()
 
-    def load_instrument(self, instrument_name, instrument_path, shutdown):
-        instrument = orc.load_instrument(instrument_name, instrument_path, shutdown)
-        self.instruments[instrument_name] = instrument
-        return instrument
+    def load_instrument(self, instrument_name, instrument_path, shutdown, listen=True):
+        """ Load or reload an instrument and tell the server how it went
+        """
+        if instrument_path is None:
+            instrument_path = os.path.join(self.cwd, names.ORC_DIR, '%s.py' % instrument_name)
+
+        instrument = self.instruments.get(instrument_name, None)
+        try:
+            if instrument is not None and instrument.path == instrument_path:
+                # Only runs the script again if it has changed
+                instrument.reload()
+            else:
+                instrument = orc.load_instrument(instrument_name, instrument_path, shutdown, listen)
+                self.instruments[instrument_name] = instrument
+            error = instrument.error
+        except orc.InstrumentNotFoundError as e:
+            error = e.message
+
+        self.status_q.put((names.LOAD_INSTRUMENT, self.index, instrument_name, error))
+        return self.instruments.get(instrument_name, None)
+
+    def warm_up(self):
+        """ Load the preload instruments and get pippi's imports and 
+            tables ready before the first play, then tell the server 
+            this renderer is ready along with how long each step took.
+        """
+        timings = {'instruments': {}}
+        start = time.monotonic()
+        warm_pippi()
+        timings['pippi'] = time.monotonic() - start
+
+        for instrument_name in self.preload:
+            t = time.monotonic()
+            # Every renderer preloads the same instruments, but 
+            # each MIDI device only needs one listener
+            self.load_instrument(instrument_name, None, self.shutdown, self.index == 0)
+            timings['instruments'][instrument_name] = time.monotonic() - t
+
+        timings['total'] = time.monotonic() - start
+        self.status_q.put((names.RENDERER_READY, self.index, timings))
 
     def get_instrument(self, instrument_name, shutdown):
         instrument = self.instruments.get(instrument_name, None)         
         if instrument is None:
-            instrument_path = os.path.join(self.cwd, names.ORC_DIR, '%s.py' % instrument_name)
-            instrument = self.load_instrument(instrument_name, instrument_path, shutdown)
+            instrument = self.load_instrument(instrument_name, None, shutdown)
         return instrument
 
     def wait_for_shutdown(self, q, shutdown):
@@ -41,25 +354,6 @@ class VoiceHandler(mp.Process):
         q.put((names.SHUTDOWN, None))
         logger.debug('render process put shutdown')
 
-    def wait_for_loads(self, q, load_q):
-        r = redis.StrictRedis(host='localhost', port=6379, db=0, decode_responses=True)
-        pubsub = r.pubsub(ignore_subscribe_messages=True)
-        pubsub.subscribe(names.LOAD_INSTRUMENT, names.SHUTDOWN)
-        for msg in pubsub.listen():
-            c = int(msg['channel'] or 0)
-            if not msg['type'] == 'message':
-                continue
-
-            instrument_name = msg['data']
-            logger.info('LOAD MSG %s' % instrument_name)
-
-            if c == names.LOAD_INSTRUMENT:
-                q.put((names.LOAD_INSTRUMENT, (instrument_name, None)))
-
-            elif c == names.SHUTDOWN:
-                logger.debug('render process shutdown load queue')
-                break
-
     def wait_for_plays(self, q, play_q):
         while True:
             msg = play_q.get()
@@ -67,11 +361,42 @@ class VoiceHandler(mp.Process):
                 logger.debug('render process shutdown play queue')
                 break
 
-            q.put((names.PLAY_INSTRUMENT, msg))
+            cmd, trace = msg
+            if trace is not None:
+                trace['dequeued'] = time.monotonic()
+
+            self.taken[self.index] += 1
+            q.put((names.PLAY_INSTRUMENT, (cmd, trace)))
+
+    def play(self, voice, instrument, params, trace=None):
+        try:
+            if trace is not None:
+                trace['started'] = time.monotonic()
+
+            voice.ctx = instrument.create_ctx(params)
+            voice.ctx.stop_me = voice.stop_me
+            voice.ctx.trace = trace
+            render_voice(instrument, voice.ctx, self.buf_q, self.clock)
+        except Exception as e:
+            logger.exception('Error rendering %s voice: %s', voice.instrument_name, e)
+        finally:
+            with self.active_lock:
+                self.active[self.index] -= 1
 
     def run(self):
-        load_listener = threading.Thread(target=self.wait_for_loads, args=(self.q, self.load_q))
-        load_listener.start()
+        if self.cpus:
+            try:
+                os.sched_setaffinity(0, self.cpus)
+            except (AttributeError, OSError) as e:
+                logger.error('Could not pin renderer %s to CPUs %s: %s', self.index, self.cpus, e)
+
+        self.warm_up()
+
+        voices = VoicePool(self.polyphony)
+
+        subscriber = ControlSubscriber(self.q, voices)
+        message_listener = threading.Thread(target=subscriber.run)
+        message_listener.start()
 
         play_listener = threading.Thread(target=self.wait_for_plays, args=(self.q, self.play_q))
         play_listener.start()
@@ -79,8 +404,6 @@ class VoiceHandler(mp.Process):
         shutdown_listener = threading.Thread(target=self.wait_for_shutdown, args=(self.q, self.shutdown))
         shutdown_listener.start()
 
-        voices = []
-
         try:
             while True:
                 action, cmd = self.q.get()
@@ -90,10 +413,11 @@ class VoiceHandler(mp.Process):
                     self.load_instrument(instrument_name, instrument_path, self.shutdown)
 
                 elif action == names.PLAY_INSTRUMENT:
+                    cmd, trace = cmd
                     instrument_name = cmd[0]
                     params = None
                     if len(cmd) > 1:
-                        logger.info('CMD params: %s' % cmd)
+                        logger.debug('CMD params: %s', cmd)
                         params = {}
                         for c in cmd[1:]:
                             if isinstance(c, dict):
@@ -104,25 +428,26 @@ class VoiceHandler(mp.Process):
 
                     instrument = self.get_instrument(instrument_name, self.shutdown)
                     if instrument is None:
-                        logger.error('No instrument loaded for %s' % instrument_name)
+                        logger.error('No instrument loaded for %s', instrument_name)
                         continue
 
-                    voice = threading.Thread(target=init_voice, args=(instrument, params, self.buf_q))
-                    voice.start()
-                    voices += [ voice ]
+                    with self.active_lock:
+                        self.active[self.index] += 1
+
+                    voices.start(instrument, self.play, instrument, params, trace)
 
                 elif action == names.SHUTDOWN:
-                    logger.debug('voice %s got shutdown' % self.pid)
-                    for voice in voices:
-                        voice.join()
+                    logger.debug('voice %s got shutdown', self.pid)
+                    voices.stop()
                     break
 
         except Exception as e:
             logger.exception(e)
 
-        load_listener.join()
+        voices.shutdown()
+        message_listener.join()
         play_listener.join()
         shutdown_listener.join()
-        logger.debug('voice %s cleaned up' % self.pid)
+        logger.debug('voice %s cleaned up', self.pid)
 
 
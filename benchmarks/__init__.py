@@ -0,0 +1,31 @@
+""" Performance benchmarks for astrid.
+
+    Each bench_*.py module has functions named bench_* that take 
+    their params as keyword arguments and return a function to 
+    time, or a (function, cleanup) or (function, cleanup, reset) 
+    tuple. The runner calls them once for every combination of 
+    params, then times the returned function over several repeats, 
+    calling reset untimed before each one. A module may also define a 
+    teardown function, which runs after its last benchmark.
+
+    python -m benchmarks.run --out results.json
+"""
+
+class Skip(Exception):
+    """ Raise from a benchmark that can't run here
+    """
+
+def bench(number=None, **params):
+    """ Declare the params a benchmark runs with, e.g.
+
+        @bench(voices=[1, 8], channels=[2])
+        def bench_mix(voices, channels): ...
+
+        number fixes how many calls are timed in each repeat, 
+        otherwise the runner picks enough to fill its target time.
+    """
+    def wrap(func):
+        func.params = params
+        func.number = number
+        return func
+    return wrap
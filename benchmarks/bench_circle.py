@@ -0,0 +1,52 @@
+""" Time writing to and reading from the input ring
+"""
+import numpy as np
+
+from astrid.backends import DummyPort
+from astrid.circle import Circle
+
+from . import bench
+
+SAMPLERATE = 48000
+NAME = 'bench-circle'
+
+def circle(channels):
+    c = Circle(NAME, create=True, channels=channels, samplerate=SAMPLERATE)
+    # Fill the ring so reads never come up short
+    block = np.zeros((SAMPLERATE, channels), dtype='d')
+    for _ in range(int(c.length // SAMPLERATE) + 1):
+        c.add(block)
+    return c
+
+@bench(block_size=[64, 256, 1024], channels=[2, 8])
+def bench_add(block_size, channels):
+    c = circle(channels)
+    block = np.random.default_rng(0).uniform(-1, 1, (block_size, channels))
+    return (lambda: c.add(block)), c.close
+
+@bench(block_size=[64, 256], channels=[2, 8])
+def bench_add_ports(block_size, channels):
+    """ What the audio callback does with the inputs
+    """
+    c = circle(channels)
+    ports = [ DummyPort(block_size) for _ in range(channels) ]
+    return (lambda: c.add_ports(ports, block_size)), c.close
+
+@bench(length=[0.01, 0.1, 1, 10])
+def bench_read(length):
+    c = circle(2)
+    return (lambda: c.read(length, (1, 2))), c.close
+
+@bench(length=[0.1, 1])
+def bench_read_attached(length):
+    """ Reading from another process's view of the ring
+    """
+    c = circle(2)
+    reader = Circle(NAME)
+    reader.attach()
+
+    def cleanup():
+        reader.close()
+        c.close()
+
+    return (lambda: reader.read(length, (1, 2))), cleanup
@@ -0,0 +1,138 @@
+""" Time command round trips through AstridClient
+"""
+import logging
+import multiprocessing as mp
+import threading
+import time
+
+import msgpack
+import zmq
+
+from astrid import names
+from astrid.client import AstridClient
+from astrid.logger import set_level
+
+from . import bench, Skip
+
+SERVER_STARTUP_TIMEOUT = 30 # seconds
+
+_server = None
+_failed = None
+
+def close(client):
+    if client.context is not None:
+        client.context.destroy(linger=0)
+
+def echo(sock, stop):
+    """ Replies to every message with an OK per command,
+        like the server without any of the work
+    """
+    while not stop.is_set():
+        if not sock.poll(100):
+            continue
+        *envelope, msg = sock.recv_multipart()
+        cmds, legacy = names.decode(msgpack.unpackb(msg))
+        sock.send_multipart(envelope + [msgpack.packb([ names.MSG_OK for _ in cmds ])])
+
+@bench(batch=[1, 10])
+def bench_transport(batch):
+    """ The socket and serialization overhead alone
+    """
+    context = zmq.Context()
+    sock = context.socket(zmq.ROUTER)
+    try:
+        sock.bind('tcp://*:{}'.format(names.MSG_PORT))
+    except zmq.ZMQError as e:
+        context.destroy(linger=0)
+        raise Skip('port %s is taken: %s' % (names.MSG_PORT, e))
+
+    stop = threading.Event()
+    thread = threading.Thread(target=echo, args=(sock, stop), daemon=True)
+    thread.start()
+
+    client = AstridClient()
+    cmds = [ [names.LIST_INSTRUMENTS] for _ in range(batch) ]
+
+    def cleanup():
+        close(client)
+        stop.set()
+        thread.join()
+        sock.close(linger=0)
+        context.destroy(linger=0)
+
+    return (lambda: client.send_batch(cmds)), cleanup
+
+def serve():
+    from astrid.backends import DummyBackend
+    from astrid.server import AstridServer
+
+    # No instruments, no sound card: just the command loop
+    AstridServer(numrenderers=2, preload=[], backend=DummyBackend()).run()
+
+def start_server():
+    """ Runs a server in another process the first time
+        it's needed, or raises Skip if it can't start here
+    """
+    global _server, _failed
+    if _server is not None:
+        return
+    if _failed is not None:
+        raise Skip(_failed)
+
+    # Not a daemon, since the server starts renderer processes
+    process = mp.Process(target=serve, name='astrid-bench-server')
+    process.start()
+
+    client = AstridClient(timeout=200)
+    deadline = time.monotonic() + SERVER_STARTUP_TIMEOUT
+
+    # Don't warn about every request that times out while waiting
+    set_level('ERROR', 'client')
+    try:
+        while time.monotonic() < deadline:
+            if not process.is_alive():
+                _failed = 'the server exited with %s' % process.exitcode
+                raise Skip(_failed)
+
+            if client.request([[names.LIST_INSTRUMENTS]]) is not None:
+                _server = process
+                return
+    finally:
+        set_level(logging.NOTSET, 'client')
+        close(client)
+
+    process.terminate()
+    process.join()
+    _failed = 'the server did not start in %ss' % SERVER_STARTUP_TIMEOUT
+    raise Skip(_failed)
+
+@bench(cmd=['list', 'set_value', 'clear_bank'])
+def bench_server(cmd):
+    """ A command handled on the command loop (list), one that
+        also hands off to the param thread (set_value) and one
+        that runs on the worker pool (clear_bank)
+    """
+    start_server()
+    client = AstridClient()
+    args = {
+        'list': [],
+        'set_value': ['bench:1'],
+        'clear_bank': ['bench-missing'],
+    }[cmd]
+
+    return (lambda: client.send_cmd([cmd] + args)), (lambda: close(client))
+
+def teardown():
+    global _server, _failed
+    _failed = None
+    if _server is None:
+        return
+
+    client = AstridClient()
+    client.send_cmd([names.SHUTDOWN])
+    close(client)
+    _server.join(10)
+    if _server.is_alive():
+        _server.terminate()
+        _server.join()
+    _server = None
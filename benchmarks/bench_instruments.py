@@ -0,0 +1,61 @@
+""" Time loading and reloading the instrument scripts in orc/
+"""
+import os
+import shutil
+import tempfile
+
+from astrid import orc
+
+from . import bench
+
+ORC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'orc')
+SCRIPTS = sorted([ os.path.splitext(f)[0] for f in os.listdir(ORC_DIR) if f.endswith('.py') ])
+
+def load(name, path):
+    # MIDI listeners run in their own processes, which
+    # isn't what's being timed here
+    return orc.load_instrument(name, path, listen=False)
+
+@bench(script=SCRIPTS)
+def bench_load(script):
+    """ Loading a script that hasn't been compiled before
+    """
+    path = os.path.join(ORC_DIR, '%s.py' % script)
+
+    def cold_load():
+        orc.modules.entries.pop(path, None)
+        load(script, path)
+
+    return cold_load
+
+@bench(script=SCRIPTS, changed=[False, True])
+def bench_reload(script, changed):
+    """ Reloading after a save, with and without changes.
+        Changes alternate between two versions of the script,
+        so the time includes writing the file.
+    """
+    tmpdir = tempfile.mkdtemp(prefix='astrid-bench-')
+    path = os.path.join(tmpdir, '%s.py' % script)
+    shutil.copy(os.path.join(ORC_DIR, '%s.py' % script), path)
+    with open(path) as f:
+        versions = [ f.read() ]
+    versions.append(versions[0] + '\n# changed\n')
+
+    instrument = load(script, path)
+    count = 0
+
+    def reload():
+        nonlocal count
+        if changed:
+            count += 1
+            with open(path, 'w') as f:
+                f.write(versions[count % 2])
+        else:
+            os.utime(path)
+        instrument.reload()
+
+    def cleanup():
+        orc.modules.entries.pop(path, None)
+        shutil.rmtree(tmpdir)
+
+    return reload, cleanup
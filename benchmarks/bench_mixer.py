@@ -0,0 +1,61 @@
+""" Time one audio callback's worth of mixing
+"""
+import numpy as np
+from pippi.soundbuffer import SoundBuffer
+
+from astrid.backends import DummyPort
+from astrid.io import BufferNode
+from astrid.mixer import AstridMixer
+
+from . import bench
+
+SAMPLERATE = 48000
+BLOCKS = 500
+BLOCK_SIZES = [64, 256]
+
+# Long enough that no voice finishes within a repeat
+FRAMES = np.random.default_rng(0).uniform(-0.1, 0.1, ((BLOCKS + 1) * max(BLOCK_SIZES), 2))
+
+@bench(number=BLOCKS, voices=[1, 8, 32, 128], channels=[2, 8], block_size=BLOCK_SIZES)
+def bench_process(voices, channels, block_size):
+    mixer = AstridMixer(block_size, channels, SAMPLERATE)
+    ports = [ DummyPort(block_size) for _ in range(channels) ]
+    snd = SoundBuffer(FRAMES, channels=2, samplerate=SAMPLERATE)
+
+    def stop():
+        mixer.clear()
+        mixer.reap()
+
+    def reset():
+        # Fresh voices for every repeat, outside the timing
+        stop()
+        for _ in range(voices):
+            mixer.add(BufferNode(snd, 0, 0))
+
+    def process():
+        mixer.process(ports, block_size)
+
+    return process, stop, reset
+
+@bench(number=BLOCKS, voices=[8, 128], block_size=BLOCK_SIZES)
+def bench_scheduled(voices, block_size):
+    """ Voices that are all due well after the current block,
+        which the mixer has to check and skip every time
+    """
+    mixer = AstridMixer(block_size, 2, SAMPLERATE)
+    ports = [ DummyPort(block_size) for _ in range(2) ]
+    snd = SoundBuffer(FRAMES, channels=2, samplerate=SAMPLERATE)
+    for _ in range(voices):
+        mixer.add(BufferNode(snd, 0, 0, 2**40))
+
+    frame_time = 0
+    def process():
+        nonlocal frame_time
+        mixer.process(ports, block_size, frame_time)
+        frame_time += block_size
+
+    def stop():
+        mixer.clear()
+        mixer.reap()
+
+    return process, stop
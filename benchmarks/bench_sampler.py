@@ -0,0 +1,35 @@
+""" Time writing, dubbing and reading sound banks
+"""
+import numpy as np
+from pippi.soundbuffer import SoundBuffer
+
+from astrid.sampler import Sampler
+
+from . import bench
+
+SAMPLERATE = 48000
+BANK = 'bench-bank'
+LENGTHS = [0.1, 1, 10] # seconds
+
+def sound(length, channels=2):
+    frames = np.random.default_rng(0).uniform(-1, 1, (int(length * SAMPLERATE), channels))
+    return SoundBuffer(frames, channels=channels, samplerate=SAMPLERATE)
+
+@bench(length=LENGTHS)
+def bench_write(length):
+    sampler = Sampler()
+    snd = sound(length)
+    return (lambda: sampler.write(BANK, snd)), (lambda: sampler.clear(BANK))
+
+@bench(length=LENGTHS)
+def bench_read(length):
+    sampler = Sampler()
+    sampler.write(BANK, sound(length))
+    return (lambda: sampler.read(BANK)), (lambda: sampler.clear(BANK))
+
+@bench(length=[0.1, 1])
+def bench_dub(length):
+    sampler = Sampler()
+    snd = sound(length)
+    sampler.write(BANK, sound(10))
+    return (lambda: sampler.dub(BANK, snd, 0, 0.5)), (lambda: sampler.clear(BANK))
@@ -0,0 +1,46 @@
+""" Time handing a rendered buffer from a renderer to the 
+    mixer across buf_q, as shared memory and as a pickle
+"""
+import multiprocessing as mp
+
+import numpy as np
+from pippi.soundbuffer import SoundBuffer
+
+from astrid import io
+
+from . import bench
+
+SAMPLERATE = 48000
+LENGTHS = [0.01, 0.1, 1, 10] # seconds
+
+def sound(length, channels):
+    frames = np.random.default_rng(0).uniform(-1, 1, (int(length * SAMPLERATE), channels))
+    return SoundBuffer(frames, channels=channels, samplerate=SAMPLERATE)
+
+@bench(length=LENGTHS, channels=[2, 8])
+def bench_shared(length, channels):
+    """ What renderers do now: copy into a shared 
+        segment and send its name
+    """
+    q = mp.Queue()
+    snd = sound(length, channels)
+
+    def transfer():
+        q.put(io.share(snd, 0, 0))
+        node = io.attach(q.get())
+        node.release()
+
+    return transfer, q.close
+
+@bench(length=LENGTHS, channels=[2, 8])
+def bench_pickled(length, channels):
+    """ Sending the BufferNode itself, for comparison
+    """
+    q = mp.Queue()
+    snd = sound(length, channels)
+
+    def transfer():
+        q.put(io.BufferNode(snd, 0, 0))
+        q.get()
+
+    return transfer, q.close
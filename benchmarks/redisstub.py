@@ -0,0 +1,184 @@
+""" A small stand-in for the Redis server, so the benchmarks 
+    can run offline.
+
+    It speaks enough of the Redis protocol, both RESP2 and the 
+    RESP3 that newer clients ask for with HELLO, for what astrid 
+    uses: GET, SET, DEL, PUBLISH, SUBSCRIBE and MULTI/EXEC pipelines. 
+    It listens on the usual port so renderer processes can reach 
+    it as well. Nothing is persisted.
+"""
+import socketserver
+import threading
+
+from astrid.logger import get_logger
+
+logger = get_logger('benchmarks')
+
+HOST = 'localhost'
+PORT = 6379
+
+class Store:
+    def __init__(self):
+        self.values = {}
+        self.channels = {}
+        self.lock = threading.Lock()
+
+    def publish(self, channel, message):
+        with self.lock:
+            subscribers = list(self.channels.get(channel, ()))
+
+        for handler in subscribers:
+            handler.push([b'message', channel, message])
+
+        return len(subscribers)
+
+    def subscribe(self, channel, handler):
+        with self.lock:
+            self.channels.setdefault(channel, set()).add(handler)
+
+    def unsubscribe(self, handler):
+        with self.lock:
+            for subscribers in self.channels.values():
+                subscribers.discard(handler)
+
+def encode(value, protocol=2, push=False):
+    if value is None:
+        return b'_\r\n' if protocol == 3 else b'$-1\r\n'
+    if isinstance(value, dict):
+        return b'%%%d\r\n' % len(value) + b''.join([ encode(k, protocol) + encode(v, protocol) for k, v in value.items() ])
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, str):
+        return b'+%s\r\n' % value.encode()
+    if isinstance(value, Exception):
+        return b'-ERR %s\r\n' % str(value).encode()
+    if isinstance(value, (list, tuple)):
+        # RESP3 clients expect pub/sub messages as push frames
+        kind = b'>' if push and protocol == 3 else b'*'
+        return kind + b'%d\r\n' % len(value) + b''.join([ encode(v, protocol) for v in value ])
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+class Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.send_lock = threading.Lock()
+        self.queued = None
+        self.protocol = 2
+
+    def send(self, data):
+        with self.send_lock:
+            try:
+                self.wfile.write(data)
+                self.wfile.flush()
+            except OSError:
+                pass
+
+    def reply(self, value):
+        self.send(encode(value, self.protocol))
+
+    def push(self, message):
+        self.send(encode(message, self.protocol, push=True))
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+
+        if not line.startswith(b'*'):
+            # Inline command
+            return line.split()
+
+        args = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(size + 2)[:-2])
+        return args
+
+    def handle(self):
+        store = self.server.store
+        try:
+            while True:
+                args = self.read_command()
+                if args is None:
+                    break
+                if len(args) == 0:
+                    continue
+
+                cmd = args[0].upper()
+                if self.queued is not None and cmd not in (b'EXEC', b'DISCARD'):
+                    self.queued.append(args)
+                    self.reply('QUEUED')
+                    continue
+
+                if cmd == b'HELLO':
+                    if len(args) > 1:
+                        self.protocol = int(args[1])
+                    reply = {
+                        b'server': b'redis', 
+                        b'version': b'7.0.0', 
+                        b'proto': self.protocol, 
+                        b'id': 1, 
+                        b'mode': b'standalone', 
+                        b'role': b'master', 
+                        b'modules': [],
+                    }
+
+                elif cmd == b'MULTI':
+                    self.queued = []
+                    reply = 'OK'
+
+                elif cmd == b'EXEC':
+                    queued, self.queued = self.queued or [], None
+                    reply = [ self.run(store, a) for a in queued ]
+
+                elif cmd == b'DISCARD':
+                    self.queued = None
+                    reply = 'OK'
+
+                elif cmd == b'SUBSCRIBE':
+                    for i, channel in enumerate(args[1:]):
+                        store.subscribe(channel, self)
+                        self.push([b'subscribe', channel, i + 1])
+                    continue
+
+                else:
+                    reply = self.run(store, args)
+
+                self.reply(reply)
+        finally:
+            store.unsubscribe(self)
+
+    def run(self, store, args):
+        cmd = args[0].upper()
+        if cmd == b'PING':
+            return 'PONG'
+        if cmd == b'GET':
+            return store.values.get(args[1], None)
+        if cmd == b'SET':
+            store.values[args[1]] = args[2]
+            return 'OK'
+        if cmd == b'DEL':
+            return sum([ 1 for k in args[1:] if store.values.pop(k, None) is not None ])
+        if cmd == b'PUBLISH':
+            return store.publish(args[1], args[2])
+        if cmd in (b'CLIENT', b'SELECT', b'UNSUBSCRIBE'):
+            return 'OK'
+        return Exception('unknown command %s' % cmd.decode())
+
+class Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def start(host=HOST, port=PORT):
+    """ Serve in a background thread. Returns the server, or 
+        None if something, like a real Redis, already has the port.
+    """
+    try:
+        server = Server((host, port), Handler)
+    except OSError as e:
+        logger.info('Not starting the Redis stand-in, using whatever is on port %s: %s', port, e)
+        return None
+
+    server.store = Store()
+    threading.Thread(target=server.serve_forever, name='redis-stub', daemon=True).start()
+    return server
@@ -0,0 +1,209 @@
+""" Run the benchmarks and write the results as JSON
+
+    python -m benchmarks.run --out results.json
+    python -m benchmarks.run -k mixer --repeat 10
+    python -m benchmarks.run --compare old.json new.json
+"""
+import argparse
+from datetime import datetime, timezone
+import importlib
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from astrid.logger import set_level
+
+from . import Skip
+from . import redisstub
+
+MODULES = [
+    'bench_mixer',
+    'bench_transfer',
+    'bench_circle',
+    'bench_sampler',
+    'bench_commands',
+    'bench_instruments',
+]
+
+DEFAULT_REPEAT = 5
+DEFAULT_TARGET = 0.2 # seconds per repeat when calibrating
+
+def discover():
+    """ Yields (module, [ bench functions ]) in the order
+        they are defined
+    """
+    for name in MODULES:
+        module = importlib.import_module('benchmarks.%s' % name)
+        funcs = [
+            func for funcname, func in vars(module).items()
+            if funcname.startswith('bench_') and callable(func)
+        ]
+        yield module, funcs
+
+def cases(func):
+    params = getattr(func, 'params', {})
+    keys = list(params.keys())
+    for values in itertools.product(*[ params[k] for k in keys ]):
+        yield dict(zip(keys, values))
+
+def case_name(module, func, params):
+    name = '%s.%s' % (module.__name__.split('.')[-1], func.__name__)
+    if params:
+        name += '[%s]' % ','.join([ '%s=%s' % (k, v) for k, v in params.items() ])
+    return name
+
+def timed(fn, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return time.perf_counter() - start
+
+def calibrate(fn, target):
+    """ The smallest power of two number of calls
+        that takes at least target seconds
+    """
+    number = 1
+    while True:
+        elapsed = timed(fn, number)
+        if elapsed >= target or number >= 2**20:
+            return number
+        number *= 2
+
+def run_case(func, params, repeat, target):
+    made = func(**params)
+    if not isinstance(made, tuple):
+        made = (made,)
+    fn, cleanup, reset = made + (None,) * (3 - len(made))
+
+    times = []
+    try:
+        if reset is not None:
+            reset()
+        number = func.number or calibrate(fn, target)
+        for _ in range(repeat):
+            if reset is not None:
+                reset()
+            times.append(timed(fn, number) / number)
+    finally:
+        if cleanup is not None:
+            cleanup()
+
+    return {
+        'number': number,
+        'repeat': repeat,
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+        'max': max(times),
+        'stdev': statistics.stdev(times) if len(times) > 1 else 0,
+    }
+
+def revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def meta():
+    return {
+        'revision': revision(),
+        'date': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'numpy': np.__version__,
+    }
+
+def format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e3), ('us', 1e6)):
+        if seconds >= 1 / scale:
+            return '%.3f%s' % (seconds * scale, unit)
+    return '%.1fns' % (seconds * 1e9)
+
+def run(pattern=None, repeat=DEFAULT_REPEAT, target=DEFAULT_TARGET):
+    results = []
+    for module, funcs in discover():
+        try:
+            for func in funcs:
+                for params in cases(func):
+                    name = case_name(module, func, params)
+                    if pattern is not None and pattern not in name:
+                        continue
+
+                    result = {'name': name, 'params': params}
+                    try:
+                        result.update(run_case(func, params, repeat, target))
+                        print('%-60s %10s  (median of %s x %s)' % (name, format_time(result['median']), repeat, result['number']), flush=True)
+                    except Skip as e:
+                        result['skipped'] = str(e)
+                        print('%-60s    skipped  (%s)' % (name, e), flush=True)
+                    results.append(result)
+        finally:
+            teardown = getattr(module, 'teardown', None)
+            if teardown is not None:
+                teardown()
+
+    return results
+
+def compare(old_path, new_path):
+    """ Print the ratio of the new median to the old one
+        for every benchmark both runs have
+    """
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    old_results = { r['name']: r for r in old['results'] if 'median' in r }
+    print('%-60s %10s %10s %8s' % ('', old['meta']['revision'], new['meta']['revision'], 'ratio'))
+    for result in new['results']:
+        before = old_results.get(result['name'], None)
+        if before is None or 'median' not in result:
+            continue
+        print('%-60s %10s %10s %7.2fx' % (result['name'], format_time(before['median']), format_time(result['median']), result['median'] / before['median']))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run', description=__doc__.splitlines()[0])
+    parser.add_argument('--out', help='write the results to this JSON file')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='timed repeats of every benchmark')
+    parser.add_argument('--target', type=float, default=DEFAULT_TARGET, help='seconds each repeat should take when calibrating')
+    parser.add_argument('-k', dest='pattern', help='only run benchmarks whose name contains this')
+    parser.add_argument('--log-level', default='WARNING', help='astrid log level while benchmarking')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files instead of running')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    # Keep the per command info logging out of the results 
+    # table. The server process inherits this level too.
+    set_level(args.log_level)
+
+    # Uses a real Redis instead if one is already running
+    stub = redisstub.start()
+
+    try:
+        results = run(args.pattern, args.repeat, args.target)
+    finally:
+        if stub is not None:
+            stub.shutdown()
+            stub.server_close()
+
+    if args.out:
+        if os.path.dirname(args.out):
+            os.makedirs(os.path.dirname(args.out), exist_ok=True)
+        with open(args.out, 'w') as f:
+            json.dump({'meta': meta(), 'results': results}, f, indent=2)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,7 @@
 import random
 import glob
 from pippi import dsp, oscs, tune, rhythm
-from astrid import player
+from astrid import player, soundcache
 
 BPM = 130
 #MIDI = 'MPK'
@@ -34,14 +34,14 @@ def before(ctx):
 @player.init()
 def hats(ctx):
     hat = random.choice(ctx.before.get('hats'))
-    hat = dsp.read(hat)
+    hat = soundcache.read(hat)
     yield hat * random.triangular(0.25, 0.75)
 
 #@player.init(onsets=kickp)
 @player.init()
 def kicks(ctx):
     kick = random.choice(ctx.before.get('kicks'))
-    kick = dsp.read(kick)
+    kick = soundcache.read(kick)
     yield kick * random.triangular(0.65, 0.75)
 
 #@player.init(onsets=snarep)
@@ -49,7 +49,7 @@ def kicks(ctx):
 def snares(ctx):
     speed = ctx.p.freq / 1000.0
     snare = random.choice(ctx.before.get('snares'))
-    snare = dsp.read(snare)
+    snare = soundcache.read(snare)
     snare = snare * random.triangular(0.75, 0.85)
     snare = snare.speed(random.triangular(1.2, 1.4) * speed)
 
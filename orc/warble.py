@@ -1,18 +1,19 @@
 import random
 from pippi import oscs, tune
 
+# Render a tenth of a second at a time as the mixer 
+# needs it, rather than 64 seconds at once
+STREAM = True
+
 def play(ctx):
     osc = oscs.Osc('tri')
 
     while True:
-        ctx.log('playing')
         if hasattr(ctx.bus, 'input_pitch'):
             hz = ctx.bus.input_pitch
         else:
             hz = random.random() * 3 + 200
-        ctx.log('play freq %s' % hz)
-        out = osc.play(freq=hz, length=64)
+        out = osc.play(freq=hz, length=0.1)
         out = out * 0.25
         yield out
 
-
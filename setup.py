@@ -5,20 +5,29 @@ from setuptools.extension import Extension
 import numpy as np
 
 ext_modules = cythonize([
+    'astrid/backends.pyx', 
     'astrid/circle.pyx', 
+    'astrid/clock.pyx', 
     'astrid/defaults.pyx', 
     'astrid/io.pyx', 
     'astrid/logger.pyx', 
     'astrid/orc.pyx', 
     'astrid/midi.pyx', 
+    'astrid/mixer.pyx', 
     'astrid/names.pyx', 
+    'astrid/ring.pyx', 
     'astrid/sampler.pyx', 
     'astrid/server.pyx', 
+    'astrid/shm.pyx', 
+    'astrid/soundcache.pyx', 
+    'astrid/stats.pyx', 
     'astrid/voices.pyx', 
 ], include_path=[np.get_include()], annotate=True) 
 
 ext_modules = [
+    Extension('astrid.backends', ['astrid/backends.c']), 
     Extension('astrid.circle', ['astrid/circle.c']), 
+    Extension('astrid.clock', ['astrid/clock.c']), 
     Extension('astrid.defaults', ['astrid/defaults.c']), 
     Extension('astrid.io', 
              ['astrid/io.c'], 
@@ -28,9 +37,14 @@ ext_modules = [
     Extension('astrid.logger', ['astrid/logger.c']), 
     Extension('astrid.orc', ['astrid/orc.c']), 
     Extension('astrid.midi', ['astrid/midi.c']), 
+    Extension('astrid.mixer', ['astrid/mixer.c']), 
     Extension('astrid.names', ['astrid/names.c']), 
+    Extension('astrid.ring', ['astrid/ring.c']), 
     Extension('astrid.sampler', ['astrid/sampler.c']), 
     Extension('astrid.server', ['astrid/server.c']), 
+    Extension('astrid.shm', ['astrid/shm.c']), 
+    Extension('astrid.soundcache', ['astrid/soundcache.c']), 
+    Extension('astrid.stats', ['astrid/stats.c']), 
     Extension('astrid.voices', ['astrid/voices.c']), 
 ]
 
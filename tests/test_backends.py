@@ -0,0 +1,68 @@
+from unittest import TestCase
+import os
+import tempfile
+import time
+import wave
+import numpy as np
+from astrid.backends import CallbackExit, DummyBackend
+
+class TestDummyBackend(TestCase):
+    def run_blocks(self, backend, count, value=0.5):
+        frame_times = []
+
+        def process(frames):
+            if len(frame_times) == count:
+                raise CallbackExit
+            frame_times.append(backend.last_frame_time)
+            for port in backend.outports:
+                port.get_array().fill(value)
+
+        backend.set_process_callback(process)
+        backend.activate()
+        backend.thread.join(timeout=5)
+        backend.deactivate()
+        backend.close()
+        return frame_times
+
+    def test_freewheel(self):
+        backend = DummyBackend(samplerate=48000, blocksize=64, freewheel=True)
+        frame_times = self.run_blocks(backend, 100)
+        self.assertEqual(frame_times, [ i * 64 for i in range(100) ])
+        self.assertEqual(len(backend.inports), 2)
+        self.assertTrue(np.all(backend.inports[0].get_array() == 0))
+
+    def test_realtime_pacing(self):
+        backend = DummyBackend(samplerate=1000, blocksize=10)
+        start = time.monotonic()
+        self.run_blocks(backend, 10)
+
+        # Ten blocks of 10ms
+        self.assertGreater(time.monotonic() - start, 0.08)
+
+    def test_xrun_when_behind(self):
+        backend = DummyBackend(samplerate=1000, blocksize=10)
+        xruns = []
+        backend.set_xrun_callback(xruns.append)
+
+        def process(frames):
+            if backend.frame > 0:
+                raise CallbackExit
+            time.sleep(0.05)
+
+        backend.set_process_callback(process)
+        backend.activate()
+        backend.thread.join(timeout=5)
+        self.assertEqual(len(xruns), 1)
+        self.assertGreater(xruns[0], 10000)
+
+    def test_write_wav(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'out.wav')
+            backend = DummyBackend(samplerate=44100, blocksize=64, channels=2, freewheel=True, path=path)
+            self.run_blocks(backend, 10)
+
+            with wave.open(path, 'rb') as out:
+                self.assertEqual(out.getnchannels(), 2)
+                self.assertEqual(out.getnframes(), 640)
+                frames = np.frombuffer(out.readframes(640), dtype='<i2')
+            self.assertTrue(np.all(frames == int(0.5 * 32767)))
@@ -0,0 +1,51 @@
+from unittest import TestCase
+import numpy as np
+from astrid.circle import Circle
+
+class TestCircle(TestCase):
+    def setUp(self):
+        self.samplerate = 1000
+        self.circle = Circle('test-circle', create=True, channels=2, samplerate=self.samplerate, length=1)
+
+    def tearDown(self):
+        self.circle.close()
+
+    def add_blocks(self, numblocks, block_size=100):
+        for i in range(numblocks):
+            block = np.zeros((block_size, 2), dtype='d')
+            block[:,0] = i
+            block[:,1] = -i
+            self.circle.add(block)
+
+    def test_read_from_another_instance(self):
+        self.add_blocks(5)
+        reader = Circle('test-circle')
+        snd = reader.read(0.2)
+        self.assertEqual(len(snd), 200)
+        self.assertTrue(np.allclose(np.asarray(snd.frames)[:100,0], 3))
+        self.assertTrue(np.allclose(np.asarray(snd.frames)[100:,0], 4))
+        reader.close()
+
+    def test_read_across_wraparound(self):
+        # 15 blocks of 100 frames through a 1000 frame ring
+        self.add_blocks(15)
+        snd = self.circle.read(0.5, channels=(2,))
+        frames = np.asarray(snd.frames)
+        for i, value in enumerate(range(10, 15)):
+            self.assertTrue(np.allclose(frames[i*100:(i+1)*100,0], -value))
+
+    def test_read_with_offset(self):
+        self.add_blocks(5)
+        snd = self.circle.read(0.1, offset=0.2)
+        self.assertTrue(np.allclose(np.asarray(snd.frames)[:,0], 2))
+
+    def test_read_before_anything_is_recorded(self):
+        self.add_blocks(1)
+        snd = self.circle.read(0.3)
+        frames = np.asarray(snd.frames)
+        self.assertEqual(len(snd), 300)
+        self.assertTrue(np.allclose(frames[:200,0], 0))
+
+    def test_missing_ring_reads_silence(self):
+        snd = Circle('test-circle-missing', samplerate=self.samplerate).read(0.1)
+        self.assertEqual(len(snd), 100)
@@ -0,0 +1,119 @@
+from unittest import TestCase
+import gc
+import threading
+
+import msgpack
+import zmq
+
+from astrid import names
+from astrid.client import AstridClient
+
+class TestClient(TestCase):
+    def setUp(self):
+        self.context = zmq.Context()
+        # A ROUTER can ignore a request, which a REP can't
+        self.router = self.context.socket(zmq.ROUTER)
+        self.router.setsockopt(zmq.RCVTIMEO, 2000)
+        self.router.bind('tcp://127.0.0.1:*')
+        self.pull = self.context.socket(zmq.PULL)
+        self.pull.bind('tcp://127.0.0.1:*')
+        # Ephemeral ports, so a running server doesn't get in the way
+        self.client = AstridClient(timeout=200, host='127.0.0.1', msg_port=self.port(self.router), push_port=self.port(self.pull))
+
+    def port(self, sock):
+        return int(sock.getsockopt_string(zmq.LAST_ENDPOINT).rsplit(':', 1)[1])
+
+    def tearDown(self):
+        if self.client.context is not None:
+            self.client.context.destroy(linger=0)
+        self.context.destroy(linger=0)
+
+    def serve(self, count, skip=0):
+        def reply():
+            for i in range(count + skip):
+                identity, empty, msg = self.router.recv_multipart()
+                if i >= skip:
+                    # Reply to each command with its arguments
+                    cmds, legacy = names.decode(msgpack.unpackb(msg))
+                    reply = [ args for op, args in cmds ]
+                    self.router.send_multipart([identity, empty, msgpack.packb(reply)])
+
+        server = threading.Thread(target=reply)
+        server.start()
+        return server
+
+    def test_socket_is_reused(self):
+        server = self.serve(2)
+        self.assertEqual(self.client.send_cmd(['play', 'a']), ['a'])
+        sock = self.client.socket(zmq.REQ)
+        self.assertEqual(self.client.send_cmd(['play', 'b']), ['b'])
+        self.assertIs(self.client.socket(zmq.REQ), sock)
+        server.join()
+
+    def test_retry_after_timeout(self):
+        # The server drops the first request on the floor
+        server = self.serve(1, skip=1)
+        self.assertEqual(self.client.send_cmd(['list', 'a']), ['a'])
+        server.join()
+
+    def test_no_retry_for_play(self):
+        server = self.serve(0, skip=1)
+        self.assertIsNone(self.client.send_cmd(['play', 'a']))
+        server.join()
+
+        # Nothing was sent again
+        with self.assertRaises(zmq.Again):
+            self.router.recv_multipart(zmq.NOBLOCK)
+
+    def test_threads_get_their_own_socket(self):
+        socks = []
+        t = threading.Thread(target=lambda: socks.append(self.client.socket(zmq.REQ)))
+        t.start()
+        t.join()
+        self.assertIsNot(self.client.socket(zmq.REQ), socks[0])
+
+        # It was closed when its thread ended
+        gc.collect()
+        self.assertTrue(socks[0].closed)
+
+    def test_threads_share_the_push_socket(self):
+        threads = [ threading.Thread(target=self.client.send_nowait, args=(['play', i],)) for i in range(4) ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertIsNotNone(self.client.pusher)
+        self.assertEqual(sorted([ msgpack.unpackb(self.pull.recv())[1][0][1] for _ in range(4) ]), [0, 1, 2, 3])
+        self.assertNotIn(zmq.PUSH, self.client.sockets())
+
+    def test_send_batch(self):
+        server = self.serve(1)
+        replies = self.client.send_batch([['play', 'a'], [names.SET_VALUE, 'b', 1]])
+        self.assertEqual(replies, [['a'], ['b', 1]])
+        server.join()
+
+    def test_send_nowait(self):
+        self.assertTrue(self.client.send_nowait(['play', 'a']))
+        msg = msgpack.unpackb(self.pull.recv())
+        self.assertEqual(msg, [names.PROTOCOL_VERSION, [[names.PLAY_INSTRUMENT, 'a']]])
+
+
+class TestProtocol(TestCase):
+    def test_encode_names_as_opcodes(self):
+        msg = names.encode([['play', 'a', {'freq': 1}], [names.STOP_ALL_VOICES]])
+        self.assertEqual(msg, [names.PROTOCOL_VERSION, [[names.PLAY_INSTRUMENT, 'a', {'freq': 1}], [names.STOP_ALL_VOICES]]])
+
+    def test_decode(self):
+        cmds, legacy = names.decode(names.encode([['play', 'a'], ['stop_all']]))
+        self.assertFalse(legacy)
+        self.assertEqual(cmds, [(names.PLAY_INSTRUMENT, ['a']), (names.STOP_ALL_VOICES, [])])
+
+    def test_decode_legacy(self):
+        cmds, legacy = names.decode(['play', 'a'])
+        self.assertTrue(legacy)
+        self.assertEqual(cmds, [(names.PLAY_INSTRUMENT, ['a'])])
+
+    def test_decode_unknown_version(self):
+        with self.assertRaises(ValueError):
+            names.decode([99, [[names.PLAY_INSTRUMENT]]])
@@ -0,0 +1,101 @@
+from unittest import TestCase
+import queue
+import threading
+import time
+import numpy as np
+from pippi.soundbuffer import SoundBuffer
+from astrid import io
+from astrid.clock import FrameClock
+from astrid.orc import EventContext
+
+class TestStream(TestCase):
+    def setUp(self):
+        self.samplerate = 1000
+        self.clock = FrameClock()
+        self.clock.set_samplerate(self.samplerate)
+        self.clock.tick(0)
+        self.buf_q = queue.Queue()
+        self.ctx = EventContext(instrument_name='stream', running=threading.Event(), shutdown=threading.Event(), stop_me=threading.Event())
+        self.rendered = []
+
+    def tearDown(self):
+        while not self.buf_q.empty():
+            io.attach(self.buf_q.get_nowait()).release()
+
+    def player(self, chunks):
+        def play(ctx):
+            for i in range(chunks):
+                self.rendered.append(time.monotonic())
+                yield SoundBuffer(np.full((50, 2), i, dtype='d'), channels=2, samplerate=self.samplerate)
+        return play
+
+    def render(self, player, lookahead, levels=False):
+        next_frames = []
+        io.render_sequence(self.buf_q, player, self.ctx, io.default_onsets(self.ctx), False, 1, self.clock, 100, lookahead, next_frames, True, levels)
+        return next_frames
+
+    def test_chunks_follow_on(self):
+        next_frames = self.render(self.player(4), 1)
+        frames = [ self.buf_q.get_nowait()[5] for _ in range(4) ]
+        self.assertEqual(frames, [100, 150, 200, 250])
+        self.assertEqual(next_frames, [300])
+
+    def test_chunks_are_paced_by_the_clock(self):
+        self.render(self.player(4), 0.05)
+
+        # Each chunk is 50ms long and rendered 50ms 
+        # before it's due, so the last comes 150ms 
+        # after the first
+        self.assertGreater(self.rendered[-1] - self.rendered[0], 0.12)
+
+    def test_late_chunk_moves_the_stream(self):
+        def play(ctx):
+            yield SoundBuffer(np.zeros((50, 2), dtype='d'), channels=2, samplerate=self.samplerate)
+            # Miss the second chunk's frame by a long way
+            time.sleep(0.3)
+            for i in range(2):
+                yield SoundBuffer(np.zeros((50, 2), dtype='d'), channels=2, samplerate=self.samplerate)
+
+        next_frames = self.render(play, 0.01)
+        frames = [ self.buf_q.get_nowait()[5] for _ in range(3) ]
+
+        # The late chunk starts just ahead of the clock, 
+        # and the one after it follows on without overlap
+        self.assertEqual(frames[0], 100)
+        self.assertGreater(frames[1], 300)
+        self.assertEqual(frames[2], frames[1] + 50)
+        self.assertEqual(next_frames, [frames[2] + 50])
+
+    def test_stop_ends_the_stream(self):
+        def play(ctx):
+            while True:
+                ctx.stop_me.set()
+                yield SoundBuffer(np.zeros((50, 2), dtype='d'), channels=2, samplerate=self.samplerate)
+
+        self.render(play, 1)
+        self.assertEqual(self.buf_q.qsize(), 1)
+
+    def test_trace_goes_with_the_first_chunk(self):
+        self.ctx.trace = {'id': 0, 'instrument': 'stream'}
+        self.render(self.player(2), 1)
+
+        first = self.buf_q.get_nowait()
+        second = self.buf_q.get_nowait()
+        io.attach(first).release()
+        io.attach(second).release()
+
+        trace = first[6]
+        self.assertLessEqual(trace['render_start'], trace['rendered'])
+        self.assertLessEqual(trace['rendered'], trace['shared'])
+        self.assertIsNone(second[6])
+        self.assertIsNone(self.ctx.trace)
+
+    def test_level_only_when_asked(self):
+        def play(ctx):
+            yield SoundBuffer(np.array([[0.25, -0.75], [0.5, 0]], dtype='d'), channels=2, samplerate=self.samplerate)
+
+        self.render(play, 1)
+        self.assertEqual(self.ctx.level, 0)
+
+        self.render(play, 1, levels=True)
+        self.assertEqual(self.ctx.level, 0.75)
@@ -0,0 +1,111 @@
+from unittest import TestCase
+import logging
+import queue
+from logging.handlers import QueueListener
+from astrid import logger as astrid_logger
+
+class Counted:
+    """ Counts how often it gets formatted
+    """
+    def __init__(self):
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return 'counted'
+
+class Collect(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+class TestLogger(TestCase):
+    def setUp(self):
+        self.q = queue.SimpleQueue()
+        self.handler = astrid_logger.LazyQueueHandler(self.q)
+        self.base = logging.getLogger('astrid-test')
+        self.base.propagate = False
+        self.base.setLevel(logging.DEBUG)
+        self.base.addHandler(self.handler)
+        self.log = astrid_logger.PrettyPrintAdapter(self.base, {})
+
+    def tearDown(self):
+        self.base.removeHandler(self.handler)
+
+    def test_formatting_happens_on_the_listener(self):
+        arg = Counted()
+        self.log.info('value %s', arg)
+
+        # Queued as is, not merged into a string
+        record = self.q.get_nowait()
+        self.assertEqual(record.msg, 'value %s')
+        self.assertEqual(record.args, (arg,))
+
+        self.q.put(record)
+        collect = Collect()
+        listener = QueueListener(self.q, collect)
+        listener.start()
+        listener.stop()
+        self.assertEqual(collect.messages, ['value counted'])
+
+    def test_disabled_levels_are_not_formatted(self):
+        arg = Counted()
+        self.base.setLevel(logging.INFO)
+        self.log.debug('value %s', arg)
+        self.assertTrue(self.q.empty())
+        self.assertEqual(arg.formatted, 0)
+
+    def test_non_strings_are_pretty_printed(self):
+        self.log.info({'a': 1})
+        self.assertEqual(self.q.get_nowait().getMessage(), "{'a': 1}")
+
+    def test_rate_limit(self):
+        self.handler.addFilter(astrid_logger.RateLimitFilter(rate=1, burst=3))
+        for i in range(10):
+            self.log.info('busy %s', i)
+
+        messages = []
+        while not self.q.empty():
+            messages.append(self.q.get_nowait().getMessage())
+        self.assertEqual(messages, ['busy 0', 'busy 1', 'busy 2'])
+
+    def test_rate_limit_per_message(self):
+        self.handler.addFilter(astrid_logger.RateLimitFilter(rate=1, burst=1))
+        for msg in ('one %s', 'two %s', 'one %s'):
+            self.log.info(msg, 0)
+
+        messages = []
+        while not self.q.empty():
+            messages.append(self.q.get_nowait().getMessage())
+        self.assertEqual(messages, ['one 0', 'two 0'])
+
+    def test_errors_are_not_rate_limited(self):
+        self.handler.addFilter(astrid_logger.RateLimitFilter(rate=1, burst=1))
+        for i in range(5):
+            self.log.error('failed %s', i)
+        self.assertEqual(self.q.qsize(), 5)
+
+    def test_rate_limit_reports_dropped(self):
+        limit = astrid_logger.RateLimitFilter(rate=1, burst=1)
+        self.handler.addFilter(limit)
+
+        for i in range(3):
+            if i == 2:
+                # Let the bucket refill
+                key = list(limit.sites.keys())[0]
+                tokens, last, dropped = limit.sites[key]
+                limit.sites[key] = (tokens, last - 2, dropped)
+            self.log.info('busy %s', i)
+
+        messages = []
+        while not self.q.empty():
+            messages.append(self.q.get_nowait().getMessage())
+        self.assertEqual(messages, ['busy 0', 'busy 2 (1 similar messages dropped)'])
+
+    def test_set_level(self):
+        astrid_logger.set_level('warning', 'test-set-level')
+        self.assertEqual(logging.getLogger('astrid.test-set-level').level, logging.WARNING)
+        self.assertEqual(astrid_logger.get_logger('test-set-level').logger.name, 'astrid.test-set-level')
@@ -0,0 +1,42 @@
+from unittest import TestCase
+from astrid import midi, shm
+
+class TestMidiStateTable(TestCase):
+    def setUp(self):
+        self.device = 'Test Device:0 20:0'
+        self.table = midi.MidiStateTable(self.device, create=True)
+
+    def tearDown(self):
+        shm.unlink(self.table.name)
+        midi._tables.clear()
+
+    def test_read_from_bucket(self):
+        self.table.set_cc(3, 0.5)
+        self.table.set_note(60, 0.8)
+        bucket = midi.MidiDeviceBucket(self.device, {'knob': 'cc3'})
+        self.assertEqual(bucket.knob, 0.5)
+        self.assertEqual(bucket.cc3, 0.5)
+        self.assertEqual(bucket.getnote(60), 0.8)
+        self.assertGreater(bucket.changed('knob'), 0)
+
+    def test_unset_values_use_default(self):
+        bucket = midi.MidiDeviceBucket(self.device)
+        self.assertIsNone(bucket.cc1)
+        self.assertEqual(bucket.get('cc1', 0.25), 0.25)
+        self.assertEqual(bucket.getnote(61, 0), 0)
+
+    def test_unmapped_names_use_default(self):
+        bucket = midi.MidiDeviceBucket(self.device, {'knob': 'cc3'})
+        self.assertEqual(bucket.get('slider', 0.25), 0.25)
+        self.assertIsNone(bucket.slider)
+        self.assertEqual(bucket.getnote('slider', 0), 0)
+        self.assertIsNone(bucket.changed('slider'))
+
+    def test_note_off(self):
+        self.table.set_note(60, 0.8)
+        self.table.set_note(60, 0)
+        self.assertEqual(midi.MidiDeviceBucket(self.device).getnote(60, 1), 0)
+
+    def test_missing_device(self):
+        bucket = midi.MidiDeviceBucket()
+        self.assertEqual(bucket.get('cc1', 1), 1)
@@ -1,135 +1,123 @@
-import random
 from unittest import TestCase
-#from astrid.mixer import AstridMixer, StreamContext, StreamContextView
-from astrid import orc
-import multiprocessing as mp
-import threading
-from pippi import dsp, interpolation, grains
-
-"""
+import time
+import numpy as np
+from pippi.soundbuffer import SoundBuffer
+from astrid.io import BufferNode
+from astrid.mixer import AstridMixer
+from astrid.ring import ObjectRing
+
+class Port:
+    """ Stands in for a jack.OwnPort output
+    """
+    def __init__(self, block_size):
+        self.array = np.zeros(block_size, dtype='f')
+
+    def get_array(self):
+        return self.array
 
 class TestMixer(TestCase):
-    def test_play_sample(self):
-        block_size = 64
-        channels = 2
-        samplerate = 44100
-
-        #ctx = StreamContext()
-        #ctx_ptr = ctx.get_pointer()
-        mixer = AstridMixer(block_size, channels, samplerate)
-
-        snd = dsp.read('tests/sounds/linus.wav')
-
-        mixer.add(snd)
-        mixer.sleep(snd.dur*1000.0)
-
-        mixer.shutdown()
-
-    def test_play_clouds(self):
-        def makecloud(snd):
-            return grains.GrainCloud(snd * 0.5, 
-                        win=dsp.HANN, 
-                        read_lfo=dsp.PHASOR, 
-                        speed_lfo=dsp.RND, 
-                        density_lfo_wt=interpolation.linear([ random.random() for _ in range(random.randint(10, 1000)) ], 4096), 
-                        grainlength_lfo_wt=interpolation.linear([ random.random() for _ in range(random.randint(10, 500)) ], 4096), 
-                        minspeed=0.75, 
-                        maxspeed=random.triangular(1, 3),
-                        density=random.triangular(0.75, 2),
-                        minlength=30, 
-                        maxlength=random.triangular(60, 1000),
-                        spread=random.random(),
-                        jitter=random.triangular(0, 0.1),
-                    ).play(snd.dur * random.triangular(3, 4))
-
-        block_size = 64
-        channels = 2
-        samplerate = 44100
-
-        #ctx = StreamContext()
-        #ctx_ptr = ctx.get_pointer()
-        mixer = AstridMixer(block_size, channels, samplerate)
-
-        mixer.sleep(2000.0)
-        snd = mixer.read(44100)
-
-        #ctx_view = StreamContextView(ctx_ptr)
-        #snd = ctx_view.read(44100, 0)
-
-        for i in range(10):
-            out = makecloud(snd)
-            #out.write('cldhm%s.wav' % i)
-
-            mixer.add(out)
-
-        mixer.sleep(5000.0)
-
-        mixer.shutdown()
-
-
-
-    def test_play_note_sequence(self):
-        block_size = 64
-        channels = 2
-        samplerate = 44100
-
-        #ctx = StreamContext()
-        #ctx_ptr = ctx.get_pointer()
-        mixer = AstridMixer(block_size, channels, samplerate)
-        manager = mp.Manager()
-        bus = manager.Namespace()
-        bus.stop_all = manager.Event() # voices
-        bus.shutdown_flag = manager.Event() # render & analysis processes
-        bus.stop_listening = manager.Event() # midi listeners
-
-        instrument_name = 'test'
-        instrument = orc.load_instrument(instrument_name, 'orc/tone.py', bus)
-        params = None
-        ctx = instrument.create_ctx(params)
-        numnotes = 6
-
-        for _ in range(numnotes):
-            generator = instrument.renderer.play(ctx)
-
-            for snd in generator:
-                self.assertTrue(len(snd) > 0)
-                mixer.add(snd)
-            mixer.sleep(random.randint(0, 100))
-
-        mixer.sleep(1000)
-        generator = instrument.renderer.play(ctx)
-
-        for snd in generator:
-            self.assertTrue(len(snd) > 0)
-            mixer.add(snd)
-
-        mixer.sleep(1000)
-
-        mixer.shutdown()
-
-
-    def test_play_input_recording(self):
-        block_size = 64
-        channels = 2
-        samplerate = 44100
-        lengthms = 2000
-
-        #ctx = StreamContext()
-        #ctx_ptr = ctx.get_pointer()
-        mixer = AstridMixer(block_size, channels, samplerate)
-
-        # fill up the ringbuffer for a while
-        mixer.sleep(lengthms)
-
-        # get the recording from the mixer
-        #ctx_view = StreamContextView(ctx_ptr)
-        #snd = ctx_view.read(int(lengthms * 0.001 * samplerate), 0)
-        snd = mixer.read(int(lengthms * 0.001 * samplerate))
-        snd.write('inp.wav')
-
-        # play the sound
-        mixer.add(snd)
-        mixer.sleep(lengthms * 2)
-
-        mixer.shutdown()
-"""
+    def setUp(self):
+        self.block_size = 64
+        self.channels = 2
+        self.samplerate = 44100
+        self.ports = [ Port(self.block_size) for _ in range(self.channels) ]
+        self.mixer = AstridMixer(self.block_size, self.channels, self.samplerate)
+
+    def node(self, value, length, channels=2, start_frame=-1):
+        snd = SoundBuffer(np.full((length, channels), value, dtype='d'), channels=channels, samplerate=self.samplerate)
+        return BufferNode(snd, 0, 0, start_frame)
+
+    def test_sum_voices(self):
+        for _ in range(3):
+            self.mixer.add(self.node(0.25, 1000))
+
+        active = self.mixer.process(self.ports, self.block_size)
+        self.assertEqual(active, 3)
+        for port in self.ports:
+            self.assertTrue(np.allclose(port.array, 0.75))
+
+    def test_mono_voice_fills_every_channel(self):
+        self.mixer.add(self.node(0.5, 1000, channels=1))
+        self.mixer.process(self.ports, self.block_size)
+        for port in self.ports:
+            self.assertTrue(np.allclose(port.array, 0.5))
+
+    def test_retire_finished_voices(self):
+        short = self.node(0.5, 100)
+        long = self.node(0.25, 1000)
+        self.mixer.add(short)
+        self.mixer.add(long)
+
+        self.assertEqual(self.mixer.process(self.ports, self.block_size), 2)
+        self.assertEqual(self.mixer.process(self.ports, self.block_size), 1)
+        self.assertEqual(short.done_playing, 1)
+        self.assertEqual(self.mixer.retired, 1)
+
+        # The tail of the short voice is mixed before it is retired
+        self.assertTrue(np.allclose(self.ports[0].array[:36], 0.75))
+        self.assertTrue(np.allclose(self.ports[0].array[36:], 0.25))
+
+        # The accumulator is cleared between blocks
+        self.mixer.process(self.ports, self.block_size)
+        self.assertTrue(np.allclose(self.ports[0].array, 0.25))
+
+    def test_silence_when_empty(self):
+        self.ports[0].array.fill(1)
+        self.assertEqual(self.mixer.process(self.ports, self.block_size), 0)
+        for port in self.ports:
+            self.assertTrue(np.allclose(port.array, 0))
+
+    def test_scheduled_voice_starts_on_frame(self):
+        node = self.node(0.5, 1000, start_frame=1000 + self.block_size + 10)
+        self.mixer.add(node)
+
+        self.mixer.process(self.ports, self.block_size, 1000)
+        self.assertEqual(node.pos, 0)
+        self.assertTrue(np.allclose(self.ports[0].array, 0))
+
+        self.mixer.process(self.ports, self.block_size, 1000 + self.block_size)
+        self.assertEqual(node.pos, self.block_size - 10)
+        self.assertTrue(np.allclose(self.ports[0].array[:10], 0))
+        self.assertTrue(np.allclose(self.ports[0].array[10:], 0.5))
+
+        self.mixer.process(self.ports, self.block_size, 1000 + self.block_size * 2)
+        self.assertTrue(np.allclose(self.ports[0].array, 0.5))
+
+    def test_late_voice_plays_immediately(self):
+        node = self.node(0.5, 1000, start_frame=10)
+        self.mixer.add(node)
+        self.mixer.process(self.ports, self.block_size, 1000)
+        self.assertTrue(np.allclose(self.ports[0].array, 0.5))
+        self.assertEqual(self.mixer.late, 1)
+
+    def test_take_voices_from_ring(self):
+        incoming = ObjectRing(2)
+        self.assertTrue(incoming.push(self.node(0.25, 1000)))
+        self.assertTrue(incoming.push(self.node(0.25, 1000)))
+        self.assertFalse(incoming.push(self.node(0.25, 1000)))
+        self.assertEqual(incoming.dropped, 1)
+
+        self.assertEqual(self.mixer.take(incoming), 2)
+        self.assertEqual(len(incoming), 0)
+        self.assertEqual(self.mixer.process(self.ports, self.block_size), 2)
+        self.assertTrue(np.allclose(self.ports[0].array, 0.5))
+
+    def test_traced_voice_stamps_first_sample(self):
+        node = self.node(0.5, 1000, start_frame=1032)
+        node.trace = {'id': 0, 'instrument': 'a'}
+        self.mixer.add(node)
+
+        # Not due yet
+        self.mixer.process(self.ports, self.block_size, 960)
+        self.assertEqual(self.mixer.traces(), [])
+
+        before = time.monotonic()
+        self.mixer.process(self.ports, self.block_size, 1024)
+        traces = self.mixer.traces()
+        self.assertEqual(len(traces), 1)
+
+        # Eight frames into the block
+        self.assertGreaterEqual(traces[0]['first_out'], before + 8 / self.samplerate)
+
+        self.mixer.process(self.ports, self.block_size, 1088)
+        self.assertEqual(self.mixer.traces(), [])
@@ -1,9 +1,17 @@
+import os
 import random
+import tempfile
+import time
 from unittest import TestCase
 from astrid import orc
 import multiprocessing as mp
 import threading
 
+import msgpack
+import redis
+
+from watchdog.events import DirModifiedEvent, FileModifiedEvent, FileMovedEvent
+
 class TestOrc(TestCase):
     def test_load_instrument_from_path(self):
         manager = mp.Manager()
@@ -22,3 +30,129 @@ class TestOrc(TestCase):
         for snd in generator:
             self.assertTrue(len(snd) > 0)
 
+
+class TestInstrumentReload(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'counter.py')
+        self.write('VALUE = 1\n')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, source):
+        with open(self.path, 'w') as f:
+            f.write(source)
+
+        # Make sure the change is visible even on coarse mtimes
+        st = os.stat(self.path)
+        os.utime(self.path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000))
+
+    def test_unchanged_script_is_not_run_again(self):
+        instrument = orc.load_instrument('counter', self.path)
+        renderer = instrument.renderer
+        self.assertFalse(instrument.reload())
+        self.assertIs(instrument.renderer, renderer)
+
+        # Saved again with the same contents
+        self.write('VALUE = 1\n')
+        self.assertFalse(instrument.reload())
+        self.assertIs(instrument.renderer, renderer)
+
+    def test_changed_script_is_swapped_in(self):
+        instrument = orc.load_instrument('counter', self.path)
+        self.write('VALUE = 2\n')
+        self.assertTrue(instrument.reload())
+        self.assertEqual(instrument.renderer.VALUE, 2)
+
+    def test_broken_script_keeps_the_old_module(self):
+        instrument = orc.load_instrument('counter', self.path)
+        self.write('VALUE = 3\nraise ValueError\n')
+        self.assertFalse(instrument.reload())
+        self.assertEqual(instrument.renderer.VALUE, 1)
+
+    def test_compiled_code_is_cached(self):
+        digest, code = orc.modules.compile(self.path)
+        self.assertIs(orc.modules.compile(self.path)[1], code)
+
+class TestInstrumentHandler(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'tone.py')
+        with open(self.path, 'w') as f:
+            f.write('VALUE = 1\n')
+
+        self.reloads = []
+        self.reloaded = threading.Event()
+        self.handler = orc.InstrumentHandler(self.reload, self.dir.name, delay=0.05)
+
+    def tearDown(self):
+        self.handler.cancel()
+        self.dir.cleanup()
+
+    def reload(self, name, path):
+        self.reloads.append((name, path))
+        self.reloaded.set()
+
+    def test_events_are_coalesced(self):
+        for _ in range(5):
+            self.handler.on_modified(FileModifiedEvent(self.path))
+        self.handler.on_moved(FileMovedEvent(self.path + '.swp', self.path))
+
+        self.assertTrue(self.reloaded.wait(timeout=1))
+        time.sleep(0.1)
+        self.assertEqual(self.reloads, [('tone', self.path)])
+
+    def test_other_files_are_ignored(self):
+        self.handler.on_modified(FileModifiedEvent(self.path + '.swp'))
+        self.handler.on_modified(DirModifiedEvent(self.dir.name))
+        self.assertFalse(self.reloaded.wait(timeout=0.2))
+
+class TestEventContext(TestCase):
+    def test_copy_keeps_its_own_counters(self):
+        ctx = orc.EventContext(params={'a': 1}, instrument_name='test', stop_me=threading.Event())
+        ctx.tick = 3
+        ctx.level = 0.5
+        ctx.trace = {'id': 1}
+
+        player_ctx = ctx.copy()
+        self.assertEqual(player_ctx.p.a, 1)
+        self.assertEqual(player_ctx.instrument_name, 'test')
+        self.assertIs(player_ctx.stop_me, ctx.stop_me)
+        self.assertEqual((player_ctx.tick, player_ctx.level, player_ctx.trace), (0, 0, None))
+
+        player_ctx.tick += 1
+        self.assertEqual(ctx.tick, 3)
+
+class PubSub:
+    """ Yields the given updates, then drops the 
+        connection if told to
+    """
+    def __init__(self, updates, drop):
+        self.updates = updates
+        self.drop = drop
+
+    def listen(self):
+        for key, value in self.updates:
+            yield {'type': 'message', 'data': msgpack.packb([key, value])}
+        if self.drop:
+            raise redis.ConnectionError('gone')
+
+    def reset(self):
+        pass
+
+class TestSessionParamCache(TestCase):
+    def test_resubscribe_after_disconnect(self):
+        cache = orc.SessionParamCache()
+        seen = []
+        def update(key, value):
+            seen.append((key, value, dict(cache.values)))
+            cache.values[key] = value
+        cache.update = update
+        cache.subscribe = lambda: PubSub([('b', '2')], False)
+
+        cache.wait_for_updates(PubSub([('a', '1')], True))
+
+        # Values cached before the drop are forgotten
+        self.assertEqual(seen, [('a', '1', {}), ('b', '2', {})])
+        self.assertEqual(cache.values, {'b': '2'})
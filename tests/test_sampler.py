@@ -0,0 +1,105 @@
+from unittest import TestCase
+import numpy as np
+from pippi.soundbuffer import SoundBuffer
+from astrid.sampler import Sampler
+
+class TestSampler(TestCase):
+    def setUp(self):
+        self.sampler = Sampler()
+        self.bank = 'test-bank'
+
+    def tearDown(self):
+        self.sampler.clear(self.bank)
+
+    def snd(self, value, length=1000, channels=2):
+        return SoundBuffer(np.full((length, channels), value, dtype='d'), channels=channels, samplerate=44100)
+
+    def test_write_and_read(self):
+        self.assertFalse(self.sampler.has(self.bank))
+        self.sampler.write(self.bank, self.snd(0.5))
+        self.assertTrue(self.sampler.has(self.bank))
+
+        snd = Sampler().read(self.bank)
+        self.assertEqual(len(snd), 1000)
+        self.assertEqual(snd.channels, 2)
+        self.assertEqual(snd.samplerate, 44100)
+        self.assertTrue(np.allclose(np.asarray(snd.frames), 0.5))
+
+    def test_rewrite_replaces_bank(self):
+        self.sampler.write(self.bank, self.snd(0.5))
+        first = self.sampler.read(self.bank)
+        self.sampler.write(self.bank, self.snd(0.25, length=500))
+        second = self.sampler.read(self.bank)
+
+        self.assertEqual(len(second), 500)
+        self.assertTrue(np.allclose(np.asarray(second.frames), 0.25))
+
+        # Earlier reads keep the frames they were given
+        self.assertTrue(np.allclose(np.asarray(first.frames), 0.5))
+
+    def test_clear(self):
+        self.sampler.write(self.bank, self.snd(0.5))
+        self.sampler.clear(self.bank)
+        self.assertFalse(self.sampler.has(self.bank))
+
+    def test_dub_with_offset_and_feedback(self):
+        self.sampler.write(self.bank, self.snd(0.5))
+        self.sampler.dub(self.bank, self.snd(0.25, length=100), offset=200, feedback=0.5)
+
+        frames = np.asarray(self.sampler.read(self.bank).frames)
+        self.assertEqual(len(frames), 1000)
+        self.assertTrue(np.allclose(frames[:200], 0.5))
+        self.assertTrue(np.allclose(frames[200:300], 0.5))
+        self.assertTrue(np.allclose(frames[300:], 0.5))
+
+        self.sampler.dub(self.bank, self.snd(0.25, length=100), offset=200)
+        frames = np.asarray(self.sampler.read(self.bank).frames)
+        self.assertTrue(np.allclose(frames[200:300], 0.75))
+
+    def test_dub_grows_bank(self):
+        self.sampler.write(self.bank, self.snd(0.5))
+        reader = Sampler()
+        self.assertEqual(len(reader.read(self.bank)), 1000)
+
+        self.sampler.dub(self.bank, self.snd(0.25, length=500), offset=800)
+        frames = np.asarray(reader.read(self.bank).frames)
+        self.assertEqual(len(frames), 1300)
+        self.assertTrue(np.allclose(frames[800:1000], 0.75))
+        self.assertTrue(np.allclose(frames[1000:], 0.25))
+
+    def test_dub_mono_into_stereo(self):
+        self.sampler.write(self.bank, self.snd(0.5))
+        self.sampler.dub(self.bank, self.snd(0.25, channels=1))
+        frames = np.asarray(self.sampler.read(self.bank).frames)
+        self.assertTrue(np.allclose(frames, 0.75))
+
+    def test_dub_creates_bank(self):
+        self.sampler.dub(self.bank, self.snd(0.25, length=100), offset=100)
+        frames = np.asarray(self.sampler.read(self.bank).frames)
+        self.assertEqual(len(frames), 200)
+        self.assertTrue(np.allclose(frames[:100], 0))
+        self.assertTrue(np.allclose(frames[100:], 0.25))
+
+    def test_dub_rejects_negative_offset(self):
+        self.sampler.write(self.bank, self.snd(0.5))
+        with self.assertRaises(ValueError):
+            self.sampler.dub(self.bank, self.snd(0.25, length=100), offset=-50)
+        self.assertTrue(np.allclose(np.asarray(self.sampler.read(self.bank).frames), 0.5))
+
+    def test_reads_are_private(self):
+        self.sampler.write(self.bank, self.snd(0.5))
+        first = self.sampler.read(self.bank)
+        second = self.sampler.read(self.bank)
+        np.asarray(first.frames)[:] = 0
+
+        self.assertTrue(np.allclose(np.asarray(second.frames), 0.5))
+        self.assertTrue(np.allclose(np.asarray(self.sampler.read(self.bank).frames), 0.5))
+
+    def test_read_is_a_copy(self):
+        self.sampler.write(self.bank, self.snd(0.5))
+        snd = self.sampler.read(self.bank)
+        np.asarray(snd.frames)[:] = 0
+        self.sampler.dub(self.bank, self.snd(0.25), feedback=1)
+
+        self.assertTrue(np.allclose(np.asarray(snd.frames), 0))
+        self.assertTrue(np.allclose(np.asarray(self.sampler.read(self.bank).frames), 0.75))
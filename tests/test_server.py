@@ -0,0 +1,107 @@
+from unittest import TestCase
+import os
+import queue
+
+import msgpack
+import numpy as np
+
+from pippi.soundbuffer import SoundBuffer
+
+from astrid import io
+from astrid import names
+from astrid.mixer import AstridMixer
+from astrid.ring import ObjectRing
+from astrid.server import AstridServer
+
+class TestStartupTimes(TestCase):
+    def setUp(self):
+        self.server = AstridServer(numrenderers=2, preload=[])
+
+    def test_reply_packs_with_strict_map_keys(self):
+        status_q = queue.Queue()
+        for i in range(2):
+            status_q.put((names.RENDERER_READY, i, {'pippi': 0.1, 'total': 0.2, 'instruments': {'total': 0.1}}))
+        status_q.put(names.SHUTDOWN)
+        self.server.wait_for_status(status_q)
+        self.assertTrue(self.server.ready.is_set())
+
+        self.server.mark('total', 0)
+        reply = msgpack.unpackb(msgpack.packb(self.server.handle_startup_times([])), strict_map_key=True)
+        self.assertEqual(sorted(reply['renderers'].keys()), ['0', '1'])
+        self.assertEqual(reply['renderers']['1']['instruments']['total'], 0.1)
+        self.assertIn('total', reply['phases'])
+
+class TestCommands(TestCase):
+    def setUp(self):
+        self.server = AstridServer(numrenderers=1, preload=[])
+
+    def test_empty_replies_are_kept(self):
+        replies = self.server.handle_cmds([(names.LATENCY, []), (names.LIST_INSTRUMENTS, [])])
+        self.assertEqual(replies, [{}, []])
+
+    def test_no_reply_is_ok(self):
+        self.server.param_q = queue.Queue()
+        replies = self.server.handle_cmds([(names.SET_VALUE, ['a:1'])])
+        self.assertEqual(replies, [names.MSG_OK])
+        self.assertEqual(self.server.param_q.get_nowait(), ['a:1'])
+
+    def test_failed_command_is_bad_params(self):
+        self.server.param_q = queue.Queue()
+        replies = self.server.handle_cmds([(names.STOP_INSTRUMENT, []), (names.SET_VALUE, ['a:1'])])
+        self.assertEqual(replies, [names.MSG_BAD_PARAMS, names.MSG_OK])
+
+    def test_malformed_frame(self):
+        sent = []
+        self.server.msgsock = type('Sock', (), {'send_multipart': lambda self, frames: sent.append(frames)})()
+        self.server.dispatch([b'id', b''], b'\xc1 not msgpack')
+        self.server.dispatch(None, msgpack.packb(7))
+        self.assertEqual(sent, [[b'id', b'', msgpack.packb(names.MSG_BAD_PARAMS)]])
+
+    def test_dub_rejects_negative_offset(self):
+        self.assertEqual(self.server.handle_cmds([(names.DUB_BANK, ['b', '1', '-0.5'])]), [names.MSG_BAD_PARAMS])
+
+    def test_only_slow_commands_go_to_the_pool(self):
+        submitted = []
+        self.server.workers = type('Pool', (), {'submit': lambda self, fn, *args: submitted.append((fn, args))})()
+        self.server.param_q = queue.Queue()
+        self.server.replies = queue.SimpleQueue()
+        self.server.wakeup_r, self.server.wakeup_w = os.pipe()
+        self.addCleanup(os.close, self.server.wakeup_r)
+        self.addCleanup(os.close, self.server.wakeup_w)
+        cmds = [[names.DUB_BANK, 'b', '1', '-0.5'], [names.SET_VALUE, 'a:1'], [names.LIST_INSTRUMENTS]]
+
+        self.server.dispatch([b'id', b''], msgpack.packb(names.encode(cmds)))
+
+        # The fast commands already ran on this thread
+        self.assertEqual(self.server.param_q.get_nowait(), ['a:1'])
+        self.assertEqual(len(submitted), 1)
+
+        fn, args = submitted[0]
+        fn(*args)
+        envelope, replies, legacy = self.server.replies.get_nowait()
+        self.assertEqual(replies, [names.MSG_BAD_PARAMS, names.MSG_OK, []])
+
+class TestBuffers(TestCase):
+    def setUp(self):
+        self.server = AstridServer(numrenderers=1, preload=[])
+        self.server.mixer = AstridMixer(64, 2, 48000)
+
+    def share(self):
+        snd = SoundBuffer(np.zeros((10, 2), dtype='d'), channels=2, samplerate=48000)
+        return io.share(snd, 0, 0, -1, None)
+
+    def test_shutdown_releases_waiting_buffers(self):
+        incoming = ObjectRing(4)
+        waiting = self.share()
+        incoming.push(io.attach(waiting))
+
+        buf_q = queue.Queue()
+        late = self.share()
+        buf_q.put(names.SHUTDOWN)
+        buf_q.put(late)
+        self.assertTrue(os.path.exists('/dev/shm/%s' % late[0]))
+
+        self.server.wait_for_buffers(buf_q, incoming)
+        self.assertEqual(len(incoming), 0)
+        for name in (waiting[0], late[0]):
+            self.assertFalse(os.path.exists('/dev/shm/%s' % name))
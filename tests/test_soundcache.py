@@ -0,0 +1,84 @@
+from unittest import TestCase
+import glob
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from astrid import shm
+from astrid.soundcache import SoundCache, segment_name
+
+# Keep clear of the segments of a server on the same machine
+PREFIX = 'test-sound-%s' % os.getpid()
+
+def path(cache, name):
+    return shm.path(segment_name(cache.digest(name), PREFIX))
+
+class TestSoundCache(TestCase):
+    def setUp(self):
+        self.cache = SoundCache(prefix=PREFIX)
+        self.cache.clear()
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.cache.clear()
+        self.dir.cleanup()
+
+    def copy(self, name, dest):
+        path = os.path.join(self.dir.name, dest)
+        shutil.copy('tests/sounds/%s' % name, path)
+        return path
+
+    def test_read(self):
+        snd = self.cache.read('tests/sounds/linux.wav')
+        self.assertTrue(len(snd) > 0)
+        self.assertTrue(os.path.exists(path(self.cache, 'tests/sounds/linux.wav')))
+
+    def test_same_contents_share_a_segment(self):
+        a = self.copy('linux.wav', 'a.wav')
+        b = self.copy('linux.wav', 'b.wav')
+        self.assertEqual(self.cache.digest(a), self.cache.digest(b))
+        self.cache.read(a)
+        self.cache.read(b)
+        segments = glob.glob(shm.path(segment_name('*', PREFIX)))
+        self.assertEqual([ s for s in segments if not s.endswith('.lock') ], [ path(self.cache, a) ])
+
+    def test_shared_between_caches(self):
+        snd = self.cache.read('tests/sounds/linux.wav')
+        other = SoundCache(prefix=PREFIX).read('tests/sounds/linux.wav')
+        self.assertTrue(np.array_equal(np.asarray(snd.frames), np.asarray(other.frames)))
+
+    def test_writes_stay_private(self):
+        snd = self.cache.read('tests/sounds/linux.wav')
+        frames = np.asarray(snd.frames)
+        original = frames[:10].copy()
+        frames[:10] = 1
+
+        other = SoundCache(prefix=PREFIX).read('tests/sounds/linux.wav')
+        self.assertTrue(np.array_equal(np.asarray(other.frames)[:10], original))
+
+    def test_reads_are_private(self):
+        first = self.cache.read('tests/sounds/linux.wav')
+        second = self.cache.read('tests/sounds/linux.wav')
+        original = np.asarray(second.frames)[:10].copy()
+        np.asarray(first.frames)[:10] = 1
+        self.assertTrue(np.array_equal(np.asarray(second.frames)[:10], original))
+
+    def test_evict_least_recently_used(self):
+        linux = 'tests/sounds/linux.wav'
+        linus = 'tests/sounds/linus.wav'
+        self.cache.read(linux)
+        self.cache.read(linus)
+
+        # Make linux the older of the two and shrink the budget to fit one
+        st = os.stat(path(self.cache, linux))
+        os.utime(path(self.cache, linux), (st.st_atime - 10, st.st_mtime - 10))
+        self.cache.budget = os.stat(path(self.cache, linus)).st_size
+        self.cache.evict()
+
+        self.assertFalse(os.path.exists(path(self.cache, linux)))
+        self.assertTrue(os.path.exists(path(self.cache, linus)))
+
+        # It is decoded again on the next read
+        self.assertTrue(len(SoundCache(prefix=PREFIX).read(linux)) > 0)
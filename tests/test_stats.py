@@ -0,0 +1,92 @@
+from unittest import TestCase
+import time
+from astrid.stats import CallbackStats, LatencyStats
+
+class TestCallbackStats(TestCase):
+    def setUp(self):
+        self.stats = CallbackStats(8)
+        self.stats.set_deadline(64, 48000)
+
+    def test_empty_summary(self):
+        summary = self.stats.summary()
+        self.assertEqual(summary['blocks'], 0)
+        self.assertNotIn('p99_ms', summary)
+        self.assertAlmostEqual(summary['deadline_ms'], 64 / 48)
+
+    def test_records_blocks(self):
+        retired = 0
+        for i in range(4):
+            self.stats.start()
+            retired += i
+            self.stats.stop(i, retired)
+
+        summary = self.stats.summary()
+        self.assertEqual(summary['blocks'], 4)
+        self.assertEqual(summary['voices_max'], 3)
+        self.assertEqual(summary['voices_mean'], 1.5)
+        self.assertEqual(summary['retired'], 6)
+        self.assertEqual(summary['over_deadline'], 0)
+        self.assertLessEqual(summary['p50_ms'], summary['max_ms'])
+
+    def test_window_wraps(self):
+        for i in range(20):
+            self.stats.start()
+            self.stats.stop(i, 0)
+
+        summary = self.stats.summary()
+        self.assertEqual(summary['blocks'], 20)
+        self.assertEqual(summary['window'], 8)
+        self.assertEqual(summary['voices_max'], 19)
+        self.assertEqual(summary['voices_mean'], 15.5)
+
+    def test_over_deadline(self):
+        self.stats.start()
+        time.sleep(0.005)
+        self.stats.stop(1, 0)
+        summary = self.stats.summary()
+        self.assertEqual(summary['over_deadline'], 1)
+        self.assertGreater(summary['max_ms'], summary['deadline_ms'])
+
+    def test_xruns(self):
+        self.stats.xrun(1500)
+        self.stats.xrun(500)
+        summary = self.stats.summary()
+        self.assertEqual(summary['xruns'], 2)
+        self.assertEqual(summary['xrun_delay_ms'], 2)
+
+class TestLatencyStats(TestCase):
+    def trace(self, instrument, offset=0):
+        stages = ['received', 'dequeued', 'started', 'render_start', 'rendered', 'shared', 'buffered', 'first_out']
+        trace = {'id': 0, 'instrument': instrument}
+        for i, stage in enumerate(stages):
+            trace[stage] = offset + i * 0.001
+        return trace
+
+    def test_spans(self):
+        latency = LatencyStats()
+        latency.add(self.trace('a'))
+        latency.add(self.trace('a', 10))
+        latency.add(self.trace('b'))
+
+        summary = latency.summary()
+        self.assertEqual(summary['a']['count'], 2)
+        self.assertAlmostEqual(summary['a']['render']['mean'], 1)
+        self.assertAlmostEqual(summary['a']['total']['max'], 7)
+        self.assertEqual(list(latency.summary('b').keys()), ['b'])
+
+    def test_missing_stages_are_skipped(self):
+        latency = LatencyStats()
+        trace = self.trace('a')
+        del trace['shared']
+        latency.add(trace)
+
+        spans = latency.summary()['a']
+        self.assertNotIn('share', spans)
+        self.assertNotIn('transfer', spans)
+        self.assertIn('mix', spans)
+
+    def test_keeps_latest(self):
+        latency = LatencyStats(size=2)
+        for i in range(5):
+            latency.add(self.trace('a', i))
+        self.assertEqual(latency.summary()['a']['count'], 2)
@@ -0,0 +1,260 @@
+from unittest import TestCase
+import logging
+import os
+import queue
+import tempfile
+
+import msgpack
+import redis
+
+from astrid import names
+from astrid import orc
+from astrid.orc import session_params
+from astrid.voices import ControlSubscriber, RendererRouter, VoiceHandler, VoicePool
+
+class TestRendererRouter(TestCase):
+    def setUp(self):
+        self.router = RendererRouter(4)
+
+    def tearDown(self):
+        for play_q in self.router.play_qs:
+            while not play_q.empty():
+                play_q.get()
+
+    def test_least_busy(self):
+        self.router.loaded('a')
+        self.router.active[0] = 3
+        self.router.active[1] = 1
+        self.router.active[2] = 2
+        self.router.active[3] = 5
+        self.assertEqual(self.router.route(['a']), 1)
+
+    def test_prefers_warm_renderers(self):
+        self.router.warm['a'] = set([2])
+        self.router.active[2] = 1
+        self.assertEqual(self.router.route(['a']), 2)
+
+        # Until the warm one is too busy
+        self.router.active[2] = 3
+        self.assertEqual(self.router.route(['a']), 0)
+
+    def test_queued_plays_count(self):
+        self.router.loaded('a')
+        self.assertEqual(sorted([ self.router.route(['a']) for _ in range(4) ]), [0, 1, 2, 3])
+
+        # The renderer took its play from the queue and started a voice
+        self.router.taken[0] += 1
+        self.router.active[0] += 1
+        self.assertEqual(self.router.load(0), 1)
+
+    def test_pinned(self):
+        self.router.loaded('a')
+        self.router.pin('a', [2, 3])
+        self.router.active[2] = 1
+        self.assertEqual(self.router.route(['a']), 3)
+        self.router.pin('a')
+        self.assertEqual(self.router.route(['a']), 0)
+
+
+class Renderer:
+    pass
+
+class Instrument:
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.renderer = Renderer()
+        for k, v in attrs.items():
+            setattr(self.renderer, k, v)
+
+class Context:
+    def __init__(self, level, players=None):
+        self.level = level
+        self.players = players or []
+
+def hold(voice):
+    # A voice that runs until it is stopped
+    voice.stop_me.wait(timeout=5)
+
+class TestVoicePool(TestCase):
+    def setUp(self):
+        self.pool = VoicePool(polyphony=3)
+
+    def tearDown(self):
+        self.pool.stop()
+        self.pool.shutdown()
+
+    def test_steal_oldest(self):
+        a = Instrument('a')
+        voices = [ self.pool.start(a, hold) for _ in range(3) ]
+        newest = self.pool.start(a, hold)
+        self.assertTrue(voices[0].stop_me.is_set())
+        self.assertFalse(voices[1].stop_me.is_set())
+        self.assertIn(newest, self.pool.voices)
+        self.assertEqual(len(self.pool), 3)
+
+    def test_steal_quietest(self):
+        a = Instrument('a', STEAL='quietest')
+        voices = [ self.pool.start(a, hold) for _ in range(3) ]
+        for voice, level in zip(voices, (0.5, 0.1, 0.9)):
+            voice.ctx = Context(level)
+
+        self.pool.start(a, hold)
+        self.assertTrue(voices[1].stop_me.is_set())
+        self.assertFalse(voices[0].stop_me.is_set())
+
+    def test_level_of_several_players(self):
+        a = Instrument('a', STEAL='quietest')
+        voices = [ self.pool.start(a, hold) for _ in range(3) ]
+        for voice, level in zip(voices, (0.5, 0.1, 0.3)):
+            voice.ctx = Context(0, [ Context(level), Context(0.2) ])
+
+        self.pool.start(a, hold)
+        self.assertTrue(voices[1].stop_me.is_set())
+        self.assertFalse(voices[2].stop_me.is_set())
+
+    def test_instrument_polyphony(self):
+        a = Instrument('a', POLYPHONY=1)
+        b = Instrument('b')
+        first = self.pool.start(a, hold)
+        other = self.pool.start(b, hold)
+        self.pool.start(a, hold)
+        self.assertTrue(first.stop_me.is_set())
+        self.assertFalse(other.stop_me.is_set())
+
+    def test_finished_voices_are_pruned(self):
+        self.pool.start(Instrument('a'), lambda voice: None)
+        self.pool.shutdown()
+        self.assertEqual(len(self.pool), 0)
+
+    def test_stop_instrument(self):
+        a = self.pool.start(Instrument('a'), hold)
+        b = self.pool.start(Instrument('b'), hold)
+        self.pool.stop('a')
+        self.assertTrue(a.stop_me.is_set())
+        self.assertFalse(b.stop_me.is_set())
+
+class PubSub:
+    """ Yields the given messages, then drops the 
+        connection if told to
+    """
+    def __init__(self, msgs, drop):
+        self.msgs = msgs
+        self.drop = drop
+
+    def listen(self):
+        for channel, data in self.msgs:
+            yield {'type': 'message', 'channel': str(channel).encode(), 'data': data}
+        if self.drop:
+            raise redis.ConnectionError('gone')
+
+    def reset(self):
+        pass
+
+class TestControlSubscriber(TestCase):
+    def setUp(self):
+        self.q = queue.Queue()
+        self.pool = VoicePool(polyphony=4)
+        self.subscriber = ControlSubscriber(self.q, self.pool)
+
+    def tearDown(self):
+        self.pool.stop()
+        self.pool.shutdown()
+
+    def test_stop_instrument(self):
+        a = self.pool.start(Instrument('a'), hold)
+        b = self.pool.start(Instrument('b'), hold)
+        self.assertTrue(self.subscriber.dispatch(names.STOP_INSTRUMENT, b'a'))
+        self.assertTrue(a.stop_me.is_set())
+        self.assertFalse(b.stop_me.is_set())
+
+        self.subscriber.dispatch(names.STOP_ALL_VOICES, str(names.STOP_ALL_VOICES).encode())
+        self.assertTrue(b.stop_me.is_set())
+
+    def test_param_update(self):
+        self.subscriber.dispatch(names.PARAM_UPDATE, msgpack.packb(['test-subscriber-key', '0.5']))
+        self.assertEqual(session_params.values['test-subscriber-key'], '0.5')
+
+    def test_set_log_level(self):
+        self.subscriber.dispatch(names.SET_LOG_LEVEL, msgpack.packb(['test-subscriber', 'debug']))
+        self.assertEqual(logging.getLogger('astrid.test-subscriber').level, logging.DEBUG)
+
+    def test_load_and_shutdown(self):
+        self.subscriber.dispatch(names.LOAD_INSTRUMENT, b'a')
+        self.assertEqual(self.q.get_nowait(), (names.LOAD_INSTRUMENT, ('a', None)))
+        self.assertFalse(self.subscriber.dispatch(names.SHUTDOWN, b'8'))
+
+    def test_resubscribe_after_disconnect(self):
+        update = (names.PARAM_UPDATE, msgpack.packb(['test-subscriber-dropped', '1']))
+        self.subscriber.subscribe = lambda: PubSub([
+            (names.LOAD_INSTRUMENT, b'a'), 
+            (names.SHUTDOWN, b'8'),
+        ], False)
+
+        self.subscriber.listen(PubSub([update], True))
+
+        # Params cached before the drop are forgotten
+        self.assertNotIn('test-subscriber-dropped', session_params.values)
+        self.assertEqual(self.q.get_nowait(), (names.LOAD_INSTRUMENT, ('a', None)))
+
+
+class TestLoadStatus(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.status_q = queue.Queue()
+        self.handler = VoiceHandler(3, None, self.status_q, None, None, self.dir.name, None, None, None)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, name, source):
+        path = os.path.join(self.dir.name, '%s.py' % name)
+        with open(path, 'w') as f:
+            f.write(source)
+        return path
+
+    def test_load_reports_success(self):
+        path = self.write('good', 'VALUE = 1\n')
+        self.assertIsNotNone(self.handler.load_instrument('good', path, None))
+        self.assertEqual(self.status_q.get_nowait(), (names.LOAD_INSTRUMENT, 3, 'good', None))
+
+    def test_load_reports_errors(self):
+        path = self.write('bad', 'raise ValueError("nope")\n')
+        self.handler.load_instrument('bad', path, None)
+        kind, renderer, name, error = self.status_q.get_nowait()
+        self.assertEqual(error, 'nope')
+
+    def test_warm_up_preloads_and_reports_ready(self):
+        os.makedirs(os.path.join(self.dir.name, names.ORC_DIR))
+        self.write(os.path.join(names.ORC_DIR, 'one'), 'VALUE = 1\n')
+        self.write(os.path.join(names.ORC_DIR, 'two'), 'VALUE = 2\n')
+
+        self.handler.preload = ['one', 'two']
+        self.handler.warm_up()
+
+        loads = [ self.status_q.get_nowait() for _ in range(2) ]
+        self.assertEqual([ l[2] for l in loads ], ['one', 'two'])
+        self.assertTrue(all([ l[3] is None for l in loads ]))
+
+        kind, renderer, timings = self.status_q.get_nowait()
+        self.assertEqual(kind, names.RENDERER_READY)
+        self.assertEqual(renderer, 3)
+        self.assertIn('pippi', timings)
+        self.assertIn('one', timings['instruments'])
+        self.assertGreaterEqual(timings['total'], timings['instruments']['one'])
+        self.assertEqual(sorted(self.handler.instruments.keys()), ['one', 'two'])
+
+    def test_only_the_first_renderer_listens(self):
+        os.makedirs(os.path.join(self.dir.name, names.ORC_DIR))
+        self.write(os.path.join(names.ORC_DIR, 'one'), 'VALUE = 1\n')
+
+        listening = []
+        start_listener = orc.midi.start_listener
+        orc.midi.start_listener = lambda instrument: listening.append(instrument.name)
+        try:
+            for i in range(3):
+                handler = VoiceHandler(i, None, self.status_q, None, None, self.dir.name, None, None, None, preload=['one'])
+                handler.warm_up()
+        finally:
+            orc.midi.start_listener = start_listener
+
+        self.assertEqual(listening, ['one'])